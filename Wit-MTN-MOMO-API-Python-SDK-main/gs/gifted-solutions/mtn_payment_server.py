@@ -219,4 +219,7 @@ if __name__ == '__main__':
     print("Health check: http://localhost:5000/api/health")
     print("Press Ctrl+C to stop the server")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    # serve.py lives at the repository root
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
+    from serve import run_server
+    run_server('sdk.mtn_payment_server', app)
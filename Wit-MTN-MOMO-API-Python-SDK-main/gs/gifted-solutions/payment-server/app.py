@@ -4,6 +4,7 @@ import sys
 import os
 import json
 import uuid
+import threading
 from datetime import datetime
 
 # Add the parent directory to the path to import the PayClass
@@ -13,8 +14,42 @@ from pay import PayClass
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+class TransactionIndex:
+    """In-memory transactions with order ID and phone indexes kept up to date on write"""
+
+    def __init__(self):
+        self.transactions = {}
+        self.by_order = {}
+        self.by_phone = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.transactions
+
+    def __getitem__(self, transaction_id):
+        return self.transactions[transaction_id]
+
+    def values(self):
+        return list(self.transactions.values())
+
+    def add(self, transaction):
+        """Store a transaction; a retried order points at its newest attempt"""
+        transaction_id = transaction['transaction_id']
+        with self.lock:
+            self.transactions[transaction_id] = transaction
+            self.by_order[transaction['order_id']] = transaction_id
+            self.by_phone.setdefault(transaction['phone_number'], []).append(transaction_id)
+
+    def for_order(self, order_id):
+        transaction_id = self.by_order.get(order_id)
+        return self.transactions.get(transaction_id) if transaction_id else None
+
+    def for_phone(self, phone_number):
+        return [self.transactions[transaction_id]
+                for transaction_id in self.by_phone.get(phone_number, ())]
+
 # Store payment transactions in memory (in production, use a database)
-payment_transactions = {}
+payment_transactions = TransactionIndex()
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -61,7 +96,7 @@ def initiate_payment():
         
         # Store transaction details
         transaction_id = payment_result['ref']
-        payment_transactions[transaction_id] = {
+        payment_transactions.add({
             'transaction_id': transaction_id,
             'order_id': order_id,
             'amount': amount,
@@ -71,7 +106,7 @@ def initiate_payment():
             'status': 'PENDING',
             'created_at': datetime.now().isoformat(),
             'response_code': payment_result['response']
-        }
+        })
         
         # Check if payment was initiated successfully
         if payment_result['response'] in [200, 202]:
@@ -136,11 +171,7 @@ def get_payment_status(order_id):
     """Get payment status by order ID"""
     try:
         # Find transaction by order_id
-        transaction = None
-        for txn_id, txn_data in payment_transactions.items():
-            if txn_data['order_id'] == order_id:
-                transaction = txn_data
-                break
+        transaction = payment_transactions.for_order(order_id)
         
         if not transaction:
             return jsonify({
@@ -164,6 +195,24 @@ def get_payment_status(order_id):
             'error': f'Failed to get payment status: {str(e)}'
         }), 500
 
+@app.route('/api/payment/customer/<phone_number>', methods=['GET'])
+def get_customer_payments(phone_number):
+    """Get all payments made from one phone number"""
+    try:
+        transactions = payment_transactions.for_phone(phone_number)
+        return jsonify({
+            'success': True,
+            'phone_number': phone_number,
+            'transactions': transactions,
+            'count': len(transactions)
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get customer payments: {str(e)}'
+        }), 500
+
 @app.route('/api/payment/transactions', methods=['GET'])
 def get_all_transactions():
     """Get all payment transactions (for admin/debugging)"""
@@ -186,6 +235,10 @@ if __name__ == '__main__':
     print("   - POST /api/payment/initiate")
     print("   - GET /api/payment/verify/<transaction_id>")
     print("   - GET /api/payment/status/<order_id>")
+    print("   - GET /api/payment/customer/<phone_number>")
     print("   - GET /api/health")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    # serve.py lives at the repository root
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', '..'))
+    from serve import run_server
+    run_server('sdk.payment_server', app)
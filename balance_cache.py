@@ -0,0 +1,138 @@
+"""
+Cached MTN MOMO account balances
+A balance is fetched at most once per TTL per account; concurrent callers
+during a fetch wait for that one upstream call instead of making their own.
+Transfers and successful collections invalidate the affected account.
+
+Settings (environment):
+    BALANCE_CACHE_TTL   seconds a fetched balance is served, default 10
+"""
+
+import os
+import time
+import threading
+
+from server_metrics import registry
+
+BALANCE_TTL = float(os.environ.get('BALANCE_CACHE_TTL', 10))
+ACCOUNTS = ('collections', 'disbursements')
+
+LOOKUPS = registry.counter('balance_cache_lookups_total', 'Balance lookups by cache outcome',
+                           ('account', 'result'))
+
+class _Fetch:
+    """One upstream balance call that concurrent callers wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class BalanceCache:
+    """Short-TTL cache with request coalescing for one account's balance"""
+
+    def __init__(self, account, fetch, ttl=None):
+        self.account = account
+        self.fetch = fetch
+        self.ttl = BALANCE_TTL if ttl is None else ttl
+        self.value = None
+        self.fetched_at = 0.0
+        self.generation = 0
+        self._fetching = None
+        self._lock = threading.Lock()
+
+    def get(self, refresh=False):
+        """(balance, age in seconds); refresh skips the cached value but still coalesces"""
+        with self._lock:
+            age = time.monotonic() - self.fetched_at
+            if not refresh and self.value is not None and age < self.ttl:
+                LOOKUPS.inc(account=self.account, result='hit')
+                return self.value, age
+            pending = self._fetching
+            if pending is None:
+                pending = self._fetching = _Fetch()
+                generation = self.generation
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            LOOKUPS.inc(account=self.account, result='coalesced')
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value, 0.0
+
+        LOOKUPS.inc(account=self.account, result='miss')
+        try:
+            pending.value = self.fetch()
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                # A balance fetched across an invalidation may predate the transfer
+                if pending.error is None and generation == self.generation and is_balance(pending.value):
+                    self.value = pending.value
+                    self.fetched_at = time.monotonic()
+                self._fetching = None
+            pending.done.set()
+        return pending.value, 0.0
+
+    def invalidate(self):
+        with self._lock:
+            self.value = None
+            self.generation += 1
+
+def is_balance(result):
+    """Only real balances are cached, never gateway error bodies"""
+    return isinstance(result, dict) and 'availableBalance' in result
+
+def _fetcher(tenant, account):
+    def fetch():
+        from momo_client import client_for
+        client = client_for(tenant)
+        return client.momobalance() if account == 'collections' else client.momobalancedisbursement()
+    return fetch
+
+caches = {}
+_caches_lock = threading.Lock()
+
+def cache_for(account, tenant=None):
+    """The balance cache of one tenant's account"""
+    key = (tenant, account)
+    cache = caches.get(key)
+    if cache is None:
+        with _caches_lock:
+            cache = caches.get(key)
+            if cache is None:
+                cache = caches[key] = BalanceCache(account, _fetcher(tenant, account))
+    return cache
+
+def balance(account, refresh=False, tenant=None):
+    """Cached balance of 'collections' or 'disbursements' as (balance, age)"""
+    return cache_for(account, tenant).get(refresh)
+
+def balance_response(args, tenant=None):
+    """Flask response with the requested balances (?account=, ?refresh=1) and cache headers"""
+    from flask import jsonify
+
+    account = args.get('account')
+    if account is not None and account not in ACCOUNTS:
+        raise ValueError(f'account must be one of {", ".join(ACCOUNTS)}')
+    refresh = args.get('refresh') in ('1', 'true')
+    balances = {}
+    oldest = 0.0
+    for name in ([account] if account else ACCOUNTS):
+        result, age = balance(name, refresh, tenant)
+        balances[name] = dict(result, age_seconds=round(age, 1)) if is_balance(result) else result
+        oldest = max(oldest, age)
+    response = jsonify({'success': all(is_balance(b) for b in balances.values()), 'balances': balances})
+    response.headers['Cache-Control'] = f'private, max-age={max(0, int(BALANCE_TTL - oldest))}'
+    return response
+
+def invalidate_balance(account, tenant=None):
+    """Drop a cached balance after money moved on that account (tenant None: every tenant's)"""
+    for (cached_tenant, cached_account), cache in list(caches.items()):
+        if cached_account == account and tenant in (None, cached_tenant):
+            cache.invalidate()
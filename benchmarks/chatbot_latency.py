@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Chatbot latency benchmark for Gifted Solutions
+Builds synthetic knowledge bases of growing size, runs every matcher of the
+chatbot engine in-process (and optionally live servers over HTTP), and
+reports latency percentiles, memory footprint and index build time, both for
+indexes built in the process and loaded from the shared knowledge snapshot.
+
+Usage:
+    python benchmarks/chatbot_latency.py --sizes 10,100,1000,10000
+    python benchmarks/chatbot_latency.py --sizes 100000 --matchers inverted,tfidf
+    python benchmarks/chatbot_latency.py --http http://localhost:5001 --output run.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import urllib.request
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from chatbot_engine import ChatbotConfig, ChatbotEngine, MATCHERS
+from chatbot_snapshot import KnowledgeSnapshot
+
+BUDGET_MS = 50.0
+CATEGORIES = ['products', 'services', 'contact', 'account', 'tracking',
+              'payment', 'delivery', 'returns', 'warranty', 'business']
+VOCABULARY = [
+    'arduino', 'uno', 'nano', 'mega', 'esp32', 'sensor', 'ultrasonic', 'breadboard',
+    'resistor', 'led', 'motor', 'servo', 'relay', 'battery', 'charger', 'cable',
+    'laptop', 'phone', 'gift', 'hamper', 'custom', 'engraving', 'project', 'consultation',
+    'delivery', 'shipping', 'lusaka', 'kitwe', 'order', 'track', 'status', 'payment',
+    'momo', 'mtn', 'airtel', 'refund', 'return', 'warranty', 'repair', 'price',
+    'discount', 'bulk', 'wholesale', 'account', 'login', 'password', 'register',
+    'contact', 'whatsapp', 'hours', 'weekend', 'pickup', 'stock', 'available',
+    'kit', 'starter', 'robotics', 'school', 'student', 'training', 'install',
+]
+FILLER = ['do', 'you', 'have', 'how', 'can', 'i', 'what', 'is', 'the', 'my', 'a', 'for']
+
+# Matcher settings of each chatbot front end
+PROFILES = {
+    'chatbot_ai_server': {'question_weight': 0.6, 'keyword_weight': 0.4, 'threshold': 0.3},
+    'gs/ai_chatbot_server': {'question_weight': 0.5, 'keyword_weight': 0.5,
+                             'threshold': 0.25, 'max_confidence': 1.0},
+    'simple_ai_server': {'question_weight': 0.6, 'keyword_weight': 0.4, 'threshold': 0.3},
+}
+
+def synthetic_knowledge(size, rng):
+    """Knowledge base entries built from a shop-flavoured vocabulary"""
+    entries = []
+    for i in range(size):
+        words = rng.sample(VOCABULARY, rng.randint(3, 7))
+        entries.append({
+            'category': rng.choice(CATEGORIES),
+            'question': ' '.join(rng.sample(FILLER, 2) + words),
+            'answer': f'Synthetic answer {i} about ' + ' '.join(words),
+            'keywords': ','.join(rng.sample(words, min(len(words), rng.randint(2, 5)))),
+            'priority': rng.randint(1, 5)
+        })
+    return entries
+
+def add_typo(word, rng):
+    """Drop, double or swap one character"""
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 1)
+    kind = rng.choice(('drop', 'double', 'swap'))
+    if kind == 'drop':
+        return word[:i] + word[i + 1:]
+    if kind == 'double':
+        return word[:i] + word[i] + word[i:]
+    return word[:i - 1] + word[i] + word[i - 1] + word[i + 1:]
+
+def synthetic_queries(knowledge, count, rng):
+    """Paraphrases of known questions, typo'd variants and unrelated noise"""
+    queries = []
+    for _ in range(count):
+        entry = rng.choice(knowledge)
+        words = entry['question'].split()
+        kind = rng.random()
+        if kind < 0.5:
+            rng.shuffle(words)
+            queries.append(' '.join(words[:rng.randint(2, len(words))]))
+        elif kind < 0.8:
+            queries.append(' '.join(add_typo(word, rng) for word in words))
+        else:
+            queries.append(' '.join(rng.sample(FILLER, 4)) + ' ' + rng.choice(['weather', 'football', 'music']))
+    return queries
+
+def percentiles(samples_ms):
+    """Latency summary in milliseconds"""
+    ordered = sorted(samples_ms)
+    if not ordered:
+        return {}
+
+    def pick(fraction):
+        return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 3)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': pick(0.50),
+        'p90': pick(0.90),
+        'p99': pick(0.99),
+        'max': round(ordered[-1], 3)
+    }
+
+def bench_in_process(size, matchers, profile, query_count, seed):
+    """Seed an engine with a synthetic base and time every matcher on it"""
+    rng = random.Random(seed)
+    knowledge = synthetic_knowledge(size, rng)
+    queries = synthetic_queries(knowledge, query_count, rng)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        config = ChatbotConfig(os.path.join(workdir, 'bench.db'), default_knowledge=knowledge,
+                               retrieval_mode='lexical', snapshot=True, **PROFILES[profile])
+        started = time.perf_counter()
+        engine = ChatbotEngine(config)
+        load_seconds = time.perf_counter() - started
+        entries = engine.load_entries()
+
+        results = []
+        for name, source in ((name, source) for name in matchers for source in ('built', 'snapshot')):
+            tracemalloc.start()
+            started = time.perf_counter()
+            # What a worker holds in its heap: its entries and matcher, or the mapped snapshot's
+            if source == 'built':
+                matcher = engine.build_matcher(engine.load_entries(), name)
+            else:
+                matcher = MATCHERS[name](config)
+                matcher.load(KnowledgeSnapshot(config.snapshot_path))
+            build_ms = (time.perf_counter() - started) * 1000
+            index_bytes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+
+            latencies = []
+            matched = 0
+            for query in queries:
+                started = time.perf_counter()
+                entry, _ = matcher.best_match(engine.make_query(query))
+                latencies.append((time.perf_counter() - started) * 1000)
+                matched += entry is not None
+
+            stats = percentiles(latencies)
+            results.append({
+                'mode': 'in_process',
+                'profile': profile,
+                'matcher': name,
+                'source': source,
+                'entries': len(entries),
+                'build_ms': round(build_ms, 3),
+                'index_kib': round(index_bytes / 1024, 1),
+                'engine_load_s': round(load_seconds, 3),
+                'match_rate': round(matched / max(len(queries), 1), 3),
+                'latency_ms': stats,
+                'within_budget': stats['p99'] <= BUDGET_MS
+            })
+            print(f"{name:>9} {source:>8} {len(entries):>7} entries  build {build_ms:9.1f} ms  "
+                  f"index {index_bytes / 1024:9.1f} KiB  p50 {stats['p50']:8.3f}  "
+                  f"p99 {stats['p99']:8.3f} ms  {'ok' if stats['p99'] <= BUDGET_MS else 'OVER BUDGET'}")
+        return results
+
+def bench_http(url, query_count, seed):
+    """Time /api/chat on a running chatbot server"""
+    rng = random.Random(seed)
+    queries = synthetic_queries(synthetic_knowledge(50, rng), query_count, rng)
+    endpoint = url.rstrip('/') + '/api/chat'
+
+    latencies = []
+    errors = 0
+    for query in queries:
+        body = json.dumps({'message': query, 'session_id': 'benchmark'}).encode('utf-8')
+        request = urllib.request.Request(endpoint, data=body,
+                                         headers={'Content-Type': 'application/json'})
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+        except Exception:
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    stats = percentiles(latencies)
+    print(f"HTTP {url}: p50 {stats.get('p50')} ms  p99 {stats.get('p99')} ms  errors {errors}")
+    return {
+        'mode': 'http',
+        'url': url,
+        'errors': errors,
+        'latency_ms': stats,
+        'within_budget': bool(stats) and stats['p99'] <= BUDGET_MS
+    }
+
+def peak_rss_kib():
+    """Peak resident set size of this process, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KiB
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Chatbot matcher latency benchmark')
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma separated knowledge base sizes (up to 100000)')
+    parser.add_argument('--matchers', default=','.join(MATCHERS),
+                        help='comma separated matcher names')
+    parser.add_argument('--profile', default='chatbot_ai_server', choices=sorted(PROFILES))
+    parser.add_argument('--queries', type=int, default=200, help='queries per run')
+    parser.add_argument('--http', nargs='*', default=[], help='base URLs of running servers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    matchers = [name.strip() for name in args.matchers.split(',') if name.strip()]
+    for name in matchers:
+        if name not in MATCHERS:
+            parser.error(f'unknown matcher {name!r}, choose from {", ".join(MATCHERS)}')
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        print(f"📚 Knowledge base with {size} entries")
+        results.extend(bench_in_process(size, matchers, args.profile, args.queries, args.seed))
+
+    for url in args.http:
+        results.append(bench_http(url, args.queries, args.seed))
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'budget_ms': BUDGET_MS,
+        'peak_rss_kib': peak_rss_kib(),
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+JSON response encoding benchmark for the Flask servers
+Encodes representative payloads of the payment and chatbot endpoints with
+Flask's default provider, with fast_json's provider and, for the large
+arrays, streamed by stream_array, and reports time and size per response.
+
+Usage:
+    python benchmarks/json_responses.py
+    python benchmarks/json_responses.py --repeat 200 --output run.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+import fast_json
+from fast_json import FastJSONProvider, stream_array
+
+WORDS = ['arduino', 'sensor', 'delivery', 'lusaka', 'momo', 'order', 'gift', 'hamper', 'warranty',
+         'refund', 'starter', 'kit', 'robotics', 'battery', 'cable', 'pickup', 'weekend', 'stock']
+
+def transaction(i, rng):
+    created = datetime(2025, 1, 1) + timedelta(minutes=i)
+    return {
+        'transaction_id': str(uuid.UUID(int=rng.getrandbits(128))),
+        'order_id': f'ORD-{100000 + i}',
+        'amount': round(rng.uniform(5, 2000), 2),
+        'currency': 'ZMW',
+        'phone_number': f'26097{rng.randint(1000000, 9999999)}',
+        'customer_name': 'Jane Banda',
+        'status': rng.choice(['initiated', 'pending', 'completed', 'failed']),
+        'created_at': created.isoformat(),
+        'last_verified': (created + timedelta(seconds=30)).isoformat(),
+        'payment_result': {'response': 202, 'ref': str(uuid.UUID(int=rng.getrandbits(128)))}
+    }
+
+def knowledge(i, rng):
+    words = rng.sample(WORDS, 5)
+    return {
+        'id': i,
+        'category': rng.choice(['products', 'delivery', 'payment', 'contact']),
+        'question': 'how do i ' + ' '.join(words),
+        'answer': '🎁 ' + ' '.join(rng.choice(WORDS) for _ in range(40)),
+        'keywords': ','.join(words),
+        'priority': rng.randint(1, 5),
+        'is_active': 1,
+        'created_at': '2025-01-01 10:00:00',
+        'updated_at': '2025-01-02 10:00:00'
+    }
+
+def payloads(rng):
+    """(endpoint, array key, items, other fields) for each representative response"""
+    return [
+        ('POST /api/payment/initiate', None, None, {
+            'success': True, 'transaction_id': str(uuid.uuid4()), 'order_id': 'ORD-100001',
+            'message': 'Payment initiated successfully. Check your phone for MTN MOMO prompt.',
+            'payment_result': {'response': 202, 'ref': str(uuid.uuid4())}, 'reference_id': str(uuid.uuid4())}),
+        ('GET /api/transactions?limit=500', 'transactions', [transaction(i, rng) for i in range(500)],
+         {'success': True, 'count': 500, 'total': 50000, 'next_cursor': '49501'}),
+        ('GET /api/admin/knowledge (1000)', 'knowledge_base', [knowledge(i, rng) for i in range(1000)], {}),
+        ('GET /api/admin/analytics', 'conversations', [{
+            'user_message': 'do you deliver to ' + rng.choice(WORDS), 'bot_response': ' '.join(rng.sample(WORDS, 12)),
+            'response_type': 'knowledge_base', 'timestamp': '2025-01-01T10:00:00',
+            'user_satisfaction': None} for _ in range(100)],
+         {'response_stats': [{'type': 'knowledge_base', 'count': 812}, {'type': 'fallback', 'count': 97}],
+          'popular_queries': [{'query': word, 'frequency': 50 - i} for i, word in enumerate(WORDS)]}),
+    ]
+
+def timed(build, repeat):
+    """Best-of-3 microseconds per response and its size"""
+    best = None
+    size = 0
+    for _ in range(3):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            size = len(build())
+        elapsed = (time.perf_counter() - started) / repeat * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 1), size
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON response encoding benchmark')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    default_app = Flask('default')
+    default_app.json = DefaultJSONProvider(default_app)
+    fast_app = Flask('fast')
+    fast_app.json = FastJSONProvider(fast_app)
+
+    print(f"🧪 JSON backend: {fast_json.BACKEND}")
+    results = []
+    for endpoint, key, items, fields in payloads(random.Random(args.seed)):
+        body = dict({key: items} if key else {}, **fields)
+        row = {'endpoint': endpoint}
+        for name, app in (('flask_default', default_app), ('fast_provider', fast_app)):
+            with app.app_context():
+                row[name] = timed(lambda: app.json.response(body).get_data(), args.repeat)
+        if key:
+            with fast_app.app_context():
+                row['streamed'] = timed(lambda: b''.join(stream_array(key, items, **fields).response),
+                                        args.repeat)
+        results.append(row)
+        speedup = row['flask_default'][0] / row['fast_provider'][0]
+        print(f"⏱️  {endpoint:34} default {row['flask_default'][0]:9.1f} µs {row['flask_default'][1]:8} B | "
+              f"fast {row['fast_provider'][0]:8.1f} µs {row['fast_provider'][1]:8} B ({speedup:.1f}x)"
+              + (f" | streamed {row['streamed'][0]:8.1f} µs" if key else ''))
+
+    if args.output:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'json_backend': fast_json.BACKEND,
+            'results': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Request-building microbenchmark for the MTN MOMO initiate path
+Measures the CPU each requesttopay spends before the network: basic auth,
+headers, payload encoding and the JSON response, comparing the per-call
+construction the servers used to do with MomoClient's prebuilt templates
+(with the stdlib encoder and, when installed, orjson).
+
+Usage:
+    python benchmarks/momo_request_build.py
+    python benchmarks/momo_request_build.py --iterations 200000 --output run.json
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import base64
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import fast_json
+from momo_client import MomoClient
+
+APIUSER = str(uuid.uuid4())
+API_KEY = 'f1db798c98df4bcf83b538175893bbf0'
+SUBKEY = 'dd541a46608d4c04840f45709d89a3b1'
+TOKEN = 'eyJ0eXAiOiJKV1QiLCJhbGciOiJSMjU2In0.' + 'x' * 600
+
+def payment(i):
+    return {
+        'amount': '150.0',
+        'currency': 'EUR',
+        'externalId': f'order-{i}',
+        'payer': {'partyIdType': 'MSISDN', 'partyId': '46733123450'},
+        'payerMessage': f'Payment for order order-{i} by Jane Banda',
+        'payeeNote': f'Payment for order order-{i} by Jane Banda'
+    }
+
+def per_call(i):
+    """What every initiate did before: auth, headers and payload built from scratch"""
+    auth = base64.b64encode(f'{APIUSER}:{API_KEY}'.encode()).decode()
+    token_headers = {'Ocp-Apim-Subscription-Key': SUBKEY, 'Authorization': f'Basic {auth}'}
+    headers = {
+        'X-Reference-Id': str(uuid.uuid4()),
+        'X-Target-Environment': 'sandbox',
+        'Ocp-Apim-Subscription-Key': SUBKEY,
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {TOKEN}'
+    }
+    body = json.dumps(payment(i))
+    response = json.dumps({'success': True, 'transaction_id': str(uuid.uuid4()), 'order_id': f'order-{i}',
+                           'payment_result': {'response': 202, 'ref': headers['X-Reference-Id']}})
+    return token_headers, headers, body, response
+
+def prepared(client):
+    def build(i):
+        reference_id = str(uuid.uuid4())
+        headers, body = client.prepare('collection', payment(i), reference_id)
+        response = fast_json.dumps_bytes({'success': True, 'transaction_id': str(uuid.uuid4()),
+                                          'order_id': f'order-{i}',
+                                          'payment_result': {'response': 202, 'ref': reference_id}})
+        return headers, body, response
+    return build
+
+def cpu_per_call(build, iterations, repeats=5):
+    """Best-of-N CPU microseconds per call"""
+    best = None
+    for _ in range(repeats):
+        started = time.process_time()
+        for i in range(iterations):
+            build(i)
+        elapsed = (time.process_time() - started) / iterations * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='MoMo request-building microbenchmark')
+    parser.add_argument('--iterations', type=int, default=50000)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    client = MomoClient('bench', collections_subkey=SUBKEY, collections_apiuser=APIUSER,
+                        api_key_collections=API_KEY)
+    product = client.products['collection']
+    product.token, product.bearer = TOKEN, 'Bearer ' + TOKEN
+    product.expires_at = float('inf')
+
+    results = {'per_call': cpu_per_call(per_call, args.iterations)}
+    orjson = fast_json.orjson
+    fast_json.orjson = None
+    results['prepared_stdlib'] = cpu_per_call(prepared(client), args.iterations)
+    fast_json.orjson = orjson
+    if orjson is not None:
+        results['prepared_orjson'] = cpu_per_call(prepared(client), args.iterations)
+
+    for name, micros in results.items():
+        print(f"⏱️  {name:16} {micros:8.2f} µs/call  ({results['per_call'] / micros:.2f}x)")
+
+    if args.output:
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': sys.version.split()[0],
+            'json_backend': fast_json.BACKEND,
+            'iterations': args.iterations,
+            'cpu_us_per_call': results
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
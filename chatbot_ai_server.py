@@ -6,178 +6,63 @@ Provides intelligent chatbot responses with admin training capabilities
 
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import json
-import sqlite3
 import datetime
-import re
-from difflib import SequenceMatcher
+from chatbot_engine import ChatbotConfig, ChatbotEngine
+from fast_json import install_json, stream_array
+from http_cache import conditional, install_compression, not_modified, with_validators
+from server_metrics import install_metrics
+from server_logging import get_logger
+
+log = get_logger('chatbot')
 
 app = Flask(__name__)
 CORS(app)
+install_json(app)
+install_compression(app)
+install_metrics(app)
 
 # Configuration
 DATABASE_PATH = 'chatbot_knowledge.db'
 
-class ChatbotAI:
-    def __init__(self):
-        self.init_database()
-        self.load_default_knowledge()
-    
-    def init_database(self):
-        """Initialize the SQLite database for chatbot knowledge"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        # Create tables
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS knowledge_base (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                category TEXT NOT NULL,
-                question TEXT NOT NULL,
-                answer TEXT NOT NULL,
-                keywords TEXT,
-                priority INTEGER DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS website_content (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE NOT NULL,
-                title TEXT,
-                content TEXT,
-                keywords TEXT,
-                last_indexed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                content_hash TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS chat_analytics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_message TEXT NOT NULL,
-                bot_response TEXT NOT NULL,
-                response_type TEXT,
-                user_satisfaction INTEGER,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                session_id TEXT
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS training_data (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                input_text TEXT NOT NULL,
-                expected_output TEXT NOT NULL,
-                category TEXT,
-                admin_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_approved BOOLEAN DEFAULT 0
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-        print("Database initialized successfully")
-    
-    def load_default_knowledge(self):
-        """Load default knowledge base entries"""
-        default_knowledge = [
-            {
-                'category': 'products',
-                'question': 'what products do you offer',
-                'answer': '🛍️ We offer a wide range of products including electronics, project consultation, custom solutions, and premium gifts. Browse our shop or use the search feature to find what you\'re looking for!',
-                'keywords': 'products,electronics,consultation,custom,gifts,shop,catalog',
-                'priority': 5
-            },
-            {
-                'category': 'services',
-                'question': 'project consultation',
-                'answer': '💼 Our project consultation services include:\n• Technical project planning\n• Custom solution development\n• Implementation guidance\n• Ongoing support\n\nContact us at 0779421717 to discuss your project needs!',
-                'keywords': 'consultation,project,technical,planning,development,custom,support',
-                'priority': 5
-            },
-            {
-                'category': 'business',
-                'question': 'about gifted solutions',
-                'answer': '🏢 Gifted Solutions is your premier destination for personalized gifts, tech gadgets, custom services, and project consultation. We combine quality products with expert technical services to meet all your needs.',
-                'keywords': 'about,company,gifted solutions,services,quality,technical',
-                'priority': 4
-            },
-            {
-                'category': 'contact',
-                'question': 'contact information',
-                'answer': '📞 Contact Gifted Solutions:\n• Phone: 0779421717\n• WhatsApp: Available through our cart\n• Business Hours: Monday-Friday, 9AM-6PM\n• We\'re here to help with all your needs!',
-                'keywords': 'contact,phone,whatsapp,hours,support,help',
-                'priority': 4
-            }
-        ]
-        
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        
-        for entry in default_knowledge:
-            cursor.execute('''
-                INSERT OR IGNORE INTO knowledge_base 
-                (category, question, answer, keywords, priority)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (entry['category'], entry['question'], entry['answer'], 
-                  entry['keywords'], entry['priority']))
-        
-        conn.commit()
-        conn.close()
-        print("Default knowledge base loaded")
-    
-    def similarity(self, a, b):
-        """Calculate similarity between two strings"""
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
-    
-    def find_best_response(self, user_message, user_context=None):
-        """Find the best response for user message using AI-like matching"""
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-
-        # Get all knowledge base entries
-        cursor.execute('''
-            SELECT question, answer, keywords, priority, category
-            FROM knowledge_base
-            WHERE is_active = 1
-            ORDER BY priority DESC
-        ''')
-        knowledge_entries = cursor.fetchall()
-        conn.close()
-
-        user_message_lower = user_message.lower()
-        best_match = None
-        best_score = 0
-
-        # Check knowledge base
-        for question, answer, keywords, priority, category in knowledge_entries:
-            # Calculate similarity scores
-            question_similarity = self.similarity(user_message_lower, question.lower())
-            keyword_matches = sum(1 for keyword in keywords.split(',')
-                                if keyword.strip().lower() in user_message_lower)
-            keyword_score = keyword_matches / max(len(keywords.split(',')), 1)
-
-            # Combined score with priority weighting
-            total_score = (question_similarity * 0.6 + keyword_score * 0.4) * (priority / 5.0)
-
-            if total_score > best_score and total_score > 0.3:  # Minimum threshold
-                best_score = total_score
-                best_match = {
-                    'answer': answer,
-                    'category': category,
-                    'confidence': total_score,
-                    'source': 'knowledge_base'
-                }
-
-        return best_match
+DEFAULT_KNOWLEDGE = [
+    {
+        'category': 'products',
+        'question': 'what products do you offer',
+        'answer': '🛍️ We offer a wide range of products including electronics, project consultation, custom solutions, and premium gifts. Browse our shop or use the search feature to find what you\'re looking for!',
+        'keywords': 'products,electronics,consultation,custom,gifts,shop,catalog',
+        'priority': 5
+    },
+    {
+        'category': 'services',
+        'question': 'project consultation',
+        'answer': '💼 Our project consultation services include:\n• Technical project planning\n• Custom solution development\n• Implementation guidance\n• Ongoing support\n\nContact us at 0779421717 to discuss your project needs!',
+        'keywords': 'consultation,project,technical,planning,development,custom,support',
+        'priority': 5
+    },
+    {
+        'category': 'business',
+        'question': 'about gifted solutions',
+        'answer': '🏢 Gifted Solutions is your premier destination for personalized gifts, tech gadgets, custom services, and project consultation. We combine quality products with expert technical services to meet all your needs.',
+        'keywords': 'about,company,gifted solutions,services,quality,technical',
+        'priority': 4
+    },
+    {
+        'category': 'contact',
+        'question': 'contact information',
+        'answer': '📞 Contact Gifted Solutions:\n• Phone: 0779421717\n• WhatsApp: Available through our cart\n• Business Hours: Monday-Friday, 9AM-6PM\n• We\'re here to help with all your needs!',
+        'keywords': 'contact,phone,whatsapp,hours,support,help',
+        'priority': 4
+    }
+]
 
 # Initialize the AI chatbot
-chatbot_ai = ChatbotAI()
+chatbot_ai = ChatbotEngine(ChatbotConfig(
+    DATABASE_PATH,
+    default_knowledge=DEFAULT_KNOWLEDGE,
+    question_weight=0.6,
+    keyword_weight=0.4,
+    threshold=0.3
+))
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -202,7 +87,7 @@ def chat():
             return jsonify({'error': 'Message is required'}), 400
         
         # Get AI response
-        response_data = chatbot_ai.find_best_response(user_message, user_context)
+        response_data = chatbot_ai.respond(user_message, user_context, session_id)
         
         if response_data:
             bot_response = response_data['answer']
@@ -215,18 +100,7 @@ def chat():
             confidence = 0.1
         
         # Log analytics
-        try:
-            conn = sqlite3.connect(DATABASE_PATH)
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO chat_analytics
-                (user_message, bot_response, response_type, session_id)
-                VALUES (?, ?, ?, ?)
-            ''', (user_message, bot_response, response_type, session_id))
-            conn.commit()
-            conn.close()
-        except Exception as e:
-            print(f"Analytics logging error: {str(e)}")
+        chatbot_ai.log_chat(user_message, bot_response, response_type, confidence, session_id)
         
         return jsonify({
             'response': bot_response,
@@ -235,43 +109,19 @@ def chat():
             'timestamp': datetime.datetime.now().isoformat()
         })
 
-    except Exception as e:
-        print(f"Chat error: {str(e)}")
+    except Exception:
+        log.exception('chat_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/knowledge', methods=['GET'])
 def get_knowledge_base():
     """Get all knowledge base entries for admin"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, category, question, answer, keywords, priority,
-                   created_at, updated_at, is_active
-            FROM knowledge_base
-            ORDER BY priority DESC, created_at DESC
-        ''')
-        entries = cursor.fetchall()
-        conn.close()
+        return conditional(*chatbot_ai.table_version('knowledge_base'),
+                           lambda: stream_array('knowledge_base', chatbot_ai.list_knowledge()))
 
-        knowledge_list = []
-        for entry in entries:
-            knowledge_list.append({
-                'id': entry[0],
-                'category': entry[1],
-                'question': entry[2],
-                'answer': entry[3],
-                'keywords': entry[4],
-                'priority': entry[5],
-                'created_at': entry[6],
-                'updated_at': entry[7],
-                'is_active': bool(entry[8])
-            })
-
-        return jsonify({'knowledge_base': knowledge_list})
-
-    except Exception as e:
-        print(f"Get knowledge base error: {str(e)}")
+    except Exception:
+        log.exception('get_knowledge_base_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/knowledge', methods=['POST'])
@@ -288,25 +138,15 @@ def add_knowledge():
         if not all([category, question, answer]):
             return jsonify({'error': 'Category, question, and answer are required'}), 400
 
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO knowledge_base
-            (category, question, answer, keywords, priority)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (category, question, answer, keywords, priority))
-
-        knowledge_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        knowledge_id = chatbot_ai.add_knowledge(category, question, answer, keywords, priority)
 
         return jsonify({
             'message': 'Knowledge entry added successfully',
             'id': knowledge_id
         })
 
-    except Exception as e:
-        print(f"Add knowledge error: {str(e)}")
+    except Exception:
+        log.exception('add_knowledge_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/knowledge/<int:knowledge_id>', methods=['PUT'])
@@ -324,55 +164,39 @@ def update_knowledge(knowledge_id):
         if not all([category, question, answer]):
             return jsonify({'error': 'Category, question, and answer are required'}), 400
 
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            UPDATE knowledge_base
-            SET category = ?, question = ?, answer = ?, keywords = ?,
-                priority = ?, is_active = ?, updated_at = ?
-            WHERE id = ?
-        ''', (category, question, answer, keywords, priority, is_active,
-              datetime.datetime.now(), knowledge_id))
-
-        if cursor.rowcount == 0:
-            conn.close()
+        if not chatbot_ai.update_knowledge(knowledge_id, category, question, answer,
+                                           keywords, priority, is_active):
             return jsonify({'error': 'Knowledge entry not found'}), 404
 
-        conn.commit()
-        conn.close()
-
         return jsonify({'message': 'Knowledge entry updated successfully'})
 
-    except Exception as e:
-        print(f"Update knowledge error: {str(e)}")
+    except Exception:
+        log.exception('update_knowledge_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/knowledge/<int:knowledge_id>', methods=['DELETE'])
 def delete_knowledge(knowledge_id):
     """Delete knowledge base entry"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM knowledge_base WHERE id = ?', (knowledge_id,))
-
-        if cursor.rowcount == 0:
-            conn.close()
+        if not chatbot_ai.delete_knowledge(knowledge_id):
             return jsonify({'error': 'Knowledge entry not found'}), 404
 
-        conn.commit()
-        conn.close()
-
         return jsonify({'message': 'Knowledge entry deleted successfully'})
 
-    except Exception as e:
-        print(f"Delete knowledge error: {str(e)}")
+    except Exception:
+        log.exception('delete_knowledge_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/analytics', methods=['GET'])
 def get_analytics():
     """Get chatbot analytics for admin"""
     try:
-        conn = sqlite3.connect(DATABASE_PATH)
+        version, changed_at = chatbot_ai.table_version('chat_analytics')
+        cached = not_modified(version, changed_at)
+        if cached is not None:
+            return cached
+
+        conn = chatbot_ai.connect()
         cursor = conn.cursor()
 
         # Get recent conversations
@@ -404,7 +228,7 @@ def get_analytics():
 
         conn.close()
 
-        return jsonify({
+        return with_validators(jsonify({
             'conversations': [
                 {
                     'user_message': conv[0],
@@ -420,20 +244,21 @@ def get_analytics():
             'popular_queries': [
                 {'query': query[0], 'frequency': query[1]} for query in popular_queries
             ]
-        })
+        }), version, changed_at)
 
-    except Exception as e:
-        print(f"Get analytics error: {str(e)}")
+    except Exception:
+        log.exception('get_analytics_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/admin/reindex', methods=['POST'])
 def trigger_reindex():
     """Manually trigger website content reindexing"""
     try:
-        return jsonify({'message': 'Website reindexing completed (simplified version)'})
+        chatbot_ai.refresh_indexes()
+        return jsonify({'message': 'Knowledge base reindexing completed'})
 
-    except Exception as e:
-        print(f"Reindex error: {str(e)}")
+    except Exception:
+        log.exception('reindex_failed')
         return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
@@ -441,7 +266,5 @@ if __name__ == '__main__':
     print("🔗 Server will be available at: http://localhost:5001")
     print("📊 Admin panel will be available at: http://localhost:5001/admin")
     
-    # Initial indexing
-    chatbot_ai.index_website_content()
-    
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    from serve import run_server
+    run_server('chatbot_ai_server', app)
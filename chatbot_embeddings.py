@@ -0,0 +1,207 @@
+"""
+Semantic retrieval for the Gifted Solutions chatbot
+Embeds knowledge base entries into an on-disk, memory-mapped vector index.
+Uses a local sentence-transformers model when one is installed, otherwise
+hashed bag-of-features vectors; everything runs offline on the CPU.
+"""
+
+import os
+import glob
+import json
+import uuid
+import zlib
+import hashlib
+import threading
+
+from chatbot_text import tokenize
+from server_logging import get_logger
+
+try:
+    import numpy as np
+except ImportError:  # Semantic mode is optional
+    np = None
+
+log = get_logger('chatbot.embeddings')
+
+HASH_DIMENSIONS = 512
+CHAR_NGRAM = 3
+
+def semantic_available():
+    """Semantic retrieval needs numpy for the vector math"""
+    return np is not None
+
+class HashingEmbedder:
+    """Feature-hashed vectors of word stems and character trigrams"""
+
+    def __init__(self, dimensions=HASH_DIMENSIONS):
+        self.dimensions = dimensions
+        self.name = f'hashing-{dimensions}'
+
+    def features(self, text):
+        """Weighted features for a piece of text"""
+        tokens = tokenize(text)
+        for token in tokens:
+            yield 'w:' + token, 1.0
+            padded = '#' + token + '#'
+            for i in range(len(padded) - CHAR_NGRAM + 1):
+                yield 'c:' + padded[i:i + CHAR_NGRAM], 0.5
+        for first, second in zip(tokens, tokens[1:]):
+            yield 'b:' + first + ' ' + second, 0.5
+
+    def embed(self, texts):
+        """Return an L2 normalized float32 matrix, one row per text"""
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self.features(text):
+                # crc32 is stable across processes, unlike hash()
+                bucket = zlib.crc32(feature.encode('utf-8'))
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                matrix[row, bucket % self.dimensions] += sign * weight
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+class SentenceTransformerEmbedder:
+    """Small local embedding model, loaded from the on-disk model cache only"""
+
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu', local_files_only=True)
+        self.name = 'st:' + model_name
+
+    def embed(self, texts):
+        """Return an L2 normalized float32 matrix, one row per text"""
+        vectors = self.model.encode(list(texts), normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+def load_embedder(model_name=None):
+    """Pick the local model when configured and installed, else hashing"""
+    model_name = model_name or os.environ.get('CHATBOT_EMBEDDING_MODEL')
+    if model_name:
+        try:
+            return SentenceTransformerEmbedder(model_name)
+        except Exception as e:
+            log.warning('embedding_model_unavailable', model=model_name, error=str(e),
+                        fallback='hashing')
+    return HashingEmbedder()
+
+def entry_text(question, keywords, category):
+    """Text that represents a knowledge base entry in vector space"""
+    return ' '.join(part for part in (question, (keywords or '').replace(',', ' '), category) if part)
+
+class VectorIndex:
+    """Memory-mapped matrix of entry embeddings with brute-force search
+
+    The row metadata lives in <path>.json and names the matrix file
+    (<path>.<generation>.npy) it belongs to, so replacing the metadata swaps
+    ids and rows together for every worker. On rebuild, rows for entries
+    whose text did not change are copied from the previous matrix, so only
+    new or edited entries are embedded.
+    """
+
+    def __init__(self, path, embedder=None):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.matrix_file = None
+        self.embedder = embedder or load_embedder()
+        self.ids = []
+        self.hashes = []
+        self.matrix = None
+        self._snapshot = ([], None)
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """Map the index files written by the last rebuild, if compatible"""
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            if meta.get('embedder') != self.embedder.name or 'matrix' not in meta:
+                return False
+            matrix = np.load(os.path.join(os.path.dirname(self.meta_path), meta['matrix']), mmap_mode='r')
+        except (OSError, ValueError):
+            return False
+        if matrix.shape[0] != len(meta['ids']):
+            log.warning('vector_index_mismatch', rows=matrix.shape[0], ids=len(meta['ids']))
+            return False
+
+        self.ids, self.hashes, self.matrix = meta['ids'], meta['hashes'], matrix
+        self.matrix_file = meta['matrix']
+        self._snapshot = (self.ids, self.matrix)
+        return True
+
+    def rebuild(self, entries):
+        """Rewrite the index from (id, text) pairs of the active entries"""
+        with self._lock:
+            previous = {}
+            if self.matrix is not None:
+                for row, (entry_id, digest) in enumerate(zip(self.ids, self.hashes)):
+                    previous[(entry_id, digest)] = row
+
+            ids, hashes, texts, pending = [], [], [], []
+            for entry_id, text in entries:
+                ids.append(entry_id)
+                hashes.append(hashlib.sha1(text.encode('utf-8')).hexdigest())
+                texts.append(text)
+                if (entry_id, hashes[-1]) not in previous:
+                    pending.append(len(ids) - 1)
+
+            fresh = self.embedder.embed([texts[i] for i in pending]) if pending else None
+            if fresh is not None:
+                dimensions = fresh.shape[1]
+            elif self.matrix is not None:
+                dimensions = self.matrix.shape[1]
+            else:
+                dimensions = HASH_DIMENSIONS
+
+            matrix = np.zeros((len(ids), dimensions), dtype=np.float32)
+            for row in range(len(ids)):
+                old_row = previous.get((ids[row], hashes[row]))
+                if old_row is not None:
+                    matrix[row] = self.matrix[old_row]
+            if pending:
+                matrix[pending] = fresh
+
+            # A new matrix file, then one metadata swap that points readers at it
+            matrix_path = f'{self.path}.{uuid.uuid4().hex[:12]}.npy'
+            np.save(matrix_path, matrix)
+            meta_tmp = f'{self.meta_path}.{os.getpid()}.tmp'
+            with open(meta_tmp, 'w') as f:
+                json.dump({'embedder': self.embedder.name, 'matrix': os.path.basename(matrix_path),
+                           'ids': ids, 'hashes': hashes}, f)
+            os.replace(meta_tmp, self.meta_path)
+
+            previous_file = self.matrix_file
+            self.ids, self.hashes = ids, hashes
+            self.matrix = np.load(matrix_path, mmap_mode='r')
+            self.matrix_file = os.path.basename(matrix_path)
+            self._remove_stale(keep=(self.matrix_file, previous_file))
+            # Searches read ids and matrix through one reference swap
+            self._snapshot = (self.ids, self.matrix)
+            return len(pending)
+
+    def _remove_stale(self, keep):
+        """Delete matrix files older than the current and previous generation"""
+        # The previous one stays for workers that read the old metadata a moment ago
+        for stale in glob.glob(glob.escape(self.path) + '.*.npy'):
+            if os.path.basename(stale) not in keep:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass  # still mapped on Windows; removed by a later rebuild
+
+    def search(self, text, top_k=1):
+        """Return (entry_id, cosine similarity) pairs for the nearest entries"""
+        ids, matrix = self._snapshot
+        if matrix is None or not ids:
+            return []
+
+        query = self.embedder.embed([text])[0]
+        scores = matrix @ query
+        top_k = min(top_k, len(ids))
+        if top_k < len(ids):
+            rows = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            rows = np.arange(len(ids))
+        rows = rows[np.argsort(-scores[rows])]
+        return [(ids[row], float(scores[row])) for row in rows]
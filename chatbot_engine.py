@@ -0,0 +1,706 @@
+"""
+Chatbot engine for Gifted Solutions
+Knowledge storage, indexing and matching shared by every chatbot server.
+The Flask front ends only supply their default knowledge, settings and routes.
+"""
+
+import os
+import math
+import time
+import sqlite3
+import datetime
+import threading
+from difflib import SequenceMatcher
+
+from chatbot_text import (message_tokens, normalize_keywords,
+                          parse_keyword_tokens, keyword_score, tokenize)
+from chatbot_spelling import SpellingCorrector
+from chatbot_embeddings import VectorIndex, entry_text, semantic_available
+from chatbot_sessions import SessionStore, is_follow_up
+from chatbot_snapshot import (SNAPSHOTS_SUPPORTED, KnowledgeSnapshot, file_signature,
+                              publish_lock, snapshot_version, write_snapshot)
+from server_metrics import registry
+from server_logging import get_logger
+
+STAGE_SECONDS = registry.histogram(
+    'chatbot_stage_seconds', 'Time spent in each chatbot engine stage', ('stage',))
+RESPONSES = registry.counter(
+    'chatbot_responses_total', 'Chat turns by response source', ('source',))
+log = get_logger('chatbot.engine')
+
+# Tables whose writes are counted in change_counters
+COUNTED_TABLES = ('knowledge_base', 'chat_analytics')
+# Current time as epoch seconds with sub-second precision, in SQLite
+EPOCH_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+class ChatbotConfig:
+    """Settings that used to differ between the copy-pasted chatbot servers"""
+
+    def __init__(self, database_path, default_knowledge=(), question_weight=0.6,
+                 keyword_weight=0.4, threshold=0.3, max_confidence=None, matcher=None,
+                 retrieval_mode=None, semantic_threshold=None, max_sessions=None,
+                 session_ttl=None, context_boost=0.15, snapshot=None, snapshot_poll=None):
+        self.database_path = database_path
+        self.default_knowledge = default_knowledge
+        self.question_weight = question_weight
+        self.keyword_weight = keyword_weight
+        self.threshold = threshold
+        self.max_confidence = max_confidence
+        # TF-IDF scores the typo-corrected stems; difflib and inverted remain selectable
+        self.matcher = matcher or os.environ.get('CHATBOT_MATCHER', 'tfidf')
+        # Retrieval mode: 'lexical' (matcher only) or 'semantic' (vector index first)
+        self.retrieval_mode = retrieval_mode or os.environ.get('CHATBOT_RETRIEVAL_MODE', 'lexical')
+        if semantic_threshold is None:
+            semantic_threshold = float(os.environ.get('CHATBOT_SEMANTIC_THRESHOLD', '0.45'))
+        self.semantic_threshold = semantic_threshold
+        self.vector_index_path = database_path + '.vectors'
+        self.max_sessions = max_sessions or int(os.environ.get('CHATBOT_MAX_SESSIONS', '10000'))
+        self.session_ttl = session_ttl or int(os.environ.get('CHATBOT_SESSION_TTL', '1800'))
+        self.context_boost = context_boost
+        # Workers share a compiled, memory-mapped snapshot of the knowledge index
+        if snapshot is None:
+            snapshot = os.environ.get('CHATBOT_SNAPSHOT', '1') != '0'
+        # Publishing replaces a file every worker has mapped, which Windows refuses
+        self.snapshot_path = database_path + '.snapshot' if snapshot and SNAPSHOTS_SUPPORTED else None
+        if snapshot_poll is None:
+            snapshot_poll = float(os.environ.get('CHATBOT_SNAPSHOT_POLL', '0.5'))
+        self.snapshot_poll = snapshot_poll
+
+class KnowledgeEntry:
+    """An active knowledge base row, compiled for matching"""
+
+    __slots__ = ('id', 'category', 'question', 'answer', 'keywords', 'keyword_tokens',
+                 'keyword_phrases', 'priority', 'question_lower', 'tokens')
+
+    def __init__(self, entry_id, category, question, answer, keywords, keyword_tokens, priority):
+        self.id = entry_id
+        self.category = category
+        self.question = question
+        self.answer = answer
+        self.keywords = keywords
+        self.keyword_tokens = keyword_tokens
+        self.keyword_phrases = parse_keyword_tokens(keyword_tokens)
+        self.priority = priority
+        self.question_lower = question.lower()
+        # Question stems plus keyword stems, used by the index based matchers
+        self.tokens = tokenize(question) + (keyword_tokens or '').replace(',', ' ').split()
+
+class Query:
+    """A user message, tokenized once per request"""
+
+    __slots__ = ('text', 'text_lower', 'tokens', 'boosts')
+
+    def __init__(self, text, tokens, boosts=None, text_lower=None):
+        self.text = text
+        # Typo-corrected when the spelling step changed anything, for difflib similarity
+        self.text_lower = text_lower or text.lower()
+        self.tokens = tokens
+        self.boosts = boosts or {}
+
+class Matcher:
+    """Scores every entry: string similarity plus keyword overlap (legacy)"""
+
+    name = 'difflib'
+
+    def __init__(self, config):
+        self.config = config
+        self.entries = ()
+
+    def build(self, entries):
+        """Prepare for matching against entries (sorted by priority)"""
+        self.entries = tuple(entries)
+
+    def load(self, snapshot):
+        """Prepare for matching against a compiled KnowledgeSnapshot instead of building"""
+        self.entries = tuple(snapshot.entries)
+
+    def candidates(self, query):
+        """Entries worth scoring for this query, in priority order"""
+        return self.entries
+
+    def text_similarity(self, query, entry):
+        """How close the message is to the entry's question, 0..1"""
+        return SequenceMatcher(None, query.text_lower, entry.question_lower).ratio()
+
+    def combine(self, query, entry, similarity):
+        """Weighted score with priority scaling and context boost"""
+        keywords_matched = keyword_score(entry.keyword_phrases, query.tokens)
+        total_score = (similarity * self.config.question_weight +
+                       keywords_matched * self.config.keyword_weight) * (entry.priority / 5.0)
+        return total_score + query.boosts.get(entry.category, 0)
+
+    def best_match(self, query):
+        """Return (entry, score) for the best entry above threshold, or (None, 0)"""
+        best_entry, best_score = None, 0
+        for entry in self.candidates(query):
+            score = self.combine(query, entry, self.text_similarity(query, entry))
+            if score > best_score and score > self.config.threshold:
+                best_entry, best_score = entry, score
+        return best_entry, best_score
+
+class InvertedIndexMatcher(Matcher):
+    """Legacy scoring, but only for entries sharing a token with the message
+
+    Entries with no token in common (and not boosted by context) are skipped,
+    so the difflib cost scales with the candidates instead of the whole base.
+    """
+
+    name = 'inverted'
+
+    def build(self, entries):
+        self.entries = tuple(entries)
+        self.postings = {}
+        self.by_category = {}
+        for position, entry in enumerate(self.entries):
+            for token in set(entry.tokens):
+                self.postings.setdefault(token, []).append(position)
+            self.by_category.setdefault(entry.category, []).append(position)
+
+    def load(self, snapshot):
+        super().load(snapshot)
+        self.postings = snapshot.postings
+        self.by_category = snapshot.by_category
+
+    def candidate_positions(self, query):
+        """Sorted entry positions reachable from the query tokens or boosts"""
+        positions = set()
+        for token in query.tokens:
+            positions.update(self.postings.get(token, ()))
+        for category in query.boosts:
+            positions.update(self.by_category.get(category, ()))
+        return sorted(positions)
+
+    def candidates(self, query):
+        return [self.entries[position] for position in self.candidate_positions(query)]
+
+class TfidfMatcher(InvertedIndexMatcher):
+    """Replaces difflib with TF-IDF cosine similarity over entry stems"""
+
+    name = 'tfidf'
+
+    def build(self, entries):
+        super().build(entries)
+        document_count = len(self.entries)
+        self.idf = {token: math.log((document_count + 1) / (len(positions) + 1)) + 1
+                    for token, positions in self.postings.items()}
+
+        # Normalized weight of each posting, aligned with postings[token]
+        self.weights = {token: [] for token in self.postings}
+        for position, entry in enumerate(self.entries):
+            counts = {}
+            for token in entry.tokens:
+                counts[token] = counts.get(token, 0) + 1
+            vector = {token: count * self.idf[token] for token, count in counts.items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            for token, weight in vector.items():
+                self.weights[token].append(weight / norm)
+
+    def load(self, snapshot):
+        super().load(snapshot)
+        self.idf = snapshot.idf
+        self.weights = snapshot.weights
+
+    def best_match(self, query):
+        query_weights = {token: self.idf[token] for token in query.tokens if token in self.idf}
+        norm = math.sqrt(sum(weight * weight for weight in query_weights.values())) or 1.0
+
+        similarities = {}
+        for token, weight in query_weights.items():
+            for position, token_weight in zip(self.postings[token], self.weights[token]):
+                similarities[position] = (similarities.get(position, 0) +
+                                          weight / norm * token_weight)
+
+        best_entry, best_score = None, 0
+        for position in self.candidate_positions(query):
+            entry = self.entries[position]
+            score = self.combine(query, entry, similarities.get(position, 0))
+            if score > best_score and score > self.config.threshold:
+                best_entry, best_score = entry, score
+        return best_entry, best_score
+
+MATCHERS = {matcher.name: matcher for matcher in (Matcher, InvertedIndexMatcher, TfidfMatcher)}
+
+class ChatbotEngine:
+    """SQLite backed knowledge base with in-memory indexes and matching"""
+
+    def __init__(self, config):
+        if config.matcher not in MATCHERS:
+            raise ValueError(f"Unknown chatbot matcher: {config.matcher}")
+
+        self.config = config
+        self.sessions = SessionStore(max_sessions=config.max_sessions,
+                                     ttl_seconds=config.session_ttl)
+        self._refresh_lock = threading.Lock()
+        self._state = ((), Matcher(config), SpellingCorrector(()), {})
+        self._snapshot_version = None
+        self._snapshot_signature = None
+        self._next_snapshot_check = 0.0
+
+        self.init_database()
+        self.load_default_knowledge()
+        self.backfill_keyword_tokens()
+
+        self.vector_index = None
+        if config.retrieval_mode == 'semantic':
+            if semantic_available():
+                self.vector_index = VectorIndex(config.vector_index_path)
+            else:
+                log.warning('semantic_retrieval_unavailable', reason='numpy is not installed',
+                            fallback='lexical')
+        if config.snapshot_path:
+            with self._refresh_lock:
+                self._sync_snapshot()
+        else:
+            self.refresh_indexes()
+
+    def connect(self):
+        """Open a connection to the knowledge database"""
+        return sqlite3.connect(self.config.database_path)
+
+    def table_counter(self, table, conn=None):
+        """(change counter, epoch seconds of the last change) of a counted table"""
+        own = conn is None
+        conn = conn or self.connect()
+        row = conn.execute('SELECT version, changed_at FROM change_counters WHERE name = ?',
+                           (table,)).fetchone()
+        if own:
+            conn.close()
+        return tuple(row)
+
+    def table_version(self, table):
+        """(version tag, epoch seconds of the last change) of a counted table"""
+        counter, changed_at = self.table_counter(table)
+        # The change time tells a recreated database apart from the old one at the same count
+        return f'{table}-{counter}-{changed_at:.6f}', changed_at
+
+    def init_database(self):
+        """Create the chatbot tables and add columns missing from older databases"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS knowledge_base (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                category TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                keywords TEXT,
+                keyword_tokens TEXT,
+                priority INTEGER DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_active BOOLEAN DEFAULT 1
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS website_content (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT UNIQUE NOT NULL,
+                title TEXT,
+                content TEXT,
+                keywords TEXT,
+                last_indexed TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                content_hash TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_analytics (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_message TEXT NOT NULL,
+                bot_response TEXT NOT NULL,
+                response_type TEXT,
+                confidence REAL,
+                user_satisfaction INTEGER,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                session_id TEXT
+            )
+        ''')
+
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS training_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                input_text TEXT NOT NULL,
+                expected_output TEXT NOT NULL,
+                category TEXT,
+                admin_id TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_approved BOOLEAN DEFAULT 0
+            )
+        ''')
+
+        # Change counters behind the admin endpoints' ETags, kept by triggers so
+        # every writer (any worker, any tool) bumps them
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS change_counters (
+                name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0,
+                changed_at REAL NOT NULL
+            )
+        ''')
+        for table in COUNTED_TABLES:
+            cursor.execute(f'INSERT OR IGNORE INTO change_counters (name, changed_at) VALUES (?, {EPOCH_NOW})',
+                           (table,))
+            for action in ('INSERT', 'UPDATE', 'DELETE'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS {table}_{action.lower()}_counter
+                    AFTER {action} ON {table}
+                    BEGIN
+                        UPDATE change_counters SET version = version + 1, changed_at = {EPOCH_NOW}
+                        WHERE name = '{table}';
+                    END
+                ''')
+
+        # Each server used to create a slightly different schema
+        added_columns = {
+            'knowledge_base': [('keyword_tokens', 'TEXT'), ('updated_at', 'TIMESTAMP')],
+            'chat_analytics': [('confidence', 'REAL'), ('user_satisfaction', 'INTEGER')],
+        }
+        for table, columns in added_columns.items():
+            cursor.execute(f'PRAGMA table_info({table})')
+            existing = {column[1] for column in cursor.fetchall()}
+            for column, column_type in columns:
+                if column not in existing:
+                    cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {column_type}')
+
+        conn.commit()
+        conn.close()
+        log.info('chatbot_database_ready', path=self.config.database_path)
+
+    def load_default_knowledge(self):
+        """Seed the default knowledge base into an empty database"""
+        conn = self.connect()
+        cursor = conn.cursor()
+
+        cursor.execute('SELECT COUNT(*) FROM knowledge_base')
+        count = cursor.fetchone()[0]
+
+        if count == 0:
+            for item in self.config.default_knowledge:
+                cursor.execute('''
+                    INSERT INTO knowledge_base
+                    (category, question, answer, keywords, keyword_tokens, priority)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (item['category'], item['question'], item['answer'],
+                      item['keywords'],
+                      normalize_keywords(item['keywords'], item['question']),
+                      item['priority']))
+            log.info('default_knowledge_loaded', entries=len(self.config.default_knowledge))
+
+        conn.commit()
+        conn.close()
+
+    def backfill_keyword_tokens(self):
+        """Normalize keywords written before keyword_tokens existed or under older stemming rules"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT id, question, keywords, keyword_tokens FROM knowledge_base')
+        updates = []
+        for entry_id, question, keywords, stored in cursor.fetchall():
+            tokens = normalize_keywords(keywords, question)
+            if tokens != stored:
+                updates.append((tokens, entry_id))
+        if updates:
+            cursor.executemany('UPDATE knowledge_base SET keyword_tokens = ? WHERE id = ?',
+                               updates)
+            conn.commit()
+        conn.close()
+
+    def load_entries(self):
+        """Read the active entries in matching order"""
+        return self.load_knowledge()[1]
+
+    def load_knowledge(self):
+        """The knowledge_base change counter and the active entries, read in one transaction"""
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN')
+            version = self.table_counter('knowledge_base', conn)
+            cursor = conn.execute('''
+                SELECT id, category, question, answer, keywords, keyword_tokens, priority
+                FROM knowledge_base
+                WHERE is_active = 1
+                ORDER BY priority DESC, id
+            ''')
+            entries = [KnowledgeEntry(*row) for row in cursor.fetchall()]
+        finally:
+            conn.close()
+        return version, entries
+
+    def build_matcher(self, entries, name=None):
+        """Create and build a matcher over entries (used by benchmarks too)"""
+        matcher = MATCHERS[name or self.config.matcher](self.config)
+        matcher.build(entries)
+        return matcher
+
+    def refresh_indexes(self):
+        """Rebuild the in-memory and on-disk indexes after knowledge changes
+
+        With snapshots on, this publishes a new snapshot for every worker and
+        swaps to it; the other workers pick it up on their next check.
+        """
+        with self._refresh_lock, STAGE_SECONDS.time(stage='index_refresh'):
+            if self.config.snapshot_path:
+                self._publish_snapshot()
+                return
+
+            entries = self.load_entries()
+            vocabulary = set()
+            for entry in entries:
+                vocabulary.update(entry.tokens)
+
+            # Requests read the whole state through one reference swap
+            self._state = (entries, self.build_matcher(entries),
+                           SpellingCorrector(vocabulary),
+                           {entry.id: entry for entry in entries})
+            self._rebuild_vector_index(entries)
+
+    def _rebuild_vector_index(self, entries):
+        if self.vector_index is not None:
+            embedded = self.vector_index.rebuild(
+                [(entry.id, entry_text(entry.question, entry.keywords, entry.category))
+                 for entry in entries])
+            log.info('vector_index_refreshed', embedded=embedded, entries=len(entries))
+
+    def _publish_snapshot(self):
+        """Compile the knowledge base into a new snapshot (unless one of this version exists) and load it"""
+        path = self.config.snapshot_path
+        # Whoever holds the lock reads the database after the previous publisher,
+        # so a later file never carries older knowledge
+        with publish_lock(path):
+            version, entries = self.load_knowledge()
+            self._rebuild_vector_index(entries)
+            if snapshot_version(path) != version:
+                with STAGE_SECONDS.time(stage='snapshot_write'):
+                    size = write_snapshot(path, version, entries, self.build_matcher(entries, 'tfidf'))
+                log.info('knowledge_snapshot_published', version=version[0], entries=len(entries),
+                         bytes=size)
+        self._load_snapshot()
+
+    def _load_snapshot(self):
+        """Map the published snapshot and swap the matching state over to it"""
+        snapshot = KnowledgeSnapshot(self.config.snapshot_path)
+        matcher = MATCHERS[self.config.matcher](self.config)
+        matcher.load(snapshot)
+        # Requests read the whole state through one reference swap; those still
+        # running keep the old mapping alive until they finish
+        self._state = (snapshot.entries, matcher, SpellingCorrector(snapshot.vocabulary),
+                       {entry.id: entry for entry in snapshot.entries})
+        self._snapshot_version = snapshot.version
+        self._snapshot_signature = snapshot.signature
+        if self.vector_index is not None:
+            self.vector_index.load()
+        log.info('knowledge_snapshot_loaded', version=snapshot.version[0], entries=len(snapshot.entries))
+
+    def _sync_snapshot(self):
+        """Load the published snapshot if it matches the database, else publish one"""
+        path = self.config.snapshot_path
+        if snapshot_version(path) == self.table_counter('knowledge_base'):
+            self._load_snapshot()
+            if self.vector_index is None or len(self.vector_index.ids) == len(self.entries):
+                return
+        self._publish_snapshot()
+
+    def check_snapshot(self):
+        """Swap to a snapshot another worker published, at most once per poll interval
+
+        Knowledge edited outside the servers (the counter moved but no
+        snapshot followed) gets a snapshot published here.
+        """
+        now = time.monotonic()
+        if now < self._next_snapshot_check or not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._next_snapshot_check = now + self.config.snapshot_poll
+            try:
+                changed = file_signature(self.config.snapshot_path) != self._snapshot_signature
+            except OSError:
+                changed = True
+            if changed or self._snapshot_version != self.table_counter('knowledge_base'):
+                self._sync_snapshot()
+        except Exception:
+            log.exception('knowledge_snapshot_check_failed')
+        finally:
+            self._refresh_lock.release()
+
+    @property
+    def entries(self):
+        return self._state[0]
+
+    @property
+    def matcher(self):
+        return self._state[1]
+
+    def make_query(self, user_message, user_context=None, spelling=None):
+        """Tokenize, typo-correct and attach context boosts to a message"""
+        spelling = spelling or self._state[2]
+        message = message_tokens(user_message)
+        tokens = spelling.expand(message)
+        text_lower = spelling.correct_text(user_message) if tokens is not message else None
+
+        # Follow-ups ("and how do I pay for it?") lean towards recent topics
+        boosts = {}
+        recent_categories = (user_context or {}).get('recent_categories') or ()
+        if recent_categories and is_follow_up(user_message, tokens):
+            for position, category in enumerate(recent_categories):
+                boosts[category] = self.config.context_boost / (position + 1)
+
+        return Query(user_message, tokens, boosts, text_lower)
+
+    def find_semantic_response(self, user_message):
+        """Nearest entry in the vector index, if it is similar enough"""
+        results = self.vector_index.search(user_message, top_k=1)
+        if not results or results[0][1] < self.config.semantic_threshold:
+            return None
+
+        entry_id, score = results[0]
+        entry = self._state[3].get(entry_id)
+        if entry is None:
+            return None
+        return self.response_for(entry, score, 'semantic_index')
+
+    def response_for(self, entry, score, source):
+        """Response dict in the shape the front ends expect"""
+        if self.config.max_confidence is not None:
+            score = min(score, self.config.max_confidence)
+        return {
+            'answer': entry.answer,
+            'category': entry.category,
+            'confidence': score,
+            'source': source
+        }
+
+    def find_best_response(self, user_message, user_context=None):
+        """Find the best response for user message using AI-like matching"""
+        if self.config.snapshot_path:
+            self.check_snapshot()
+        if self.vector_index is not None:
+            semantic_match = self.find_semantic_response(user_message)
+            if semantic_match:
+                return semantic_match
+
+        _, matcher, spelling, _ = self._state
+        entry, score = matcher.best_match(self.make_query(user_message, user_context, spelling))
+        if entry is None:
+            return None
+        return self.response_for(entry, score, 'knowledge_base')
+
+    def respond(self, user_message, user_context=None, session_id='anonymous'):
+        """Answer a chat turn, using and updating the session context"""
+        # Anonymous visitors share an id, so they get no conversation memory
+        if session_id != 'anonymous':
+            with STAGE_SECONDS.time(stage='session_context'):
+                user_context = self.sessions.context_for(session_id, user_context)
+
+        with STAGE_SECONDS.time(stage='match'):
+            response_data = self.find_best_response(user_message, user_context)
+        source = response_data['source'] if response_data else 'fallback'
+        RESPONSES.inc(source=source)
+        log.debug('chat_turn', sample=0.01, source=source,
+                  confidence=response_data['confidence'] if response_data else 0.0)
+
+        if session_id != 'anonymous':
+            self.sessions.record_turn(session_id, user_message,
+                                      response_data['category'] if response_data else None,
+                                      user_context)
+        return response_data
+
+    def log_chat(self, user_message, bot_response, response_type, confidence, session_id):
+        """Store a chat turn for the admin analytics"""
+        try:
+            started = time.perf_counter()
+            conn = self.connect()
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO chat_analytics
+                (user_message, bot_response, response_type, confidence, session_id)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_message, bot_response, response_type, confidence, session_id))
+            conn.commit()
+            conn.close()
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage='analytics_insert')
+        except Exception:
+            log.exception('analytics_insert_failed')
+
+    def list_knowledge(self):
+        """All knowledge base entries for the admin panel"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT id, category, question, answer, keywords, priority,
+                   created_at, updated_at, is_active
+            FROM knowledge_base
+            ORDER BY priority DESC, created_at DESC
+        ''')
+        entries = cursor.fetchall()
+        conn.close()
+
+        return [
+            {
+                'id': entry[0],
+                'category': entry[1],
+                'question': entry[2],
+                'answer': entry[3],
+                'keywords': entry[4],
+                'priority': entry[5],
+                'created_at': entry[6],
+                'updated_at': entry[7],
+                'is_active': bool(entry[8])
+            } for entry in entries
+        ]
+
+    def add_knowledge(self, category, question, answer, keywords, priority):
+        """Insert an entry and return its id"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO knowledge_base
+            (category, question, answer, keywords, keyword_tokens, priority)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (category, question, answer, keywords,
+              normalize_keywords(keywords, question), priority))
+
+        knowledge_id = cursor.lastrowid
+        conn.commit()
+        conn.close()
+        self.refresh_indexes()
+        return knowledge_id
+
+    def update_knowledge(self, knowledge_id, category, question, answer, keywords,
+                         priority, is_active):
+        """Update an entry; returns False when it does not exist"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE knowledge_base
+            SET category = ?, question = ?, answer = ?, keywords = ?,
+                keyword_tokens = ?, priority = ?, is_active = ?, updated_at = ?
+            WHERE id = ?
+        ''', (category, question, answer, keywords,
+              normalize_keywords(keywords, question), priority, is_active,
+              datetime.datetime.now(), knowledge_id))
+
+        if cursor.rowcount == 0:
+            conn.close()
+            return False
+
+        conn.commit()
+        conn.close()
+        self.refresh_indexes()
+        return True
+
+    def delete_knowledge(self, knowledge_id):
+        """Delete an entry; returns False when it does not exist"""
+        conn = self.connect()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM knowledge_base WHERE id = ?', (knowledge_id,))
+
+        if cursor.rowcount == 0:
+            conn.close()
+            return False
+
+        conn.commit()
+        conn.close()
+        self.refresh_indexes()
+        return True
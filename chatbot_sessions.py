@@ -0,0 +1,115 @@
+"""
+Conversation context for the Gifted Solutions chatbot
+Bounded in-memory session store (LRU + TTL) with compact per-session state
+"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+
+MAX_RECENT_CATEGORIES = 3
+ORDER_ID_PATTERN = re.compile(
+    r'\b(?:order|ord|ref(?:erence)?)\s*(?:id|no|number)?\s*[#:-]?\s*([a-z0-9][a-z0-9-]{3,})\b',
+    re.IGNORECASE)
+FOLLOW_UP_WORDS = frozenset(['it', 'that', 'this', 'those', 'them', 'also', 'too', 'same'])
+FOLLOW_UP_PREFIXES = ('and ', 'what about', 'how about', 'then ', 'also ')
+
+class SessionState:
+    """What the bot remembers about one conversation"""
+
+    __slots__ = ('last_seen', 'categories', 'order_id')
+
+    def __init__(self):
+        self.last_seen = time.monotonic()
+        self.categories = ()
+        self.order_id = None
+
+    def remember_category(self, category):
+        """Push a category to the front of the recent list"""
+        recent = [category] + [c for c in self.categories if c != category]
+        self.categories = tuple(recent[:MAX_RECENT_CATEGORIES])
+
+class SessionStore:
+    """Thread-safe LRU of session states that also expires idle sessions"""
+
+    def __init__(self, max_sessions=10000, ttl_seconds=1800):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _expire(self, now):
+        """Drop idle sessions from the least recently used end"""
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if now - state.last_seen <= self.ttl_seconds:
+                break
+            del self._sessions[session_id]
+
+    def get(self, session_id):
+        """Return the live state for a session, or None"""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state.last_seen = now
+                self._sessions.move_to_end(session_id)
+            return state
+
+    def touch(self, session_id):
+        """Return the state for a session, creating it if needed"""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState()
+                self._sessions[session_id] = state
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_seen = now
+            return state
+
+    def record_turn(self, session_id, user_message, category=None, user_context=None):
+        """Remember the entities and matched category of one chat turn"""
+        state = self.touch(session_id)
+        order_id = extract_order_id(user_message)
+        if not order_id and user_context:
+            order_id = user_context.get('order_id')
+        if order_id:
+            state.order_id = str(order_id)
+        if category:
+            state.remember_category(category)
+        return state
+
+    def context_for(self, session_id, user_context=None):
+        """Merge stored session state into the client supplied context"""
+        context = dict(user_context) if isinstance(user_context, dict) else {}
+        state = self.get(session_id)
+        if state is not None:
+            context.setdefault('recent_categories', state.categories)
+            if state.order_id:
+                context.setdefault('order_id', state.order_id)
+        return context
+
+def extract_order_id(message):
+    """Pull an order reference such as 'order #GS-1042' out of a message"""
+    match = ORDER_ID_PATTERN.search(message)
+    if not match or not any(char.isdigit() for char in match.group(1)):
+        return None
+    return match.group(1).upper()
+
+def is_follow_up(message, tokens):
+    """Short or referring messages lean on the previous turn"""
+    lowered = message.lower().strip()
+    if lowered.startswith(FOLLOW_UP_PREFIXES):
+        return True
+    words = set(re.findall(r'[a-z]+', lowered))
+    return bool(words & FOLLOW_UP_WORDS) or len(tokens) <= 2
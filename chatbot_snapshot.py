@@ -0,0 +1,239 @@
+"""
+Compiled knowledge base snapshots shared by the chatbot workers
+The active entries, their token postings and TF-IDF weights are compiled
+into one versioned binary file that every worker memory-maps read-only, so
+the answers and index arrays live once in the page cache instead of once
+per process. A knowledge change writes a new file beside the old one and
+renames it into place; workers notice the new file within a poll interval
+and swap to it, while requests already running keep the old mapping.
+Windows cannot rename over a file that is still mapped, so snapshots are only
+used where fcntl exists (SNAPSHOTS_SUPPORTED).
+"""
+
+import os
+import sys
+import mmap
+import struct
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: mapped files cannot be replaced, so no snapshots
+    fcntl = None
+
+SNAPSHOTS_SUPPORTED = fcntl is not None
+
+from chatbot_text import parse_keyword_tokens
+
+MAGIC = b'GSKB'
+FORMAT_VERSION = 1
+# magic, format, change counter, change time, entries, tokens, then section offsets:
+# entries, tokens, postings (uint32 positions), weights (float64), strings (UTF-8)
+HEADER = struct.Struct('<4sIQdIIQQQQQ')
+# id, priority, then (offset, length) of category, question, answer, keywords, keyword_tokens
+ENTRY = struct.Struct('<qd' + 'QI' * 5)
+# token (offset, length), postings start and count, idf
+TOKEN = struct.Struct('<QIQId')
+STRING_FIELDS = ('category', 'question', 'answer', 'keywords', 'keyword_tokens')
+
+class SnapshotEntry:
+    """An entry matched from a snapshot; its long texts are read from the mapping on use"""
+
+    __slots__ = ('id', 'category', 'keyword_phrases', 'priority', 'question_lower',
+                 '_snapshot', '_record')
+
+    def __init__(self, snapshot, record):
+        self._snapshot = snapshot
+        self._record = record
+        fields = ENTRY.unpack_from(snapshot._map, record)
+        self.id = fields[0]
+        self.priority = fields[1]
+        self.category = sys.intern(snapshot.text(fields[2:4]))
+        self.question_lower = snapshot.text(fields[4:6]).lower()
+        self.keyword_phrases = snapshot.phrases(snapshot.text(fields[10:12]))
+
+    def _text(self, field):
+        fields = ENTRY.unpack_from(self._snapshot._map, self._record)
+        return self._snapshot.text(fields[2 + 2 * field:4 + 2 * field])
+
+    @property
+    def question(self):
+        return self._text(1)
+
+    @property
+    def answer(self):
+        return self._text(2)
+
+    @property
+    def keywords(self):
+        return self._text(3) or None
+
+class TokenArrays:
+    """token -> zero-copy view of that token's slice of a snapshot array"""
+
+    def __init__(self, spans, array):
+        self._spans = spans
+        self._array = array
+
+    def __getitem__(self, token):
+        start, count = self._spans[token]
+        return self._array[start:start + count]
+
+    def get(self, token, default=None):
+        span = self._spans.get(token)
+        if span is None:
+            return default
+        return self._array[span[0]:span[0] + span[1]]
+
+    def __contains__(self, token):
+        return token in self._spans
+
+    def __len__(self):
+        return len(self._spans)
+
+class KnowledgeSnapshot:
+    """A compiled knowledge base file, memory-mapped read-only
+
+    Exposes what the matchers build for themselves otherwise: entries in
+    matching order, postings, idf, per-token TF-IDF weights and categories.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.signature = file_signature(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, format_version, counter, changed_at, entry_count, token_count, entries_offset,
+         tokens_offset, postings_offset, weights_offset, strings_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} knowledge snapshot')
+        self.version = (counter, changed_at)
+        self._strings = strings_offset
+        view = memoryview(self._map)
+
+        spans = {}
+        self.idf = {}
+        postings_count = 0
+        for position in range(token_count):
+            offset, length, start, count, idf = TOKEN.unpack_from(self._map, tokens_offset + position * TOKEN.size)
+            token = self.text((offset, length))
+            spans[token] = (start, count)
+            self.idf[token] = idf
+            postings_count = max(postings_count, start + count)
+        self.postings = TokenArrays(
+            spans, view[postings_offset:postings_offset + 4 * postings_count].cast('I'))
+        self.weights = TokenArrays(
+            spans, view[weights_offset:weights_offset + 8 * postings_count].cast('d'))
+
+        self.entries = []
+        self.by_category = {}
+        self._phrases = {}
+        for position in range(entry_count):
+            entry = SnapshotEntry(self, entries_offset + position * ENTRY.size)
+            self.entries.append(entry)
+            self.by_category.setdefault(entry.category, []).append(position)
+        del self._phrases
+
+    def text(self, span):
+        offset, length = span
+        start = self._strings + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def phrases(self, keyword_tokens):
+        """Parsed keyword phrases, sharing equal phrase sets between entries"""
+        return [self._phrases.setdefault(phrase, phrase)
+                for phrase in parse_keyword_tokens(keyword_tokens)]
+
+    @property
+    def vocabulary(self):
+        return self.idf.keys()
+
+def file_signature(path_or_fd):
+    """Identity of the file behind a path; changes whenever a new snapshot is renamed in"""
+    stat = os.stat(path_or_fd)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def snapshot_version(path):
+    """(change counter, change time) recorded in a snapshot file, or None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+    except OSError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    fields = HEADER.unpack(header)
+    if fields[0] != MAGIC or fields[1] != FORMAT_VERSION:
+        return None
+    return (fields[2], fields[3])
+
+def write_snapshot(path, version, entries, matcher):
+    """Compile entries and a built TF-IDF matcher over them into path, atomically
+
+    version is the (change counter, change time) the entries were read at.
+    """
+    strings = bytearray()
+    offsets = {}
+
+    def add_string(value):
+        data = (value or '').encode('utf-8')
+        offset = offsets.get(data)
+        if offset is None:
+            offset = offsets[data] = len(strings)
+            strings.extend(data)
+        return offset, len(data)
+
+    entry_records = bytearray()
+    for entry in entries:
+        spans = []
+        for field in STRING_FIELDS:
+            spans.extend(add_string(getattr(entry, field)))
+        entry_records.extend(ENTRY.pack(entry.id, entry.priority, *spans))
+
+    token_records = bytearray()
+    positions = []
+    weights = []
+    for token in sorted(matcher.postings):
+        token_postings = matcher.postings[token]
+        token_records.extend(TOKEN.pack(*add_string(token), len(positions), len(token_postings),
+                                        matcher.idf[token]))
+        positions.extend(token_postings)
+        weights.extend(matcher.weights[token])
+
+    positions = struct.pack(f'<{len(positions)}I', *positions)
+    weights = struct.pack(f'<{len(weights)}d', *weights)
+    entries_offset = HEADER.size
+    tokens_offset = entries_offset + len(entry_records)
+    postings_offset = tokens_offset + len(token_records)
+    # float64 views need 8-byte alignment
+    padding = -(postings_offset + len(positions)) % 8
+    weights_offset = postings_offset + len(positions) + padding
+    strings_offset = weights_offset + len(weights)
+
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, version[0], version[1], len(entries),
+                            len(token_records) // TOKEN.size, entries_offset, tokens_offset,
+                            postings_offset, weights_offset, strings_offset))
+        f.write(entry_records)
+        f.write(token_records)
+        f.write(positions)
+        f.write(b'\0' * padding)
+        f.write(weights)
+        f.write(strings)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    return strings_offset + len(strings)
+
+@contextlib.contextmanager
+def publish_lock(path):
+    """Serialise snapshot publishing across worker processes"""
+    if fcntl is None:
+        yield
+        return
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
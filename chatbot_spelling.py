@@ -0,0 +1,145 @@
+"""
+Typo tolerant token lookup for the Gifted Solutions chatbot
+BK-tree over the knowledge base vocabulary with bounded edit distance
+"""
+
+import threading
+
+from chatbot_text import STOP_WORDS, TOKEN_PATTERN, stem
+
+# Longest token length that only tolerates a single typo
+SHORT_TOKEN_LENGTH = 5
+MIN_CORRECTABLE_LENGTH = 3
+CORRECTION_CACHE_SIZE = 4096
+
+def edit_distance(a, b, max_distance):
+    """Levenshtein distance, giving up early once it exceeds max_distance"""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) < len(b):
+        a, b = b, a
+
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, char_b in enumerate(b, 1):
+            cost = 0 if char_a == char_b else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current.append(value)
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+
+    return previous[-1]
+
+class BKTree:
+    """Burkhard-Keller tree for nearest-word lookups under edit distance"""
+
+    def __init__(self, words=()):
+        self.root = None
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """Insert a word, ignoring duplicates"""
+        if self.root is None:
+            self.root = (word, {})
+            self.size = 1
+            return
+
+        node_word, children = self.root
+        while True:
+            distance = edit_distance(word, node_word, len(word) + len(node_word))
+            if distance == 0:
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (word, {})
+                self.size += 1
+                return
+            node_word, children = child
+
+    def search(self, word, max_distance):
+        """Return (distance, word) pairs within max_distance, closest first"""
+        if self.root is None:
+            return []
+
+        results = []
+        stack = [self.root]
+        while stack:
+            node_word, children = stack.pop()
+            # Exact distance is needed to prune children by the triangle inequality
+            distance = edit_distance(word, node_word, max_distance + len(node_word) + len(word))
+            if distance <= max_distance:
+                results.append((distance, node_word))
+            low, high = distance - max_distance, distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+
+        results.sort()
+        return results
+
+class SpellingCorrector:
+    """Maps misspelled message tokens onto the knowledge base vocabulary"""
+
+    def __init__(self, vocabulary):
+        self.vocabulary = frozenset(vocabulary)
+        self.tree = BKTree(sorted(self.vocabulary))
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def max_distance(self, token):
+        """Allowed typos for a token of this length"""
+        return 1 if len(token) <= SHORT_TOKEN_LENGTH else 2
+
+    def correct(self, token):
+        """Closest vocabulary word for a token, or None when nothing is close"""
+        if token in self.vocabulary:
+            return token
+        if len(token) < MIN_CORRECTABLE_LENGTH or token.isdigit():
+            return None
+
+        cached = self._cache.get(token, False)
+        if cached is not False:
+            return cached
+
+        matches = self.tree.search(token, self.max_distance(token))
+        correction = matches[0][1] if matches else None
+
+        with self._lock:
+            if len(self._cache) >= CORRECTION_CACHE_SIZE:
+                self._cache.clear()
+            self._cache[token] = correction
+        return correction
+
+    def expand(self, tokens):
+        """Return the token set with corrections for unknown tokens added"""
+        corrections = set()
+        for token in tokens:
+            if token in self.vocabulary:
+                continue
+            correction = self.correct(token)
+            if correction:
+                corrections.add(correction)
+
+        if not corrections:
+            return tokens
+        return frozenset(tokens) | corrections
+
+    def correct_text(self, text):
+        """Lowercase text with misspelled words replaced by their correction (for string similarity)"""
+        def replace(match):
+            word = match.group(0)
+            if word in STOP_WORDS:
+                return word
+            token = stem(word)
+            if token in self.vocabulary:
+                return word
+            return self.correct(token) or word
+
+        return TOKEN_PATTERN.sub(replace, text.lower())
@@ -0,0 +1,91 @@
+"""
+Text normalization helpers for the Gifted Solutions chatbot
+Tokenizes, stems and filters keywords so matching can use set lookups
+"""
+
+import re
+
+# Words that carry no meaning for matching a knowledge base entry
+STOP_WORDS = frozenset([
+    'a', 'about', 'am', 'an', 'and', 'any', 'are', 'as', 'at', 'be', 'by',
+    'can', 'could', 'do', 'does', 'for', 'from', 'have', 'how', 'i', 'if',
+    'in', 'into', 'is', 'it', 'its', 'me', 'my', 'of', 'on', 'or', 'our',
+    'please', 'so', 'than', 'that', 'the', 'their', 'them', 'then', 'there',
+    'these', 'this', 'to', 'us', 'was', 'we', 'what', 'when', 'where',
+    'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your'
+])
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+def stem(word):
+    """Reduce a lowercase word to a light stem (plural and verb suffixes)"""
+    if len(word) <= 3 or word.isdigit():
+        return word
+
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith('sses'):
+        return word[:-2]
+
+    for suffix in ('ing', 'ed'):
+        # speed, feed: the -ed is part of the word (speeds -> speed must agree)
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3 and \
+                not (suffix == 'ed' and word.endswith('eed')):
+            word = word[:-len(suffix)]
+            # shopping -> shopp -> shop
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'lsz':
+                word = word[:-1]
+            return word
+
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+
+    return word
+
+def tokenize(text):
+    """Split text into stemmed tokens with stop words removed"""
+    if not text:
+        return []
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower())
+            if token not in STOP_WORDS]
+
+def message_tokens(text):
+    """Tokenize a user message once per request for set intersection"""
+    return frozenset(tokenize(text))
+
+def normalize_keywords(keywords, question=''):
+    """Normalize a comma separated keyword string for storage
+
+    Each keyword becomes a space separated phrase of stems; duplicates and
+    stop-word-only keywords are dropped. When no usable keywords are given,
+    the keywords are extracted from the question instead.
+    """
+    phrases = []
+    seen = set()
+
+    for keyword in (keywords or '').split(','):
+        phrase = ' '.join(tokenize(keyword))
+        if phrase and phrase not in seen:
+            seen.add(phrase)
+            phrases.append(phrase)
+
+    if not phrases:
+        for token in tokenize(question):
+            if token not in seen:
+                seen.add(token)
+                phrases.append(token)
+
+    return ','.join(phrases)
+
+def parse_keyword_tokens(keyword_tokens):
+    """Turn a stored keyword_tokens string back into a list of phrase sets"""
+    if not keyword_tokens:
+        return []
+    return [frozenset(phrase.split()) for phrase in keyword_tokens.split(',')]
+
+def keyword_score(phrases, tokens):
+    """Fraction of keyword phrases whose stems all appear in the message"""
+    if not phrases:
+        return 0.0
+    matches = sum(1 for phrase in phrases if phrase <= tokens)
+    return matches / len(phrases)
@@ -8,12 +8,23 @@ from flask_cors import CORS
 import uuid
 from datetime import datetime
 import time
+from fast_json import install_json
+from http_cache import install_compression
+from payment_tracing import install_tracing, tag
+from server_logging import get_logger
+from payment_store import (IdempotencyConflict, TransactionStore, idempotency_key,
+                           replay_payload, stream_listing)
+
+log = get_logger('payments.demo')
 
 app = Flask(__name__)
 CORS(app)
+install_json(app)
+install_compression(app)
+install_tracing(app)
 
 # Store transactions in memory for demo
-payment_transactions = {}
+payment_transactions = TransactionStore('demo_payment_server')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -60,32 +71,37 @@ def initiate_payment():
         customer_name = str(data['customer_name'])
         currency = data.get('currency', 'EUR')
         
-        # Generate transaction ID
-        transaction_id = str(uuid.uuid4())
+        # Retried checkouts (double click, network retry) reuse the first transaction
+        key = idempotency_key(request, order_id)
+        with payment_transactions.idempotent(key, order_id=order_id, amount=amount,
+                                             phone_number=phone_number) as existing:
+            if existing is not None:
+                tag(order_id=order_id, transaction_id=existing['transaction_id'])
+                log.info('payment_replayed', idempotency_key=key, status=existing['status'])
+                return jsonify(replay_payload(existing))
+
+            # Generate transaction ID
+            transaction_id = str(uuid.uuid4())
+            tag(order_id=order_id, transaction_id=transaction_id)
         
-        print(f'🚀 Demo Payment Initiated:')
-        print(f'   Amount: {amount} {currency}')
-        print(f'   Phone: {phone_number}')
-        print(f'   Order ID: {order_id}')
-        print(f'   Customer: {customer_name}')
-        print(f'   Transaction ID: {transaction_id}')
+            log.info('payment_initiating', amount=amount, currency=currency,
+                     phone_number=phone_number, customer_name=customer_name)
         
-        # Store transaction
-        transaction_data = {
-            'transaction_id': transaction_id,
-            'order_id': order_id,
-            'amount': amount,
-            'currency': currency,
-            'phone_number': phone_number,
-            'customer_name': customer_name,
-            'customer_email': data.get('customer_email', ''),
-            'status': 'initiated',
-            'created_at': datetime.now().isoformat(),
-            'demo': True
-        }
+            # Store transaction
+            transaction_data = {
+                'transaction_id': transaction_id,
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'phone_number': phone_number,
+                'customer_name': customer_name,
+                'customer_email': data.get('customer_email', ''),
+                'status': 'initiated',
+                'created_at': datetime.now().isoformat(),
+                'demo': True
+            }
         
-        payment_transactions[transaction_id] = transaction_data
-        payment_transactions[order_id] = transaction_data
+            payment_transactions.add(transaction_data, key)
         
         # Simulate successful initiation
         return jsonify({
@@ -100,8 +116,13 @@ def initiate_payment():
             }
         })
         
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except Exception as e:
-        print(f'❌ Demo payment error: {str(e)}')
+        log.exception('payment_initiation_failed')
         return jsonify({
             'success': False, 
             'error': f'Demo payment failed: {str(e)}'
@@ -124,13 +145,12 @@ def verify_payment(transaction_id):
         current_time = datetime.now()
         time_diff = (current_time - created_time).total_seconds()
         
-        print(f'🔍 Verifying demo payment: {transaction_id}')
-        print(f'   Time elapsed: {time_diff:.1f} seconds')
+        tag(order_id=transaction['order_id'], transaction_id=transaction_id)
+        log.info('payment_verifying', sample=0.1, elapsed_seconds=round(time_diff, 1))
         
         # Auto-complete after 10 seconds for demo
         if time_diff > 10:
-            transaction['status'] = 'completed'
-            transaction['completed_at'] = current_time.isoformat()
+            payment_transactions.set_status(transaction, 'completed', completed_at=current_time.isoformat())
             
             return jsonify({
                 'success': True,
@@ -159,7 +179,7 @@ def verify_payment(transaction_id):
             })
             
     except Exception as e:
-        print(f'❌ Demo verification error: {str(e)}')
+        log.exception('payment_verification_failed')
         return jsonify({
             'success': False, 
             'error': f'Demo verification failed: {str(e)}'
@@ -167,11 +187,14 @@ def verify_payment(transaction_id):
 
 @app.route('/api/transactions', methods=['GET'])
 def list_transactions():
-    """List all demo transactions"""
-    return jsonify({
-        'transactions': list(payment_transactions.values()),
-        'count': len(payment_transactions)
-    })
+    """List demo transactions a page at a time (?limit, cursor, status, from, to, fields)"""
+    try:
+        return stream_listing(payment_transactions, request.args)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
 
 if __name__ == '__main__':
     print('🚀 Starting Demo MTN MOMO Payment Server')
@@ -181,4 +204,5 @@ if __name__ == '__main__':
     print('⏱️  Demo payments auto-complete after 10 seconds')
     print('=' * 50)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    from serve import run_server
+    run_server('demo_payment_server', app)
@@ -0,0 +1,94 @@
+"""
+JSON encoding for gateway payloads and responses
+Uses orjson when it is installed (several times faster than the standard
+library and returns bytes ready for the wire), else compact stdlib json.
+install_json(app) makes a Flask app's jsonify and returned dicts use it, and
+stream_array() streams large lists in encoded batches.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+except ImportError:  # encoding helpers only, outside the Flask servers
+    DefaultJSONProvider = object
+
+BACKEND = 'orjson' if orjson else 'json'
+# json.dumps builds a new encoder whenever it gets non-default options; reuse one
+_encoder = json.JSONEncoder(default=str, separators=(',', ':'), ensure_ascii=False)
+
+def dumps_bytes(obj):
+    """Compact UTF-8 JSON; unknown types are encoded with str() like json.dumps(default=str)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return _encoder.encode(obj).encode('utf-8')
+
+def dumps(obj):
+    return dumps_bytes(obj).decode('utf-8')
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider encoding with orjson; stdlib behaviour for anything orjson cannot mirror"""
+
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        # Dates go through Flask's default hook, so they stay HTTP dates as with jsonify
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+def install_json(app):
+    """Serve the app's JSON (jsonify, returned dicts, request.get_json) through FastJSONProvider"""
+    app.json = FastJSONProvider(app)
+    return app.json
+
+def stream_array(key, items, encode=None, batch=256, **fields):
+    """Flask response streaming {"key": [items...], **fields} a batch of items at a time
+
+    encode turns an item into a JSON-ready value (default: the item itself).
+    Memory stays at one encoded batch instead of the whole body.
+    """
+    from flask import Response
+
+    def generate():
+        yield b'{' + dumps_bytes(key) + b':['
+        chunk = []
+        first = True
+        for item in items:
+            chunk.append(dumps_bytes(encode(item) if encode else item))
+            if len(chunk) == batch:
+                yield (b'' if first else b',') + b','.join(chunk)
+                first = False
+                chunk = []
+        if chunk:
+            yield (b'' if first else b',') + b','.join(chunk)
+        tail = dumps_bytes(fields)[1:] if fields else b'}'
+        yield b']' + (b',' + tail if fields else tail) + b'\n'
+
+    return Response(generate(), mimetype='application/json')
@@ -0,0 +1,191 @@
+"""
+Protection around MTN MOMO gateway calls
+Strict request timeouts, a circuit breaker per gateway operation and an
+adaptive (AIMD) concurrency limit shared by all operations, so a degraded
+gateway fails requests fast instead of tying up every worker thread. Calls
+made with a subscription key first queue for that key's quota (gateway_quota).
+
+Settings (environment):
+    GATEWAY_CONNECT_TIMEOUT    seconds, default 3.05
+    GATEWAY_READ_TIMEOUT       seconds, default 15
+    GATEWAY_FAILURE_THRESHOLD  consecutive failures that open a circuit, default 5
+    GATEWAY_RESET_SECONDS      how long a circuit stays open, default 30
+    GATEWAY_MAX_CONCURRENCY    upper bound of the adaptive limit, default 16
+    GATEWAY_LATENCY_TARGET     seconds; slower calls shrink the limit, default 5
+"""
+
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import requests
+
+from gateway_quota import acquire_quota
+from payment_tracing import span
+from server_metrics import registry
+
+GATEWAY_TIMEOUT = (float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', 3.05)),
+                   float(os.environ.get('GATEWAY_READ_TIMEOUT', 15)))
+
+REJECTIONS = registry.counter('gateway_rejections_total',
+                              'Gateway calls failed fast without reaching MoMo', ('operation', 'reason'))
+CIRCUIT_OPEN = registry.gauge('gateway_circuit_open', '1 while the circuit of an operation is open',
+                              ('operation',))
+CONCURRENCY_LIMIT = registry.gauge('gateway_concurrency_limit', 'Current adaptive gateway concurrency limit')
+IN_FLIGHT = registry.gauge('gateway_in_flight', 'Gateway calls currently in flight')
+
+class GatewayUnavailable(Exception):
+    """The gateway call was refused or timed out; the client should retry later"""
+
+    def __init__(self, operation, reason, retry_after):
+        super().__init__(f'MTN MOMO {operation} unavailable ({reason})')
+        self.operation = operation
+        self.reason = reason
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one probe call through after a cool-down"""
+
+    def __init__(self, operation, failure_threshold=None, reset_timeout=None):
+        self.operation = operation
+        self.failure_threshold = failure_threshold or int(os.environ.get('GATEWAY_FAILURE_THRESHOLD', 5))
+        self.reset_timeout = reset_timeout or float(os.environ.get('GATEWAY_RESET_SECONDS', 30))
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'  # this caller is the probe
+                return True
+            return False
+
+    def retry_after(self):
+        return max(1, int(self.reset_timeout - (time.monotonic() - self.opened_at)) + 1)
+
+    def record(self, ok):
+        with self._lock:
+            if ok:
+                self.failures = 0
+                self.state = 'closed'
+            else:
+                self.failures += 1
+                if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                    self.state = 'open'
+                    self.opened_at = time.monotonic()
+            CIRCUIT_OPEN.set(1 if self.state == 'open' else 0, operation=self.operation)
+
+class AdaptiveLimiter:
+    """Concurrency limit that grows by one per window of fast calls and halves on slow or failed ones"""
+
+    def __init__(self, max_limit=None, min_limit=1, latency_target=None, backoff=0.5):
+        self.max_limit = max_limit or int(os.environ.get('GATEWAY_MAX_CONCURRENCY', 16))
+        self.min_limit = min_limit
+        self.latency_target = latency_target or float(os.environ.get('GATEWAY_LATENCY_TARGET', 5))
+        self.backoff = backoff
+        self.limit = max(min_limit, self.max_limit / 4.0)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        CONCURRENCY_LIMIT.set(int(self.limit))
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            IN_FLIGHT.set(self.in_flight)
+            return True
+
+    def cancel(self):
+        """Give back a slot that was never used for a call"""
+        with self._lock:
+            self.in_flight -= 1
+            IN_FLIGHT.set(self.in_flight)
+
+    def release(self, latency, ok):
+        with self._lock:
+            was_busy = self.in_flight >= self.limit / 2
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.latency_target:
+                # One decrease per target interval, not one per queued slow call
+                if now - self._last_decrease >= self.latency_target:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self._last_decrease = now
+            elif was_busy:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            IN_FLIGHT.set(self.in_flight)
+            CONCURRENCY_LIMIT.set(int(self.limit))
+
+limiter = AdaptiveLimiter()
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def breaker_for(operation):
+    breaker = _breakers.get(operation)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(operation, CircuitBreaker(operation))
+    return breaker
+
+def failed_status(status):
+    """Gateway-side trouble: 5xx or throttling; other 4xx are our request's fault"""
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+@contextmanager
+def gateway_call(operation, span_name='gateway_call', quota_key=None):
+    """Traced gateway call guarded by the operation's circuit and the shared limiter
+
+    Set .status on the yielded span to the HTTP status. quota_key is the
+    subscription key whose per-second quota the call draws on. Raises
+    GatewayUnavailable when refused, on timeouts and on connection errors.
+    """
+    breaker = breaker_for(operation)
+    with span(span_name, operation=operation) as call_span:
+        # Queue for quota before taking a concurrency slot, so waiting holds no slot
+        if quota_key and not acquire_quota(quota_key, operation):
+            call_span.status = 'rate_limited'
+            REJECTIONS.inc(operation=operation, reason='rate_limited')
+            raise GatewayUnavailable(operation, 'rate_limited', 1)
+        # Take a slot before asking the breaker, so a half-open probe is never refused here
+        if not limiter.try_acquire():
+            call_span.status = 'concurrency_limit'
+            REJECTIONS.inc(operation=operation, reason='concurrency_limit')
+            raise GatewayUnavailable(operation, 'concurrency_limit', 1)
+        if not breaker.allow():
+            limiter.cancel()
+            call_span.status = 'circuit_open'
+            REJECTIONS.inc(operation=operation, reason='circuit_open')
+            raise GatewayUnavailable(operation, 'circuit_open', breaker.retry_after())
+
+        started = time.monotonic()
+        ok = False
+        try:
+            yield call_span
+            ok = not failed_status(call_span.status)
+        except requests.Timeout as e:
+            call_span.status = 'timeout'
+            raise GatewayUnavailable(operation, 'timeout', breaker.reset_timeout) from e
+        except requests.ConnectionError as e:
+            call_span.status = 'connection_error'
+            raise GatewayUnavailable(operation, 'connection_error', breaker.reset_timeout) from e
+        finally:
+            limiter.release(time.monotonic() - started, ok)
+            breaker.record(ok)
+
+def unavailable_response(error):
+    """503 Flask response telling the client when to retry"""
+    from flask import jsonify
+
+    retry_after = int(error.retry_after)
+    return jsonify({
+        'success': False,
+        'error': 'The MTN MOMO gateway is busy or unavailable. Please try again shortly.',
+        'retry_after': retry_after
+    }), 503, {'Retry-After': str(retry_after)}
@@ -0,0 +1,178 @@
+"""
+Client-side quota for MTN MOMO subscription keys
+A token bucket per subscription key, shared by every thread and optionally by
+every process on the host (through a small SQLite file), with a queue that
+serves customer-facing calls before background status and balance checks.
+
+Settings (environment):
+    MOMO_QUOTA_RPS     requests per second allowed per subscription key, default 5
+    MOMO_QUOTA_BURST   bucket size, default 10
+    MOMO_QUOTA_DB      SQLite file shared by all worker processes; unset = per process
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import deque
+
+from server_metrics import registry
+
+CUSTOMER, STATUS, BACKGROUND = 0, 1, 2
+OPERATION_PRIORITY = {
+    'collection_provision': CUSTOMER,
+    'disbursement_provision': CUSTOMER,
+    'collection_token': CUSTOMER,
+    'disbursement_token': CUSTOMER,
+    'requesttopay': CUSTOMER,
+    'transfer': CUSTOMER,
+    'requesttopay_status': STATUS,
+    'transfer_status': STATUS,
+    'collection_balance': BACKGROUND,
+    'disbursement_balance': BACKGROUND,
+}
+# How long a call may queue for quota before failing fast
+MAX_WAIT = {CUSTOMER: 5.0, STATUS: 15.0, BACKGROUND: 15.0}
+# Lower-priority calls waiting this long are served next, so they never starve
+AGING_SECONDS = 2.0
+
+QUOTA_WAIT = registry.histogram('gateway_quota_wait_seconds',
+                                'Time gateway calls queued for subscription key quota', ('priority',))
+
+class LocalBucket:
+    """Token bucket for one process"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take a token and return 0, or return the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+class SharedBucket:
+    """Token bucket kept in SQLite so all worker processes draw from one quota"""
+
+    def __init__(self, path, name, rate, burst):
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self._conn = None
+        self._pid = None
+
+    def connect(self):
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS quota_buckets (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                )
+            ''')
+            self._pid = os.getpid()
+        return self._conn
+
+    def take(self):
+        conn = self.connect()
+        now = time.time()
+        # BEGIN IMMEDIATE takes the file's write lock, serialising all processes
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM quota_buckets WHERE name = ?',
+                               (self.name,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            conn.execute('INSERT OR REPLACE INTO quota_buckets (name, tokens, updated) VALUES (?, ?, ?)',
+                         (self.name, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return wait
+
+class QuotaQueue:
+    """Hands out bucket tokens by priority, oldest first within a priority"""
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self._waiting = (deque(), deque(), deque())
+        self._cond = threading.Condition()
+
+    def _head(self):
+        now = time.monotonic()
+        aged = None
+        for queue in self._waiting[1:]:
+            if queue and now - queue[0][1] >= AGING_SECONDS and (aged is None or queue[0][1] < aged[1]):
+                aged = queue[0]
+        if aged is not None:
+            return aged
+        for queue in self._waiting:
+            if queue:
+                return queue[0]
+        return None
+
+    def acquire(self, priority, max_wait):
+        """Wait for a token; False if none came within max_wait seconds"""
+        started = time.monotonic()
+        deadline = started + max_wait
+        ticket = [priority, started]
+        with self._cond:
+            self._waiting[priority].append(ticket)
+            try:
+                while True:
+                    wait = None
+                    if self._head() is ticket:
+                        wait = self.bucket.take()
+                        if wait == 0:
+                            return True
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(min(wait, remaining) if wait else remaining)
+            finally:
+                self._waiting[priority].remove(ticket)
+                self._cond.notify_all()
+                QUOTA_WAIT.observe(time.monotonic() - started, priority=priority)
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+def quota_for(subscription_key, rate=None, burst=None):
+    """The shared queue for one subscription key"""
+    queue = _queues.get(subscription_key)
+    if queue is None:
+        with _queues_lock:
+            queue = _queues.get(subscription_key)
+            if queue is None:
+                rate = rate or float(os.environ.get('MOMO_QUOTA_RPS', 5))
+                burst = burst or float(os.environ.get('MOMO_QUOTA_BURST', 10))
+                shared_path = os.environ.get('MOMO_QUOTA_DB')
+                if shared_path:
+                    # Never write the key itself to disk
+                    name = hashlib.sha256(subscription_key.encode('utf-8')).hexdigest()[:16]
+                    bucket = SharedBucket(shared_path, name, rate, burst)
+                else:
+                    bucket = LocalBucket(rate, burst)
+                queue = _queues[subscription_key] = QuotaQueue(bucket)
+    return queue
+
+def acquire_quota(subscription_key, operation):
+    """Wait for quota for one gateway call; False if the wait limit ran out"""
+    priority = OPERATION_PRIORITY.get(operation, STATUS)
+    return quota_for(subscription_key).acquire(priority, MAX_WAIT[priority])
@@ -0,0 +1,150 @@
+"""
+Response compression and conditional GET for the Flask servers
+install_compression(app) compresses JSON and text responses above a size
+threshold with brotli (when the brotli package is installed and the client
+accepts it) or gzip, streamed responses included. not_modified() answers
+If-None-Match / If-Modified-Since with a bodyless 304 from a cheap version
+tag (a table change counter) before the response is built, and
+with_validators() stamps ETag and Last-Modified on the full response.
+
+Settings (environment):
+    HTTP_COMPRESS_MIN_BYTES  smallest body worth compressing, default 1024
+    HTTP_COMPRESS_LEVEL      gzip level 1-9, default 6
+    HTTP_BROTLI_QUALITY      brotli quality 0-11, default 5
+"""
+
+import os
+import time
+import zlib
+from datetime import datetime, timezone
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from server_metrics import registry
+
+MIN_BYTES = int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('HTTP_COMPRESS_LEVEL', 6))
+BROTLI_QUALITY = int(os.environ.get('HTTP_BROTLI_QUALITY', 5))
+# Preferred first when the client weighs them equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE = frozenset(['application/json', 'application/javascript', 'text/plain',
+                          'text/html', 'text/css', 'text/csv'])
+
+COMPRESSED = registry.counter('http_compressed_responses_total',
+                              'Responses sent compressed', ('encoding',))
+COMPRESSED_BYTES = registry.counter('http_compression_bytes_total',
+                                    'Bytes before and after compression of buffered responses', ('stage',))
+NOT_MODIFIED = registry.counter('http_not_modified_total',
+                                'Conditional GETs answered with 304', ('endpoint',))
+
+def _gzip_compressor():
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+def compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = _gzip_compressor()
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed body chunk by chunk"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = _gzip_compressor()
+        compress, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+def compress_response(response, request):
+    """Compress response in place if it is worth it and the client accepts an encoding"""
+    if request.method == 'HEAD' or response.status_code != 200 or \
+            'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(ENCODINGS)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # Streams are the large listings; their size is unknown up front
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_BYTES:
+            return response
+        compressed = compress_bytes(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+        COMPRESSED_BYTES.inc(len(data), stage='original')
+        COMPRESSED_BYTES.inc(len(compressed), stage='compressed')
+
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the identity ones, so validators become weak
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    COMPRESSED.inc(encoding=encoding)
+    return response
+
+def install_compression(app):
+    """Compress the app's large JSON and text responses"""
+    from flask import request
+
+    @app.after_request
+    def compress(response):
+        return compress_response(response, request)
+
+    return app
+
+def _last_modified(changed_at):
+    # HTTP dates have one-second resolution: a change in the current second
+    # may be followed by another one in it, so leave Last-Modified off until then
+    if changed_at is None or time.time() - changed_at < 1:
+        return None
+    return datetime.fromtimestamp(changed_at, timezone.utc)
+
+def with_validators(response, version, changed_at, cache_control='private, no-cache'):
+    """Stamp ETag, Last-Modified and (revalidate every time) Cache-Control on a response"""
+    response.set_etag(version, weak=True)
+    last_modified = _last_modified(changed_at)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def not_modified(version, changed_at):
+    """Bodyless 304 if the client already holds this version, else None
+
+    version is a string that changes whenever the data behind the response
+    does; changed_at the epoch seconds of that change (or None). Check it
+    before running the queries, so a revalidation costs no more than this.
+    """
+    from flask import make_response, request
+    from werkzeug.http import is_resource_modified
+
+    if request.method not in ('GET', 'HEAD') or \
+            is_resource_modified(request.environ, etag=version, last_modified=_last_modified(changed_at)):
+        return None
+    NOT_MODIFIED.inc(endpoint=request.endpoint or '')
+    return with_validators(make_response('', 304), version, changed_at)
+
+def conditional(version, changed_at, build):
+    """not_modified(), else the response of build() with validators attached"""
+    from flask import make_response
+
+    cached = not_modified(version, changed_at)
+    if cached is not None:
+        return cached
+    return with_validators(make_response(build()), version, changed_at)
@@ -0,0 +1,298 @@
+"""
+Multi-tenant MTN MOMO client
+One MomoClient per merchant account, each with its own credentials, cached
+access tokens and pooled HTTP connections, so a single server process can
+take payments for every merchant. Servers pick the client per request.
+
+Settings (environment):
+    MOMO_TENANTS_FILE    JSON file {"tenant": {MomoClient keyword arguments}}; unset =
+                         one "default" tenant with the credentials in pay.PayClass
+    MOMO_DEFAULT_TENANT  tenant used when a request names none, default "default"
+    MOMO_POOL_SIZE       pooled connections per tenant, default 10
+"""
+
+import os
+import json
+import time
+import uuid
+import base64
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from balance_cache import invalidate_balance
+from fast_json import dumps_bytes
+from gateway_guard import GATEWAY_TIMEOUT, GatewayUnavailable, breaker_for, gateway_call
+from payment_tracing import tag
+from server_logging import get_logger
+
+log = get_logger('payments.gateway')
+
+TENANT_HEADER = 'X-Merchant-Id'
+DEFAULT_TENANT = os.environ.get('MOMO_DEFAULT_TENANT', 'default')
+SANDBOX_URL = 'https://sandbox.momodeveloper.mtn.com'
+PRODUCTION_URL = 'https://proxy.momoapi.mtn.com'
+# Refresh tokens this long before MoMo expires them
+TOKEN_MARGIN = 60
+
+class UnknownTenant(ValueError):
+    """The request named a merchant this server has no credentials for"""
+
+class TokenError(GatewayUnavailable):
+    """MoMo refused to issue an access token; answered with a 503 like other gateway outages"""
+
+class _Product:
+    """Credentials and cached token for one MoMo product (collection or disbursement)"""
+
+    def __init__(self, name, subkey, apiuser, api_key, authorization, environment_mode):
+        self.name = name
+        self.subkey = subkey
+        self.apiuser = apiuser
+        self.api_key = api_key
+        self.authorization = authorization
+        self.token = None
+        self.bearer = None
+        self.expires_at = 0.0
+        self.lock = threading.Lock()
+        # Header templates copied per call; only the token and reference ID vary
+        self.headers = {'Ocp-Apim-Subscription-Key': subkey, 'X-Target-Environment': environment_mode}
+        self.json_headers = {**self.headers, 'Content-Type': 'application/json'}
+
+    def basic_auth(self):
+        if not self.authorization:
+            credentials = f'{self.apiuser}:{self.api_key}'.encode('utf-8')
+            self.authorization = 'Basic ' + base64.b64encode(credentials).decode('ascii')
+        return self.authorization
+
+class MomoClient:
+    """MTN MOMO API client for one merchant account; methods mirror PayClass"""
+
+    def __init__(self, tenant, collections_subkey='', disbursements_subkey='',
+                 collections_apiuser='', api_key_collections='',
+                 disbursements_apiuser='', api_key_disbursements='',
+                 environment_mode='sandbox', accurl=None,
+                 basic_authorisation_collections='', basic_authorisation_disbursements='',
+                 pool_size=None):
+        self.tenant = tenant
+        self.environment_mode = environment_mode
+        self.accurl = accurl or (SANDBOX_URL if environment_mode == 'sandbox' else PRODUCTION_URL)
+        self.products = {
+            'collection': _Product('collection', collections_subkey, collections_apiuser,
+                                   api_key_collections, basic_authorisation_collections, environment_mode),
+            'disbursement': _Product('disbursement', disbursements_subkey, disbursements_apiuser,
+                                     api_key_disbursements, basic_authorisation_disbursements, environment_mode),
+        }
+        pool_size = pool_size or int(os.environ.get('MOMO_POOL_SIZE', 10))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_payclass(cls, tenant, pay_class):
+        """Client sharing the credentials PayClass provisioned at import"""
+        return cls(tenant,
+                   collections_subkey=pay_class.collections_subkey,
+                   disbursements_subkey=pay_class.disbursements_subkey,
+                   collections_apiuser=pay_class.collections_apiuser,
+                   api_key_collections=pay_class.api_key_collections,
+                   disbursements_apiuser=pay_class.disbursements_apiuser,
+                   api_key_disbursements=pay_class.api_key_disbursements,
+                   environment_mode=pay_class.environment_mode,
+                   accurl=pay_class.accurl,
+                   basic_authorisation_collections=pay_class.basic_authorisation_collections,
+                   basic_authorisation_disbursements=pay_class.basic_authorisation_disbursments)
+
+    # ============= Credentials and tokens
+
+    def _provision(self, product):
+        """Create a sandbox API user and key for a product that has none"""
+        product.apiuser = product.apiuser or str(uuid.uuid4())
+        headers = {'X-Reference-Id': product.apiuser, 'Content-Type': 'application/json',
+                   'Ocp-Apim-Subscription-Key': product.subkey}
+        with gateway_call(f'{product.name}_provision', quota_key=product.subkey) as call_span:
+            response = self.session.post(f'{self.accurl}/v1_0/apiuser', headers=headers,
+                                         data=json.dumps({'providerCallbackHost': 'URL of host ie google.com'}),
+                                         timeout=GATEWAY_TIMEOUT)
+            call_span.status = response.status_code
+        with gateway_call(f'{product.name}_provision', quota_key=product.subkey) as call_span:
+            response = self.session.post(f'{self.accurl}/v1_0/apiuser/{product.apiuser}/apikey',
+                                         headers={'Ocp-Apim-Subscription-Key': product.subkey},
+                                         timeout=GATEWAY_TIMEOUT)
+            call_span.status = response.status_code
+        product.api_key = response.json()['apiKey']
+        product.authorization = None
+
+    def token(self, product_name):
+        """Cached access token for a product, fetched again shortly before it expires"""
+        product = self.products[product_name]
+        if product.token and time.monotonic() < product.expires_at:
+            return product.token
+        return self._fetch_token(product_name, product)
+
+    def _fetch_token(self, product_name, product):
+        # One fetch per product; concurrent callers wait and reuse it
+        with product.lock:
+            if product.token and time.monotonic() < product.expires_at:
+                return product.token
+            if not product.api_key and not product.authorization and self.environment_mode == 'sandbox':
+                self._provision(product)
+            headers = {'Ocp-Apim-Subscription-Key': product.subkey, 'Authorization': product.basic_auth()}
+            with gateway_call(f'{product_name}_token', span_name='token_fetch',
+                              quota_key=product.subkey) as token_span:
+                response = self.session.post(f'{self.accurl}/{product_name}/token/', headers=headers,
+                                             timeout=GATEWAY_TIMEOUT)
+                token_span.status = response.status_code
+            if response.status_code != 200:
+                log.error('token_request_failed', tenant=self.tenant, product=product_name,
+                          status=response.status_code)
+                operation = f'{product_name}_token'
+                raise TokenError(operation, f'token request failed ({response.status_code})',
+                                 breaker_for(operation).reset_timeout)
+            body = response.json()
+            product.token = body['access_token']
+            product.bearer = 'Bearer ' + product.token
+            product.expires_at = time.monotonic() + max(0, int(body.get('expires_in', 3600)) - TOKEN_MARGIN)
+            return product.token
+
+    def token_response(self, product_name):
+        """The token as MoMo's token endpoint returns it (the shape PayClass.momotoken gives)"""
+        access_token = self.token(product_name)
+        expires_in = max(0, int(self.products[product_name].expires_at - time.monotonic()) + TOKEN_MARGIN)
+        return {'access_token': access_token, 'token_type': 'access_token', 'expires_in': expires_in}
+
+    def momotoken(self):
+        return self.token_response('collection')
+
+    def momotokendisbursement(self):
+        return self.token_response('disbursement')
+
+    def prepare(self, product_name, payload=None, reference_id=None):
+        """Headers and body of a gateway request, from the product's prebuilt templates"""
+        product = self.products[product_name]
+        if not product.token or time.monotonic() >= product.expires_at:
+            self._fetch_token(product_name, product)
+        headers = (product.headers if payload is None else product.json_headers).copy()
+        headers['Authorization'] = product.bearer
+        if reference_id:
+            headers['X-Reference-Id'] = reference_id
+        return headers, (None if payload is None else dumps_bytes(payload))
+
+    def _call(self, product_name, operation, method, path, payload=None, reference_id=None):
+        product = self.products[product_name]
+        headers, data = self.prepare(product_name, payload, reference_id)
+        with gateway_call(operation, quota_key=product.subkey) as gateway_span:
+            response = self.session.request(method, self.accurl + path, headers=headers, data=data,
+                                            timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
+        if response.status_code == 401:
+            # Revoked or expired early: the next call fetches a new token
+            product.token = None
+        return response
+
+    # ============= Collections
+
+    def momopay(self, amount, currency, txt_ref, phone_number, payermessage):
+        uuidgen = str(uuid.uuid4())
+        tag(reference_id=uuidgen)
+        response = self._call('collection', 'requesttopay', 'POST', '/collection/v1_0/requesttopay', {
+            'amount': amount,
+            'currency': currency,
+            'externalId': txt_ref,
+            'payer': {'partyIdType': 'MSISDN', 'partyId': phone_number},
+            'payerMessage': payermessage,
+            'payeeNote': payermessage
+        }, reference_id=uuidgen)
+        return {'response': response.status_code, 'ref': uuidgen}
+
+    def verifymomo(self, txn):
+        tag(reference_id=txn)
+        response = self._call('collection', 'requesttopay_status', 'GET', f'/collection/v1_0/requesttopay/{txn}')
+        result = response.json()
+        if result.get('status') == 'SUCCESSFUL':
+            invalidate_balance('collections', self.tenant)
+        return result
+
+    def momobalance(self):
+        return self._call('collection', 'collection_balance', 'GET', '/collection/v1_0/account/balance').json()
+
+    # ============= Disbursements
+
+    def momobalancedisbursement(self):
+        return self._call('disbursement', 'disbursement_balance', 'GET',
+                          '/disbursement/v1_0/account/balance').json()
+
+    def withdrawmtnmomo(self, amount, currency, txt_ref, phone_number, payermessage):
+        uuidgen = str(uuid.uuid4())
+        tag(reference_id=uuidgen)
+        response = self._call('disbursement', 'transfer', 'POST', '/disbursement/v1_0/transfer', {
+            'amount': amount,
+            'currency': currency,
+            'externalId': txt_ref,
+            'payee': {'partyIdType': 'MSISDN', 'partyId': phone_number},
+            'payerMessage': payermessage,
+            'payeeNote': payermessage
+        }, reference_id=uuidgen)
+        if response.status_code == 202:
+            invalidate_balance('disbursements', self.tenant)
+        return {'response': response.status_code, 'ref': uuidgen}
+
+    def checkwithdrawstatus(self, txt_ref):
+        response = self._call('disbursement', 'transfer_status', 'GET', f'/disbursement/v1_0/transfer/{txt_ref}',
+                              reference_id=str(uuid.uuid4()))
+        returneddata = response.json()
+        log.info('gateway_response', operation='transfer_status', result=returneddata)
+        return {'response': response.status_code, 'ref': txt_ref, 'data': returneddata}
+
+class ClientRegistry:
+    """Tenant name -> MomoClient, loaded once per process"""
+
+    def __init__(self, config_path=None):
+        self.config_path = config_path
+        self._clients = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        clients = {}
+        if self.config_path:
+            with open(self.config_path, encoding='utf-8') as f:
+                for tenant, settings in json.load(f).items():
+                    clients[tenant] = MomoClient(tenant, **settings)
+        else:
+            from pay import PayClass
+            clients[DEFAULT_TENANT] = MomoClient.from_payclass(DEFAULT_TENANT, PayClass)
+        log.info('momo_tenants_loaded', tenants=sorted(clients))
+        return clients
+
+    def _ensure(self):
+        if self._clients is None:
+            with self._lock:
+                if self._clients is None:
+                    self._clients = self._load()
+        return self._clients
+
+    def get(self, tenant=None):
+        client = self._ensure().get(tenant or DEFAULT_TENANT)
+        if client is None:
+            raise UnknownTenant(f'Unknown merchant {tenant!r}')
+        return client
+
+    def add(self, client):
+        self._ensure()[client.tenant] = client
+
+    def tenants(self):
+        return sorted(self._ensure())
+
+clients = ClientRegistry(os.environ.get('MOMO_TENANTS_FILE'))
+
+def client_for(tenant=None):
+    """The MomoClient of a tenant (None = the default tenant)"""
+    return clients.get(tenant)
+
+def tenant_from(request, data=None):
+    """Tenant named by the X-Merchant-Id header or a merchant_id field, else the default"""
+    tenant = request.headers.get(TENANT_HEADER)
+    if not tenant and isinstance(data, dict):
+        tenant = data.get('merchant_id')
+    return str(tenant) if tenant else DEFAULT_TENANT
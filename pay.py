@@ -3,6 +3,12 @@ import requests
 import json
 import uuid
 from basicauth import encode
+from payment_tracing import tag
+from balance_cache import invalidate_balance
+from gateway_guard import GATEWAY_TIMEOUT, gateway_call
+from server_logging import get_logger
+
+log = get_logger('payments.gateway')
 
 
 class PayClass():
@@ -55,7 +61,7 @@ class PayClass():
         'Ocp-Apim-Subscription-Key': collections_subkey
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
 
     # ============= Create API key
 
@@ -66,7 +72,7 @@ class PayClass():
         'Ocp-Apim-Subscription-Key': collections_subkey
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
 
     #print("The response is: \n"+str(response))
     response = response.json()
@@ -97,7 +103,9 @@ class PayClass():
             'Authorization': str(PayClass.basic_authorisation_collections)
         }
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        with gateway_call('collection_token', span_name='token_fetch', quota_key=PayClass.collections_subkey) as token_span:
+            response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            token_span.status = response.status_code
 
         authorization_token = response.json()
 
@@ -106,6 +114,7 @@ class PayClass():
     def momopay(amount, currency, txt_ref, phone_number, payermessage):
         # UUID V4 generator
         uuidgen = str(uuid.uuid4())
+        tag(reference_id=uuidgen)
         url = ""+str(PayClass.accurl)+"/collection/v1_0/requesttopay"
 
         payload = json.dumps({
@@ -127,13 +136,16 @@ class PayClass():
             'Authorization': "Bearer "+str(PayClass.momotoken()["access_token"])
         }
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        with gateway_call('requesttopay', quota_key=PayClass.collections_subkey) as gateway_span:
+            response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
 
         context = {"response": response.status_code, "ref": uuidgen}
 
         return context
 
     def verifymomo(txn):
+        tag(reference_id=txn)
         url = ""+str(PayClass.accurl) + \
             "/collection/v1_0/requesttopay/"+str(txn)+""
 
@@ -144,10 +156,15 @@ class PayClass():
             'X-Target-Environment': PayClass.environment_mode,
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload)
+        with gateway_call('requesttopay_status', quota_key=PayClass.collections_subkey) as gateway_span:
+            response = requests.request("GET", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
 
         json_respon = response.json()
 
+        if json_respon.get('status') == 'SUCCESSFUL':
+            invalidate_balance('collections')
+
         return json_respon
 
     # Check momo collections balance
@@ -161,7 +178,9 @@ class PayClass():
             'X-Target-Environment': PayClass.environment_mode,
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload)
+        with gateway_call('collection_balance', quota_key=PayClass.collections_subkey) as gateway_span:
+            response = requests.request("GET", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
 
         json_respon = response.json()
 
@@ -183,7 +202,7 @@ class PayClass():
         'Ocp-Apim-Subscription-Key': disbursements_subkey
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
 
     # ============= Create API key
 
@@ -194,7 +213,7 @@ class PayClass():
         'Ocp-Apim-Subscription-Key': disbursements_subkey
     }
 
-    response = requests.request("POST", url, headers=headers, data=payload)
+    response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
 
     #print("The response is: \n"+str(response))
     response = response.json()
@@ -227,7 +246,9 @@ class PayClass():
             'Authorization': str(PayClass.basic_authorisation_disbursments)
         }
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        with gateway_call('disbursement_token', span_name='token_fetch', quota_key=PayClass.disbursements_subkey) as token_span:
+            response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            token_span.status = response.status_code
 
         authorization_token = response.json()
 
@@ -244,7 +265,9 @@ class PayClass():
             'X-Target-Environment': PayClass.environment_mode,
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload)
+        with gateway_call('disbursement_balance', quota_key=PayClass.disbursements_subkey) as gateway_span:
+            response = requests.request("GET", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
 
         json_respon = response.json()
 
@@ -254,6 +277,7 @@ class PayClass():
     def withdrawmtnmomo(amount, currency, txt_ref, phone_number, payermessage):
         # UUID V4 generator
         uuidgen = str(uuid.uuid4())
+        tag(reference_id=uuidgen)
         url = ""+str(PayClass.accurl)+"/disbursement/v1_0/transfer"
 
         payload = json.dumps({
@@ -276,7 +300,12 @@ class PayClass():
             'Authorization': "Bearer "+str(PayClass.momotokendisbursement()["access_token"])
         }
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        with gateway_call('transfer', quota_key=PayClass.disbursements_subkey) as gateway_span:
+            response = requests.request("POST", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
+
+        if response.status_code == 202:
+            invalidate_balance('disbursements')
 
         context = {"response": response.status_code, "ref": uuidgen}
 
@@ -301,11 +330,13 @@ class PayClass():
             'Authorization': "Bearer " + str(PayClass.momotokendisbursement()["access_token"])
         }
 
-        response = requests.request("GET", url, headers=headers, data=payload)
+        with gateway_call('transfer_status', quota_key=PayClass.disbursements_subkey) as gateway_span:
+            response = requests.request("GET", url, headers=headers, data=payload, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
 
         returneddata = response.json()
 
-        print(returneddata)
+        log.info('gateway_response', operation='transfer_status', result=returneddata)
 
         context = {
             "response": response.status_code,
@@ -0,0 +1,295 @@
+"""
+Append-only event log of payment state changes
+Every transaction creation, status transition and archival is appended as a
+JSON line to the current segment file. A background writer commits whatever
+has queued up with one write and one fsync (group commit), so concurrent
+payments share the cost of durability. Closed segments are periodically
+compacted into a snapshot holding the latest state of each live transaction,
+and the transaction table is rebuilt from snapshot + segments at startup.
+Each server logs to its own subdirectory; a writer holds an flock on its open
+segment, so compaction only folds segments no live process is writing.
+
+Settings (environment):
+    PAYMENT_EVENT_DIR            base directory, one subdirectory per server, default
+                                 payment_events; empty disables the log
+    PAYMENT_EVENT_SEGMENT_BYTES  start a new segment past this size, default 16 MiB
+    PAYMENT_EVENT_COMPACT_AFTER  closed segments that trigger a compaction, default 8
+    PAYMENT_EVENT_FSYNC          set to 0 to skip fsync and not wait for commits
+"""
+
+import os
+import json
+import time
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process servers, so only our own segments are closed
+    fcntl = None
+
+from server_logging import get_logger
+from server_metrics import registry
+
+SEGMENT_PREFIX = 'events-'
+SNAPSHOT_PREFIX = 'snapshot-'
+SUFFIX = '.jsonl'
+LOCK_FILE = '.lock'
+# How long an append waits for its commit before carrying on
+COMMIT_WAIT = 5.0
+
+EVENTS = registry.counter('payment_events_appended_total', 'Payment events appended to the log', ('type',))
+COMMIT_SECONDS = registry.histogram('payment_event_commit_seconds', 'Write + fsync time per group commit')
+COMMIT_BATCH = registry.histogram('payment_event_commit_batch_size', 'Events per group commit',
+                                  buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+
+log = get_logger('payments.events')
+
+def _numbered(directory, prefix):
+    """(number, path) of the directory's files with a prefix, in order"""
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(SUFFIX):
+            try:
+                found.append((int(name[len(prefix):-len(SUFFIX)]), os.path.join(directory, name)))
+            except ValueError:
+                continue
+    return sorted(found)
+
+@contextlib.contextmanager
+def _directory_lock(directory):
+    """Serialise segment creation and compaction across the processes sharing a directory"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_FILE), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _writer_gone(path):
+    """Whether no process holds the segment open for writing (always False without flock)"""
+    if fcntl is None:
+        return False
+    try:
+        with open(path, 'rb') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+def _read_events(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # A crash mid-write leaves a torn last line; everything before it is intact
+                log.warning('event_line_skipped', path=path)
+
+def fold(events):
+    """Latest state per transaction: {id: [created_ts, idempotency_key, data, settled_ts]}"""
+    states = {}
+    for event in events:
+        kind = event.get('type')
+        transaction_id = event.get('id')
+        if kind in ('created', 'state'):
+            states[transaction_id] = [event['ts'], event.get('key'), event['data'], event.get('settled')]
+        elif kind == 'status':
+            state = states.get(transaction_id)
+            if state is not None:
+                state[2].update(event['data'])
+                state[3] = event['ts'] if event.get('settled') else None
+        elif kind == 'archived':
+            states.pop(transaction_id, None)
+    return states
+
+def replay(directory):
+    """Every event still on disk, oldest first: the latest snapshot, then the newer segments
+
+    Read-only, so other processes (reconciliation, audits) can replay a live log.
+    """
+    snapshots = _numbered(directory, SNAPSHOT_PREFIX)
+    covered = 0
+    if snapshots:
+        covered, path = snapshots[-1]
+        yield from _read_events(path)
+    for number, path in _numbered(directory, SEGMENT_PREFIX):
+        if number > covered:
+            yield from _read_events(path)
+
+class _Batch:
+    """Appends committed together by one write + fsync"""
+
+    def __init__(self):
+        self.done = threading.Event()
+
+class EventLog:
+    """Segmented JSONL log with group commit and snapshot compaction"""
+
+    def __init__(self, directory, segment_bytes=None, compact_after=None, fsync=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes or int(os.environ.get('PAYMENT_EVENT_SEGMENT_BYTES', 16 * 1024 * 1024))
+        self.compact_after = compact_after or int(os.environ.get('PAYMENT_EVENT_COMPACT_AFTER', 8))
+        self.fsync = fsync if fsync is not None else os.environ.get('PAYMENT_EVENT_FSYNC', '1') != '0'
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = []
+        self._batch = _Batch()
+        self._cond = threading.Condition()
+        self._writer_pid = None
+        self._compacting = False
+        # Segments this process wrote and closed
+        self._closed = set()
+        # Never append after a possibly torn line: every process start opens a new segment
+        self._open_segment()
+        # Restarts leave small closed segments behind too
+        if len(_numbered(directory, SEGMENT_PREFIX)) > self.compact_after:
+            self.compact()
+
+    def _open_segment(self):
+        """Start the next free segment and hold its flock while this process writes it"""
+        with _directory_lock(self.directory):
+            last = [number for number, _ in
+                    _numbered(self.directory, SEGMENT_PREFIX) + _numbered(self.directory, SNAPSHOT_PREFIX)]
+            self._segment_no = max(last, default=0) + 1
+            self._file = open(os.path.join(self.directory, f'{SEGMENT_PREFIX}{self._segment_no:08d}{SUFFIX}'),
+                              'a', encoding='utf-8')
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+
+    def _compactable(self, segments):
+        """The leading segments no process is still writing
+
+        A snapshot numbered N stands for every segment up to N, so stop at
+        the first live one.
+        """
+        done = []
+        for number, path in segments:
+            if number == self._segment_no or not (number in self._closed or _writer_gone(path)):
+                break
+            done.append((number, path))
+        return done
+
+    def replay(self):
+        return replay(self.directory)
+
+    def states(self):
+        return fold(self.replay())
+
+    def append(self, event, wait=None):
+        """Queue an event for the next group commit; by default wait until it is on disk"""
+        line = json.dumps(event, default=str, separators=(',', ':')) + '\n'
+        with self._cond:
+            self._ensure_writer()
+            self._pending.append(line)
+            batch = self._batch
+            self._cond.notify()
+        EVENTS.inc(type=event.get('type'))
+        if wait is None:
+            wait = self.fsync
+        if wait and not batch.done.wait(COMMIT_WAIT):
+            log.warning('event_commit_slow', waited_seconds=COMMIT_WAIT)
+        return batch
+
+    def flush(self, timeout=COMMIT_WAIT):
+        """Wait for everything appended so far to be committed"""
+        with self._cond:
+            if not self._pending:
+                return True
+            batch = self._batch
+        return batch.done.wait(timeout)
+
+    def _ensure_writer(self):
+        """Start the writer thread in this process (forked workers need their own)"""
+        if self._writer_pid != os.getpid():
+            self._writer_pid = os.getpid()
+            threading.Thread(target=self._write_loop, name='payment-events', daemon=True).start()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Everything that queued up while the last commit ran goes in this one
+                lines, batch = self._pending, self._batch
+                self._pending, self._batch = [], _Batch()
+            started = time.perf_counter()
+            try:
+                self._commit(lines)
+            except Exception:
+                log.exception('event_commit_failed', events=len(lines))
+            finally:
+                batch.done.set()
+            COMMIT_SECONDS.observe(time.perf_counter() - started)
+            COMMIT_BATCH.observe(len(lines))
+
+    def _commit(self, lines):
+        self._file.write(''.join(lines))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        if self._file.tell() >= self.segment_bytes:
+            self._file.close()
+            self._closed.add(self._segment_no)
+            self._open_segment()
+            if len(self._closed) >= self.compact_after and not self._compacting:
+                self._compacting = True
+                threading.Thread(target=self.compact, name='payment-events-compact', daemon=True).start()
+
+    def compact(self):
+        """Fold the closed segments into a new snapshot and delete what it replaces"""
+        try:
+            with _directory_lock(self.directory):
+                return self._compact()
+        finally:
+            self._compacting = False
+
+    def _compact(self):
+        closed = self._compactable(_numbered(self.directory, SEGMENT_PREFIX))
+        if not closed:
+            return 0
+        through = closed[-1][0]
+        snapshots = _numbered(self.directory, SNAPSHOT_PREFIX)
+
+        def covered_events():
+            covered = 0
+            if snapshots:
+                covered, path = snapshots[-1]
+                yield from _read_events(path)
+            for number, path in closed:
+                if number > covered:
+                    yield from _read_events(path)
+
+        states = fold(covered_events())
+        path = os.path.join(self.directory, f'{SNAPSHOT_PREFIX}{through:08d}{SUFFIX}')
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            for transaction_id, (created_ts, key, data, settled_ts) in states.items():
+                f.write(json.dumps({'type': 'state', 'ts': created_ts, 'id': transaction_id, 'key': key,
+                                    'data': data, 'settled': settled_ts},
+                                   default=str, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        for _, old in snapshots + closed:
+            if old != path:
+                os.remove(old)
+        self._closed.difference_update(number for number, _ in closed)
+        log.info('event_log_compacted', segments=len(closed), transactions=len(states))
+        return len(closed)
+
+def event_log_directory(name):
+    """Where the server called name logs, or None when PAYMENT_EVENT_DIR is set empty"""
+    base = os.environ.get('PAYMENT_EVENT_DIR', 'payment_events')
+    return os.path.join(base, name) if base else None
+
+def event_log_from_environment(name):
+    """The event log of the server called name, or None when PAYMENT_EVENT_DIR is set empty
+
+    Servers must not share a log: each one rebuilds its table from all of it.
+    """
+    directory = event_log_directory(name)
+    return EventLog(directory) if directory else None
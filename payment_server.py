@@ -10,12 +10,26 @@ from datetime import datetime
 current_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(current_dir)
 from pay import PayClass
+from fast_json import install_json
+from http_cache import install_compression
+from payment_tracing import install_tracing, span, tag
+from gateway_guard import GatewayUnavailable, unavailable_response
+from balance_cache import balance_response
+from momo_client import UnknownTenant, client_for, clients, tenant_from
+from server_logging import get_logger
+from payment_store import (IdempotencyConflict, TransactionStore, bulk_status_response,
+                           idempotency_key, replay_payload, stream_listing)
+
+log = get_logger('payments')
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+install_json(app)
+install_compression(app)
+install_tracing(app)
 
 # Store payment transactions in memory (in production, use a database)
-payment_transactions = {}
+payment_transactions = TransactionStore('payment_server')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -23,7 +37,8 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'MTN MOMO Payment Server is running',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': datetime.now().isoformat(),
+        'tenants': clients.tenants()
     })
 
 @app.route('/api/payment/initiate', methods=['POST'])
@@ -51,39 +66,57 @@ def initiate_payment():
         # Create payment message
         payer_message = f"Payment for order {order_id} by {customer_name}"
         
-        # Generate unique transaction ID
-        transaction_id = str(uuid.uuid4())
+        # Each merchant account has its own MoMo client; unknown merchants are a 400
+        tenant = tenant_from(request, data)
+        client = client_for(tenant)
+        
+        # Retried checkouts (double click, network retry) reuse the first transaction
+        key = f'{tenant}/{idempotency_key(request, order_id)}'
+        with payment_transactions.idempotent(key, order_id=order_id, amount=amount,
+                                             phone_number=phone_number) as existing:
+            if existing is not None:
+                tag(order_id=order_id, transaction_id=existing['transaction_id'])
+                log.info('payment_replayed', idempotency_key=key, status=existing['status'])
+                return jsonify(replay_payload(existing))
+
+            # Generate unique transaction ID
+            transaction_id = str(uuid.uuid4())
+            tag(order_id=order_id, transaction_id=transaction_id)
         
-        print(f"Initiating payment: Amount={amount}, Phone={phone_number}, Order={order_id}")
+            log.info('payment_initiating', amount=amount, currency=currency, phone_number=phone_number)
         
-        # Call MTN MOMO API
-        payment_result = PayClass.momopay(
-            amount=amount,
-            currency=currency,
-            txt_ref=order_id,
-            phone_number=phone_number,
-            payermessage=payer_message
-        )
+            # Call MTN MOMO API
+            with span('initiate', operation='requesttopay'):
+                payment_result = client.momopay(
+                    amount=amount,
+                    currency=currency,
+                    txt_ref=order_id,
+                    phone_number=phone_number,
+                    payermessage=payer_message
+                )
         
-        print(f"Payment result: {payment_result}")
+            log.info('gateway_response', operation='requesttopay', result=payment_result)
         
-        # Store transaction details
-        payment_transactions[transaction_id] = {
-            'order_id': order_id,
-            'amount': amount,
-            'currency': currency,
-            'phone_number': phone_number,
-            'customer_name': customer_name,
-            'payment_result': payment_result,
-            'status': 'initiated',
-            'created_at': datetime.now().isoformat(),
-            'transaction_id': transaction_id
-        }
-        
-        # Also store by order_id for easy lookup
-        payment_transactions[order_id] = payment_transactions[transaction_id]
-        
-        if payment_result and 'success' in payment_result and payment_result['success']:
+            # Store transaction details; rejected attempts may be retried
+            accepted = bool(isinstance(payment_result, dict) and payment_result.get('response') == 202)
+            transaction_data = {
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'phone_number': phone_number,
+                'customer_name': customer_name,
+                'payment_result': payment_result,
+                'tenant': tenant,
+                'status': 'initiated' if accepted else 'failed',
+                'created_at': datetime.now().isoformat(),
+                'transaction_id': transaction_id
+            }
+        
+            # One record, indexed by transaction_id, order_id and idempotency key
+            with span('store_write'):
+                payment_transactions.add(transaction_data, key)
+        
+        if accepted:  # MTN MOMO answers 202 when the request to pay is queued
             return jsonify({
                 'success': True,
                 'transaction_id': transaction_id,
@@ -98,8 +131,21 @@ def initiate_payment():
                 'details': payment_result
             }), 400
             
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
+    except UnknownTenant as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f"Error initiating payment: {str(e)}")
+        log.exception('payment_initiation_failed')
         return jsonify({
             'success': False,
             'error': f'Payment initiation failed: {str(e)}'
@@ -109,21 +155,23 @@ def initiate_payment():
 def verify_payment(transaction_id):
     """Verify MTN MOMO payment status"""
     try:
-        if transaction_id not in payment_transactions:
+        # Other merchants' transactions read as missing
+        transaction = payment_transactions.get(transaction_id, tenant=tenant_from(request))
+        if transaction is None:
             return jsonify({
                 'success': False,
                 'error': 'Transaction not found'
             }), 404
         
-        transaction = payment_transactions[transaction_id]
         order_id = transaction['order_id']
         
-        print(f"Verifying payment for transaction: {transaction_id}, order: {order_id}")
-        
         # Call MTN MOMO verification API
-        verification_result = PayClass.verifymomo(order_id)
+        tag(order_id=order_id, transaction_id=transaction_id)
+        with span('verify', operation='requesttopay_status'):
+            verification_result = client_for(transaction.get('tenant')).verifymomo(order_id)
         
-        print(f"Verification result: {verification_result}")
+        log.info('gateway_response', sample=0.1, operation='requesttopay_status',
+                 result=verification_result)
         
         # Update transaction status
         transaction['verification_result'] = verification_result
@@ -131,7 +179,7 @@ def verify_payment(transaction_id):
         
         if verification_result and 'success' in verification_result:
             if verification_result['success']:
-                transaction['status'] = 'completed'
+                payment_transactions.set_status(transaction, 'completed')
                 return jsonify({
                     'success': True,
                     'status': 'completed',
@@ -139,7 +187,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
             else:
-                transaction['status'] = 'failed'
+                payment_transactions.set_status(transaction, 'failed')
                 return jsonify({
                     'success': False,
                     'status': 'failed',
@@ -147,7 +195,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
         else:
-            transaction['status'] = 'pending'
+            payment_transactions.set_status(transaction, 'pending')
             return jsonify({
                 'success': False,
                 'status': 'pending',
@@ -155,25 +203,42 @@ def verify_payment(transaction_id):
                 'message': 'Payment still pending'
             })
             
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f"Error verifying payment: {str(e)}")
+        log.exception('payment_verification_failed')
         return jsonify({
             'success': False,
             'error': f'Payment verification failed: {str(e)}'
         }), 500
 
+@app.route('/api/payment/status', methods=['GET', 'POST'])
+def get_payment_statuses():
+    """Payment status of many orders at once (order history pages)
+
+    Query: order_ids=a,b,c, or POST {"order_ids": [...]}; at most 100
+    """
+    try:
+        return bulk_status_response(payment_transactions, request, tenant_from(request))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
+
 @app.route('/api/payment/status/<order_id>', methods=['GET'])
 def get_payment_status(order_id):
     """Get payment status by order ID"""
     try:
-        if order_id not in payment_transactions:
+        # Other merchants' transactions read as missing
+        transaction = payment_transactions.get(order_id, tenant=tenant_from(request))
+        if transaction is None:
             return jsonify({
                 'success': False,
                 'error': 'Order not found'
             }), 404
         
-        transaction = payment_transactions[order_id]
-        
         return jsonify({
             'success': True,
             'order_id': order_id,
@@ -185,30 +250,52 @@ def get_payment_status(order_id):
         })
         
     except Exception as e:
-        print(f"Error getting payment status: {str(e)}")
+        log.exception('payment_status_failed')
         return jsonify({
             'success': False,
             'error': f'Failed to get payment status: {str(e)}'
         }), 500
 
+@app.route('/api/balance', methods=['GET'])
+def get_balance():
+    """Collections and disbursement balances, cached for a few seconds (admin dashboard)
+
+    Query: account=collections|disbursements, refresh=1 to bypass the cache
+    """
+    try:
+        return balance_response(request.args, tenant_from(request))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
+    except Exception as e:
+        log.exception('balance_check_failed')
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get balance: {str(e)}'
+        }), 500
+
 @app.route('/api/payment/transactions', methods=['GET'])
 def get_all_transactions():
-    """Get all payment transactions (for admin/debugging)"""
+    """Get payment transactions a page at a time (for admin/debugging)
+
+    Query: limit, cursor (next_cursor of the previous page), order=asc|desc,
+    status, from/to (ISO dates), min_amount/max_amount, fields (comma separated)
+    """
     try:
-        # Filter out duplicate entries (we store by both transaction_id and order_id)
-        unique_transactions = {}
-        for key, transaction in payment_transactions.items():
-            if 'transaction_id' in transaction:
-                unique_transactions[transaction['transaction_id']] = transaction
+        return stream_listing(payment_transactions, request.args)
         
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'transactions': list(unique_transactions.values()),
-            'count': len(unique_transactions)
-        })
-        
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
     except Exception as e:
-        print(f"Error getting transactions: {str(e)}")
+        log.exception('list_transactions_failed')
         return jsonify({
             'success': False,
             'error': f'Failed to get transactions: {str(e)}'
@@ -220,4 +307,5 @@ if __name__ == '__main__':
     print("Health check: http://localhost:5000/api/health")
     print("Press Ctrl+C to stop the server")
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    from serve import run_server
+    run_server('payment_server', app)
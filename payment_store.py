@@ -0,0 +1,550 @@
+"""
+Transaction storage for the Gifted Solutions payment servers
+Each transaction is stored once as a compact record and indexed by
+transaction ID, order ID and idempotency key, with per-key locks so retried
+checkouts coalesce into a single MoMo requesttopay. Listings are
+cursor-paginated over creation order. Settled transactions are archived to
+disk after a TTL, and a ceiling caps how many stay in memory. Creations and
+status transitions go to the payment event log (payment_events), which
+rebuilds the table when the server restarts.
+
+Settings (environment):
+    PAYMENT_ARCHIVE_DIR       where archived transactions go, default payment_archive
+    PAYMENT_ARCHIVE_AFTER     seconds a settled transaction stays in memory, default 86400
+    PAYMENT_MAX_TRANSACTIONS  in-memory ceiling, default 50000
+    PAYMENT_EVENT_DIR         event log base directory (see payment_events), default payment_events
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from contextlib import contextmanager
+
+from fast_json import stream_array
+from http_cache import conditional
+from payment_events import event_log_from_environment
+from server_logging import get_logger
+from server_metrics import registry
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+MAX_BULK_STATUS = 100
+# Settled payments never change, so clients may reuse them this long
+SETTLED_MAX_AGE = 300
+SWEEP_INTERVAL = 60
+
+# A retry after one of these starts a new attempt instead of replaying
+RETRYABLE_STATUSES = frozenset(['failed'])
+# Settled transactions no longer change and may be archived
+TERMINAL_STATUSES = frozenset(['completed', 'failed'])
+# Settled for good: a failed order can still be retried under the same order ID
+FINAL_STATUSES = TERMINAL_STATUSES - RETRYABLE_STATUSES
+
+RECORD_FIELDS = ('transaction_id', 'order_id', 'amount', 'currency', 'phone_number',
+                 'customer_name', 'customer_email', 'payer_message', 'status',
+                 'created_at', 'last_verified', 'payment_result', 'verification_result')
+STATUS_FIELDS = ('transaction_id', 'order_id', 'status', 'amount', 'currency', 'created_at',
+                 'last_verified')
+# Gateway payloads are cut down to what the handlers and reconciliation read
+PAYLOAD_FIELDS = frozenset(['payment_result', 'verification_result'])
+PAYLOAD_KEEP = frozenset(['success', 'response', 'ref', 'status', 'status_text', 'reason',
+                          'error', 'demo', 'amount', 'currency', 'financialTransactionId',
+                          'externalId'])
+
+ARCHIVED = registry.counter('payment_transactions_archived_total',
+                            'Transactions moved from memory to the disk archive', ('reason',))
+
+log = get_logger('payments.store')
+
+class IdempotencyConflict(Exception):
+    """An idempotency key was reused for a different payment"""
+
+def compact_payload(payload):
+    if isinstance(payload, dict):
+        return {key: value for key, value in payload.items() if key in PAYLOAD_KEEP}
+    return payload
+
+class TransactionRecord:
+    """One transaction in __slots__, read and written like the dict it replaces"""
+
+    __slots__ = RECORD_FIELDS + ('extra', 'seq', 'settled_at', 'idempotency_key')
+
+    def __init__(self, data):
+        for field in RECORD_FIELDS:
+            object.__setattr__(self, field, None)
+        self.extra = None
+        self.seq = 0
+        self.settled_at = None
+        self.idempotency_key = None
+        for key, value in data.items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in RECORD_FIELDS:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in PAYLOAD_FIELDS:
+            value = compact_payload(value)
+        elif key in ('status', 'currency') and isinstance(value, str):
+            value = sys.intern(value)
+            if key == 'status':
+                # Stamp the settlement once; re-saving a settled status keeps its age
+                if value not in TERMINAL_STATUSES:
+                    self.settled_at = None
+                elif self.status not in TERMINAL_STATUSES:
+                    self.settled_at = time.time()
+        if key in RECORD_FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return (key in RECORD_FIELDS and getattr(self, key) is not None) or \
+            (self.extra is not None and key in self.extra)
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def items(self):
+        for field in RECORD_FIELDS:
+            value = getattr(self, field)
+            if value is not None:
+                yield field, value
+        if self.extra:
+            yield from self.extra.items()
+
+    def as_dict(self):
+        return dict(self.items())
+
+def order_key(record):
+    """(tenant, order ID): merchants number their orders independently"""
+    return (record.get('tenant'), record.order_id)
+
+class TransactionStore:
+    """Thread-safe transaction map with O(1) lookup by transaction or order ID"""
+
+    def __init__(self, name, max_transactions=None, archive_after=None, archive_dir=None, events=None):
+        self.max_transactions = max_transactions or int(os.environ.get('PAYMENT_MAX_TRANSACTIONS', 50000))
+        self.archive_after = archive_after or float(os.environ.get('PAYMENT_ARCHIVE_AFTER', 86400))
+        self.archive_dir = archive_dir or os.environ.get('PAYMENT_ARCHIVE_DIR', 'payment_archive')
+
+        self._transactions = {}
+        self._by_order = {}
+        self._by_key = {}
+        self._key_locks = {}
+        # Creation order (sequence numbers, IDs and times) for cursors and date-range seeks
+        self._created_seqs = []
+        self._created_ids = []
+        self._created_times = []
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        # Bumped on every change a listing could show; the instance ID keeps
+        # equal counts in other workers or after a restart from matching
+        self._instance = uuid.uuid4().hex[:12]
+        self._version = 0
+        self._changed_at = time.time()
+
+        self._sweep_wanted = threading.Event()
+        self._sweeper_pid = None
+
+        # name picks this server's own event log directory
+        self.events = events if events is not None else event_log_from_environment(name)
+        if self.events:
+            self._rebuild()
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __contains__(self, transaction_or_order_id):
+        return self.get(transaction_or_order_id) is not None
+
+    def __getitem__(self, transaction_or_order_id):
+        transaction = self.get(transaction_or_order_id)
+        if transaction is None:
+            raise KeyError(transaction_or_order_id)
+        return transaction
+
+    def get(self, transaction_or_order_id, default=None, tenant=None):
+        """Look a transaction up by its transaction ID, falling back to the tenant's order ID
+
+        Order IDs are only unique per merchant. Given a tenant, another
+        tenant's transaction counts as missing.
+        """
+        self._ensure_sweeper()
+        transaction = self._transactions.get(transaction_or_order_id)
+        if transaction is None:
+            transaction_id = self._by_order.get((tenant, transaction_or_order_id))
+            if transaction_id is not None:
+                transaction = self._transactions.get(transaction_id)
+        if transaction is None or (tenant is not None and transaction.get('tenant') != tenant):
+            return default
+        return transaction
+
+    def values(self):
+        """Every in-memory transaction once (the old dict held each one twice)"""
+        with self._lock:
+            return list(self._transactions.values())
+
+    def items(self):
+        with self._lock:
+            return list(self._transactions.items())
+
+    def add(self, transaction, idempotency_key=None):
+        """Store a transaction as a compact record and index it; the newest attempt wins the order ID"""
+        record = transaction if isinstance(transaction, TransactionRecord) else TransactionRecord(transaction)
+        created = time.time()
+        over_ceiling = self._index(record, created, idempotency_key)
+        if self.events:
+            self.events.append({'type': 'created', 'ts': created, 'id': record.transaction_id,
+                                'key': idempotency_key, 'data': record.as_dict(),
+                                'settled': record.settled_at})
+
+        self._ensure_sweeper()
+        if over_ceiling:
+            self._sweep_wanted.set()
+        return record
+
+    def _index(self, record, created, idempotency_key):
+        transaction_id = record.transaction_id
+        with self._lock:
+            if transaction_id not in self._transactions:
+                record.seq = self._next_seq
+                self._next_seq += 1
+                self._created_seqs.append(record.seq)
+                self._created_ids.append(transaction_id)
+                self._created_times.append(created)
+            self._transactions[transaction_id] = record
+            self._by_order[order_key(record)] = transaction_id
+            self._touch()
+            if idempotency_key:
+                record.idempotency_key = idempotency_key
+                self._by_key[idempotency_key] = transaction_id
+            return len(self._transactions) > self.max_transactions
+
+    def _rebuild(self):
+        """Reload the live transactions from the event log, in creation order"""
+        states = self.events.states()
+        for created, key, data, settled in sorted(states.values(), key=lambda state: state[0]):
+            record = TransactionRecord(data)
+            if record.settled_at is not None and settled:
+                record.settled_at = settled
+            self._index(record, created, key)
+        if states:
+            log.info('transactions_rebuilt', count=len(states))
+            # Runs at import, which a preloading gunicorn arbiter does too: only
+            # ask for a sweep; the serving process starts the thread on first use
+            self._sweep_wanted.set()
+
+    def _touch(self):
+        self._version += 1
+        self._changed_at = time.time()
+
+    def version(self):
+        """(version tag, epoch seconds of the last change) for listing ETags"""
+        return f'transactions-{self._instance}-{self._version}', self._changed_at
+
+    def set_status(self, transaction, status, **fields):
+        """Update a transaction's status (and fields) and log the transition if the status changed"""
+        changed = transaction['status'] != status
+        for field, value in fields.items():
+            transaction[field] = value
+        transaction['status'] = status
+        with self._lock:
+            self._touch()
+        if changed and self.events:
+            data = {'status': status}
+            for field in ('last_verified', 'verification_result'):
+                if transaction.get(field) is not None:
+                    data[field] = transaction[field]
+            data.update((field, transaction[field]) for field in fields)
+            self.events.append({'type': 'status', 'ts': time.time(), 'id': transaction['transaction_id'],
+                                'data': data, 'settled': transaction.settled_at is not None})
+
+    def page(self, limit=DEFAULT_PAGE_SIZE, cursor=None, descending=True, status=None,
+             created_from=None, created_to=None, min_amount=None, max_amount=None):
+        """One page of transactions in creation order and the cursor of the next page
+
+        The date range is found by binary search over creation times; status
+        and amount filters are applied while walking that range. Cursors are
+        sequence numbers, so they stay valid while old transactions are archived.
+        """
+        self._ensure_sweeper()
+        with self._lock:
+            seqs = self._created_seqs
+            ids = self._created_ids
+            times = self._created_times
+            low = bisect_left(times, created_from) if created_from is not None else 0
+            high = bisect_right(times, created_to) if created_to is not None else len(ids)
+            if descending:
+                start = high if cursor is None else min(bisect_left(seqs, cursor), high)
+                positions = range(start - 1, low - 1, -1)
+            else:
+                start = low if cursor is None else max(bisect_left(seqs, cursor), low)
+                positions = range(start, high)
+
+            results = []
+            next_cursor = None
+            for position in positions:
+                transaction = self._transactions.get(ids[position])
+                if transaction is None:
+                    continue  # archived since the index was last compacted
+                if status is not None and transaction.status != status:
+                    continue
+                amount = transaction.amount or 0
+                if (min_amount is not None and amount < min_amount) or \
+                        (max_amount is not None and amount > max_amount):
+                    continue
+                if len(results) == limit:
+                    # One more match exists, so there is a next page
+                    next_cursor = seqs[position] + 1 if descending else seqs[position]
+                    break
+                results.append(transaction)
+        return results, next_cursor
+
+    def find(self, idempotency_key):
+        """Transaction previously created under an idempotency key"""
+        transaction_id = self._by_key.get(idempotency_key)
+        return self._transactions.get(transaction_id) if transaction_id else None
+
+    @contextmanager
+    def idempotent(self, idempotency_key, **fingerprint):
+        """Serialise initiations sharing a key and yield the transaction to replay, if any
+
+        Concurrent duplicates wait on the key's lock and then see the first
+        request's transaction. Failed attempts are not replayed, so the customer
+        can retry. fingerprint fields (order_id, amount, phone_number) must match
+        the stored transaction or IdempotencyConflict is raised.
+        """
+        with self._lock:
+            entry = self._key_locks.get(idempotency_key)
+            if entry is None:
+                entry = self._key_locks[idempotency_key] = [threading.Lock(), 0]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                existing = self.find(idempotency_key)
+                if existing is not None and existing.get('status') in RETRYABLE_STATUSES:
+                    existing = None
+                if existing is not None:
+                    for field, value in fingerprint.items():
+                        if existing.get(field) != value:
+                            raise IdempotencyConflict(
+                                f'Payment {idempotency_key!r} was already initiated '
+                                f'with a different {field}')
+                yield existing
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._key_locks[idempotency_key]
+
+    def _ensure_sweeper(self):
+        """Start the archive thread in this process on first use (forked workers need their own)"""
+        if self._sweeper_pid == os.getpid():
+            return
+        with self._lock:
+            if self._sweeper_pid == os.getpid():
+                return
+            self._sweeper_pid = os.getpid()
+        threading.Thread(target=self._sweep_loop, name='payment-archive', daemon=True).start()
+
+    def _sweep_loop(self):
+        while True:
+            self._sweep_wanted.wait(SWEEP_INTERVAL)
+            self._sweep_wanted.clear()
+            try:
+                self.sweep()
+            except Exception:
+                log.exception('archive_sweep_failed')
+
+    def sweep(self, now=None):
+        """Archive settled transactions past the TTL, then the oldest ones over the ceiling"""
+        now = now or time.time()
+        expired = []
+        with self._lock:
+            for transaction_id in self._created_ids:
+                record = self._transactions.get(transaction_id)
+                if record is not None and record.settled_at is not None and \
+                        now - record.settled_at >= self.archive_after:
+                    expired.append(record)
+            excess = len(self._transactions) - len(expired) - self.max_transactions
+            overflow = []
+            if excess > 0:
+                # Oldest first, settled before in-flight
+                expired_ids = set(record.transaction_id for record in expired)
+                remaining = [self._transactions[transaction_id] for transaction_id in self._created_ids
+                             if transaction_id in self._transactions and transaction_id not in expired_ids]
+                remaining.sort(key=lambda record: record.settled_at is None)
+                overflow = remaining[:excess]
+
+        archived = self.archive(expired, 'ttl') + self.archive(overflow, 'ceiling')
+        if archived:
+            log.info('transactions_archived', count=archived, in_memory=len(self._transactions))
+        return archived
+
+    def archive(self, records, reason):
+        """Append records to today's archive file and drop them from memory"""
+        if not records:
+            return 0
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"transactions-{time.strftime('%Y-%m-%d')}.jsonl")
+        archived_at = datetime.now().isoformat()
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(dict(record.as_dict(), archived_at=archived_at), default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            for record in records:
+                transaction_id = record.transaction_id
+                if self._transactions.pop(transaction_id, None) is None:
+                    continue
+                if self._by_order.get(order_key(record)) == transaction_id:
+                    del self._by_order[order_key(record)]
+                if record.idempotency_key and self._by_key.get(record.idempotency_key) == transaction_id:
+                    del self._by_key[record.idempotency_key]
+            self._touch()
+            self._compact_creation_index()
+        if self.events:
+            for record in records:
+                self.events.append({'type': 'archived', 'ts': time.time(), 'id': record.transaction_id},
+                                   wait=False)
+        ARCHIVED.inc(len(records), reason=reason)
+        return len(records)
+
+    def _compact_creation_index(self):
+        """Drop archived IDs from the creation index once they make up half of it"""
+        if len(self._created_ids) < 2 * len(self._transactions) + 64:
+            return
+        live = [(seq, transaction_id, created)
+                for seq, transaction_id, created in zip(self._created_seqs, self._created_ids,
+                                                        self._created_times)
+                if transaction_id in self._transactions]
+        self._created_seqs = [seq for seq, _, _ in live]
+        self._created_ids = [transaction_id for _, transaction_id, _ in live]
+        self._created_times = [created for _, _, created in live]
+
+def idempotency_key(request, order_id):
+    """The client's Idempotency-Key header, else the order ID"""
+    return request.headers.get(IDEMPOTENCY_HEADER) or order_id
+
+def replay_payload(transaction):
+    """Initiate response for a request that matched an existing transaction"""
+    payload = {
+        'success': True,
+        'transaction_id': transaction['transaction_id'],
+        'order_id': transaction['order_id'],
+        'status': transaction['status'],
+        'message': 'Payment already initiated for this order. Check your phone for MTN MOMO prompt.',
+        'idempotent_replay': True
+    }
+    payment_result = transaction.get('payment_result')
+    if payment_result is not None:
+        payload['payment_result'] = payment_result
+        if isinstance(payment_result, dict):
+            payload['reference_id'] = payment_result.get('ref', transaction['transaction_id'])
+    return payload
+
+def parse_time(value):
+    """Epoch seconds from an ISO date/time query parameter"""
+    return datetime.fromisoformat(value).timestamp()
+
+def listing_options(args):
+    """page() arguments from ?limit=&cursor=&status=&from=&to=&min_amount=&max_amount=&order="""
+    limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be 'asc' or 'desc'")
+    return {
+        'limit': limit,
+        'cursor': int(args['cursor']) if args.get('cursor') else None,
+        'descending': order == 'desc',
+        'status': args.get('status') or None,
+        'created_from': parse_time(args['from']) if args.get('from') else None,
+        'created_to': parse_time(args['to']) if args.get('to') else None,
+        'min_amount': float(args['min_amount']) if args.get('min_amount') else None,
+        'max_amount': float(args['max_amount']) if args.get('max_amount') else None
+    }
+
+def stream_listing(store, args, default_fields=None):
+    """Streamed JSON page of transactions, projected to ?fields= or default_fields
+
+    Answers 304 while the store has not changed since the client's copy.
+    Raises ValueError for malformed query parameters.
+    """
+    options = listing_options(args)
+    fields = [field for field in args.get('fields', '').split(',') if field] or default_fields
+
+    def project(transaction):
+        if fields:
+            return {field: transaction.get(field) for field in fields}
+        return transaction.as_dict()
+
+    def build():
+        transactions, next_cursor = store.page(**options)
+        return stream_array('transactions', transactions, encode=project, success=True,
+                            count=len(transactions), total=len(store),
+                            next_cursor=str(next_cursor) if next_cursor is not None else None)
+
+    return conditional(*store.version(), build)
+
+def bulk_status_response(store, request, tenant=None):
+    """Payment states of many orders in one response, cacheable once all are completed
+
+    Order IDs come from ?order_ids=a,b,c (GET) or {"order_ids": [...]} (POST)
+    and are looked up among the tenant's orders.
+    Raises ValueError for a missing, malformed or oversized list.
+    """
+    from flask import jsonify
+
+    if request.method == 'POST':
+        order_ids = (request.get_json(silent=True) or {}).get('order_ids')
+    else:
+        order_ids = [order_id for order_id in request.args.get('order_ids', '').split(',') if order_id]
+    if not isinstance(order_ids, list) or not order_ids:
+        raise ValueError('order_ids must be a non-empty list')
+    if len(order_ids) > MAX_BULK_STATUS:
+        raise ValueError(f'at most {MAX_BULK_STATUS} order_ids per request')
+
+    payments = {}
+    missing = []
+    final = True
+    for order_id in dict.fromkeys(str(order_id) for order_id in order_ids):
+        transaction = store.get(order_id, tenant=tenant)
+        if transaction is None:
+            missing.append(order_id)
+            continue
+        payments[order_id] = {field: transaction.get(field) for field in STATUS_FIELDS}
+        final = final and transaction.status in FINAL_STATUSES
+
+    response = jsonify({'success': True, 'payments': payments, 'missing': missing})
+    if final and not missing:
+        response.headers['Cache-Control'] = f'private, max-age={SETTLED_MAX_AGE}'
+    else:
+        # Pending, failed (retryable) or unknown orders can change on the next poll
+        response.headers['Cache-Control'] = 'no-cache'
+    if request.method == 'GET':
+        # Revalidations of an unchanged set get a bodyless 304
+        response.add_etag()
+        response.make_conditional(request)
+    return response
@@ -0,0 +1,152 @@
+"""
+Request tracing for the Gifted Solutions payment servers
+Per-request spans (initiate, token fetch, gateway call, store write, verify)
+with durations, a correlation ID tied to the MoMo X-Reference-Id, and
+latency histograms by gateway operation and status code.
+"""
+
+import time
+import uuid
+import contextvars
+from contextlib import contextmanager
+
+from server_metrics import registry, install_metrics
+from server_logging import add_context_provider, get_logger
+
+CORRELATION_HEADER = 'X-Correlation-Id'
+
+SPAN_SECONDS = registry.histogram(
+    'payment_span_seconds', 'Payment flow span latency by operation and status',
+    ('span', 'operation', 'status'))
+
+_current_trace = contextvars.ContextVar('payment_trace', default=None)
+log = get_logger('payments.trace')
+
+class Span:
+    """One timed step of a payment request"""
+
+    __slots__ = ('name', 'operation', 'attributes', 'parent', 'status', 'duration')
+
+    def __init__(self, name, operation, attributes, parent):
+        self.name = name
+        self.operation = operation
+        self.attributes = attributes
+        self.parent = parent
+        self.status = None
+        self.duration = 0.0
+
+    def as_dict(self):
+        data = {'name': self.name, 'ms': round(self.duration * 1000, 2)}
+        if self.operation != self.name:
+            data['operation'] = self.operation
+        if self.parent:
+            data['parent'] = self.parent
+        if self.status is not None:
+            data['status'] = self.status
+        data.update(self.attributes)
+        return data
+
+class Trace:
+    """Spans and log context collected for one request"""
+
+    __slots__ = ('correlation_id', 'route', 'started', 'spans', 'stack', 'context')
+
+    def __init__(self, correlation_id, route):
+        self.correlation_id = correlation_id
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = []
+        self.stack = []
+        self.context = {}
+
+    def summary(self, status):
+        return {
+            'correlation_id': self.correlation_id,
+            'route': self.route,
+            'status': status,
+            'total_ms': round((time.perf_counter() - self.started) * 1000, 2),
+            **self.context,
+            'spans': [span.as_dict() for span in self.spans]
+        }
+
+def current_trace():
+    """The trace of the request being handled, or None outside requests"""
+    return _current_trace.get()
+
+def correlation_id():
+    """Correlation ID of the current request, or None"""
+    trace = _current_trace.get()
+    return trace.correlation_id if trace else None
+
+def log_context():
+    """Correlation ID and tagged fields added to every log record of a request"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    return dict(trace.context, correlation_id=trace.correlation_id)
+
+add_context_provider(log_context)
+
+def tag(**context):
+    """Attach fields (e.g. reference_id, order_id) to the request log context"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.context.update(context)
+
+@contextmanager
+def span(name, operation=None, **attributes):
+    """Time a step; set span.status to the gateway HTTP status when known"""
+    trace = _current_trace.get()
+    current = Span(name, operation or name, attributes,
+                   trace.stack[-1].name if trace and trace.stack else None)
+    if trace is not None:
+        trace.stack.append(current)
+
+    started = time.perf_counter()
+    try:
+        yield current
+    except Exception:
+        if current.status is None:
+            current.status = 'error'
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        if trace is not None:
+            trace.stack.pop()
+            trace.spans.append(current)
+        SPAN_SECONDS.observe(current.duration, span=name, operation=current.operation,
+                             status=current.status if current.status is not None else 'ok')
+
+def emit_trace(summary):
+    """Log a finished request trace as one structured record"""
+    log.info('request_trace', **summary)
+
+def install_tracing(app):
+    """Trace every request of a payment app and expose /metrics"""
+    from flask import g, request
+
+    install_metrics(app)
+
+    @app.before_request
+    def start_trace():
+        incoming = request.headers.get(CORRELATION_HEADER) or request.headers.get('X-Request-Id')
+        trace = Trace(incoming or str(uuid.uuid4()), request.path)
+        g.payment_trace_token = _current_trace.set(trace)
+
+    @app.after_request
+    def finish_trace(response):
+        trace = _current_trace.get()
+        if trace is not None:
+            response.headers[CORRELATION_HEADER] = trace.correlation_id
+            # Health checks and scrapes would drown out the payment traces
+            if trace.spans or request.path not in ('/api/health', '/metrics'):
+                emit_trace(trace.summary(response.status_code))
+        return response
+
+    @app.teardown_request
+    def clear_trace(exc):
+        token = g.pop('payment_trace_token', None)
+        if token is not None:
+            _current_trace.reset(token)
+
+    return app
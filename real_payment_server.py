@@ -11,7 +11,15 @@ import os
 import json
 import uuid
 from datetime import datetime
-import traceback
+from fast_json import install_json
+from http_cache import install_compression
+from payment_tracing import install_tracing, span, tag
+from gateway_guard import GatewayUnavailable, unavailable_response
+from balance_cache import balance_response
+from momo_client import client_for, clients, tenant_from
+from server_logging import get_logger
+from payment_store import (IdempotencyConflict, TransactionStore, bulk_status_response,
+                           idempotency_key, replay_payload, stream_listing)
 
 # Add current directory to Python path to import pay module
 sys.path.append(os.path.dirname(__file__))
@@ -24,11 +32,17 @@ except ImportError as e:
     print("Make sure pay.py is in the same directory")
     sys.exit(1)
 
+log = get_logger('payments')
+
 app = Flask(__name__)
 CORS(app)
+install_json(app)
+install_compression(app)
+install_tracing(app)
 
 # In-memory storage for payment transactions
-payment_transactions = {}
+payment_transactions = TransactionStore('real_payment_server')
+LISTING_FIELDS = ['transaction_id', 'order_id', 'amount', 'currency', 'status', 'created_at']
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -38,7 +52,8 @@ def health_check():
         'message': 'Real MTN MOMO Payment Server is running',
         'timestamp': datetime.now().isoformat(),
         'environment': PayClass.environment_mode,
-        'api_url': PayClass.accurl
+        'api_url': PayClass.accurl,
+        'tenants': clients.tenants()
     })
 
 @app.route('/api/payment/initiate', methods=['POST'])
@@ -66,46 +81,59 @@ def initiate_payment():
         # Create payer message
         payer_message = f'Payment for order {order_id} by {customer_name}'
         
-        # Generate unique transaction ID
-        transaction_id = str(uuid.uuid4())
+        # Each merchant account has its own MoMo client; unknown merchants are a 400
+        tenant = tenant_from(request, data)
+        client = client_for(tenant)
         
-        print(f'🚀 Initiating MTN MOMO payment:')
-        print(f'   Amount: {amount} {currency}')
-        print(f'   Phone: {phone_number}')
-        print(f'   Order ID: {order_id}')
-        print(f'   Customer: {customer_name}')
-        print(f'   Transaction ID: {transaction_id}')
+        # Retried checkouts (double click, network retry) reuse the first transaction
+        key = f'{tenant}/{idempotency_key(request, order_id)}'
+        with payment_transactions.idempotent(key, order_id=order_id, amount=amount,
+                                             phone_number=phone_number) as existing:
+            if existing is not None:
+                tag(order_id=order_id, transaction_id=existing['transaction_id'])
+                log.info('payment_replayed', idempotency_key=key, status=existing['status'])
+                return jsonify(replay_payload(existing))
+
+            # Generate unique transaction ID
+            transaction_id = str(uuid.uuid4())
+            tag(order_id=order_id, transaction_id=transaction_id)
         
-        # Call MTN MOMO API
-        payment_result = PayClass.momopay(
-            amount=amount,
-            currency=currency,
-            txt_ref=transaction_id,  # Use transaction_id as reference
-            phone_number=phone_number,
-            payermessage=payer_message
-        )
+            log.info('payment_initiating', amount=amount, currency=currency,
+                     phone_number=phone_number, customer_name=customer_name)
         
-        print(f'📱 MTN MOMO API Response: {payment_result}')
+            # Call MTN MOMO API
+            with span('initiate', operation='requesttopay'):
+                payment_result = client.momopay(
+                    amount=amount,
+                    currency=currency,
+                    txt_ref=transaction_id,  # Use transaction_id as reference
+                    phone_number=phone_number,
+                    payermessage=payer_message
+                )
         
-        # Store transaction details
-        transaction_data = {
-            'transaction_id': transaction_id,
-            'order_id': order_id,
-            'amount': amount,
-            'currency': currency,
-            'phone_number': phone_number,
-            'customer_name': customer_name,
-            'customer_email': data.get('customer_email', ''),
-            'payer_message': payer_message,
-            'payment_result': payment_result,
-            'status': 'initiated',
-            'created_at': datetime.now().isoformat(),
-            'last_verified': None
-        }
+            log.info('gateway_response', operation='requesttopay', result=payment_result)
+        
+            # Store transaction details; rejected attempts may be retried
+            accepted = bool(isinstance(payment_result, dict) and payment_result.get('response') == 202)
+            transaction_data = {
+                'transaction_id': transaction_id,
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'phone_number': phone_number,
+                'customer_name': customer_name,
+                'customer_email': data.get('customer_email', ''),
+                'payer_message': payer_message,
+                'payment_result': payment_result,
+                'tenant': tenant,
+                'status': 'initiated' if accepted else 'failed',
+                'created_at': datetime.now().isoformat(),
+                'last_verified': None
+            }
         
-        # Store by both transaction_id and order_id for easy lookup
-        payment_transactions[transaction_id] = transaction_data
-        payment_transactions[order_id] = transaction_data
+            # One record, indexed by transaction_id, order_id and idempotency key
+            with span('store_write'):
+                payment_transactions.add(transaction_data, key)
         
         # Check if payment initiation was successful
         if payment_result and isinstance(payment_result, dict):
@@ -132,14 +160,21 @@ def initiate_payment():
                 'details': payment_result
             }), 500
             
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except ValueError as e:
         return jsonify({
             'success': False,
             'error': f'Invalid data format: {str(e)}'
         }), 400
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f'❌ Payment initiation error: {str(e)}')
-        print(f'❌ Traceback: {traceback.format_exc()}')
+        log.exception('payment_initiation_failed')
         return jsonify({
             'success': False,
             'error': f'Payment initiation failed: {str(e)}'
@@ -149,36 +184,37 @@ def initiate_payment():
 def verify_payment(transaction_id):
     """Verify the status of a payment transaction"""
     try:
-        # Check if transaction exists
-        if transaction_id not in payment_transactions:
+        # Other merchants' transactions read as missing
+        transaction = payment_transactions.get(transaction_id, tenant=tenant_from(request))
+        if transaction is None:
             return jsonify({
                 'success': False,
                 'error': 'Transaction not found'
             }), 404
         
-        transaction = payment_transactions[transaction_id]
-        
         # Get the reference ID from the original payment result
         reference_id = transaction['payment_result'].get('ref', transaction_id)
         
-        print(f'🔍 Verifying payment for transaction: {transaction_id}')
-        print(f'🔍 Using reference ID: {reference_id}')
-        
         # Call MTN MOMO verification API
-        verification_result = PayClass.verifymomo(reference_id)
+        tag(transaction_id=transaction_id, reference_id=reference_id)
+        with span('verify', operation='requesttopay_status'):
+            verification_result = client_for(transaction.get('tenant')).verifymomo(reference_id)
         
-        print(f'📋 Verification result: {verification_result}')
+        # Clients poll verify every few seconds; keep a sample of the results
+        log.info('gateway_response', sample=0.1, operation='requesttopay_status',
+                 result=verification_result)
         
         # Update transaction with verification result
-        transaction['verification_result'] = verification_result
-        transaction['last_verified'] = datetime.now().isoformat()
+        with span('store_write'):
+            transaction['verification_result'] = verification_result
+            transaction['last_verified'] = datetime.now().isoformat()
         
         # Parse verification result
         if verification_result and isinstance(verification_result, dict):
             status = verification_result.get('status', '').upper()
             
             if status == 'SUCCESSFUL':
-                transaction['status'] = 'completed'
+                payment_transactions.set_status(transaction, 'completed')
                 return jsonify({
                     'success': True,
                     'status': 'completed',
@@ -187,7 +223,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
             elif status == 'FAILED':
-                transaction['status'] = 'failed'
+                payment_transactions.set_status(transaction, 'failed')
                 return jsonify({
                     'success': False,
                     'status': 'failed',
@@ -196,7 +232,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
             elif status == 'PENDING':
-                transaction['status'] = 'pending'
+                payment_transactions.set_status(transaction, 'pending')
                 return jsonify({
                     'success': False,
                     'status': 'pending',
@@ -206,7 +242,7 @@ def verify_payment(transaction_id):
                 })
             else:
                 # Unknown status, treat as pending
-                transaction['status'] = 'pending'
+                payment_transactions.set_status(transaction, 'pending')
                 return jsonify({
                     'success': False,
                     'status': 'pending',
@@ -216,7 +252,7 @@ def verify_payment(transaction_id):
                 })
         else:
             # No valid verification result, treat as pending
-            transaction['status'] = 'pending'
+            payment_transactions.set_status(transaction, 'pending')
             return jsonify({
                 'success': False,
                 'status': 'pending',
@@ -225,24 +261,41 @@ def verify_payment(transaction_id):
                 'verification_result': verification_result
             })
             
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f'❌ Payment verification error: {str(e)}')
-        print(f'❌ Traceback: {traceback.format_exc()}')
+        log.exception('payment_verification_failed')
         return jsonify({
             'success': False,
             'error': f'Payment verification failed: {str(e)}'
         }), 500
 
+@app.route('/api/payment/status', methods=['GET', 'POST'])
+def get_payment_statuses():
+    """Payment status of many orders at once (order history pages)
+
+    Query: order_ids=a,b,c, or POST {"order_ids": [...]}; at most 100
+    """
+    try:
+        return bulk_status_response(payment_transactions, request, tenant_from(request))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
+
 @app.route('/api/payment/status/<transaction_id>', methods=['GET'])
 def get_payment_status(transaction_id):
     """Get the current status of a payment transaction"""
-    if transaction_id not in payment_transactions:
+    # Other merchants' transactions read as missing
+    transaction = payment_transactions.get(transaction_id, tenant=tenant_from(request))
+    if transaction is None:
         return jsonify({
             'success': False,
             'error': 'Transaction not found'
         }), 404
     
-    transaction = payment_transactions[transaction_id]
     return jsonify({
         'success': True,
         'transaction': {
@@ -256,29 +309,43 @@ def get_payment_status(transaction_id):
         }
     })
 
+@app.route('/api/balance', methods=['GET'])
+def get_balance():
+    """Collections and disbursement balances, cached for a few seconds (admin dashboard)
+
+    Query: account=collections|disbursements, refresh=1 to bypass the cache
+    """
+    try:
+        return balance_response(request.args, tenant_from(request))
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
+    except Exception as e:
+        log.exception('balance_check_failed')
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get balance: {str(e)}'
+        }), 500
+
 @app.route('/api/transactions', methods=['GET'])
 def list_transactions():
-    """List all payment transactions (for debugging)"""
-    transactions = []
-    seen_ids = set()
-    
-    for tid, transaction in payment_transactions.items():
-        if tid not in seen_ids:
-            transactions.append({
-                'transaction_id': transaction['transaction_id'],
-                'order_id': transaction['order_id'],
-                'amount': transaction['amount'],
-                'currency': transaction['currency'],
-                'status': transaction['status'],
-                'created_at': transaction['created_at']
-            })
-            seen_ids.add(transaction['transaction_id'])
-    
-    return jsonify({
-        'success': True,
-        'transactions': transactions,
-        'total': len(transactions)
-    })
+    """List payment transactions, newest first, one page at a time (for debugging)
+
+    Query: limit, cursor (next_cursor of the previous page), order=asc|desc,
+    status, from/to (ISO dates), min_amount/max_amount, fields (comma separated)
+    """
+    try:
+        return stream_listing(payment_transactions, request.args, LISTING_FIELDS)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
 
 if __name__ == '__main__':
     print('🚀 Starting Real MTN MOMO Payment Server')
@@ -289,4 +356,5 @@ if __name__ == '__main__':
     print('🔄 CORS enabled for React frontend')
     print('=' * 50)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    from serve import run_server
+    run_server('real_payment_server', app)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Settlement reconciliation against MTN MOMO
+Reads the stored transactions (every server's payment event log plus the disk
+archive) in a date range, asks MoMo for the status of every one that is not
+settled (or of all of them with --all), and reports status/amount mismatches
+and totals per currency. Status checks run on a thread pool; tokens are shared
+through each tenant's MomoClient and calls draw on the subscription key quota.
+Only collections (requesttopay) are reconciled: disbursement transfers are not
+recorded by the payment servers, so there is nothing to compare them with.
+
+Usage:
+    python reconcile.py --from 2025-01-01 --to 2025-01-31
+    python reconcile.py --from 2025-01-01 --all --workers 32 --rate 50 --output report.json
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from gateway_guard import GatewayUnavailable
+from gateway_quota import quota_for
+from momo_client import client_for
+from payment_events import fold, replay
+from payment_store import TERMINAL_STATUSES
+
+# Local status each MoMo status should have been recorded as
+GATEWAY_STATUS = {'SUCCESSFUL': 'completed', 'FAILED': 'failed', 'REJECTED': 'failed',
+                  'TIMEOUT': 'failed', 'PENDING': 'pending'}
+MAX_ATTEMPTS = 10
+
+def in_range(transaction, start, end):
+    try:
+        created = datetime.fromisoformat(transaction.get('created_at') or '')
+    except ValueError:
+        return False
+    return (start is None or created >= start) and (end is None or created < end)
+
+def event_directories(event_dir):
+    """The servers' event logs under a base directory (or event_dir itself if it is one)"""
+    if not event_dir or not os.path.isdir(event_dir):
+        return []
+    if any(name.endswith('.jsonl') for name in os.listdir(event_dir)):
+        return [event_dir]
+    return sorted(entry.path for entry in os.scandir(event_dir) if entry.is_dir())
+
+def load_transactions(event_dir, archive_dir, start, end):
+    """Live transactions from the event log and settled ones from the archive, by transaction ID"""
+    transactions = {}
+    if archive_dir and os.path.isdir(archive_dir):
+        for path in sorted(glob.glob(os.path.join(archive_dir, 'transactions-*.jsonl'))):
+            # Archived on that day, so it cannot hold transactions created later
+            day = os.path.basename(path)[len('transactions-'):-len('.jsonl')]
+            if start is not None and day < start.strftime('%Y-%m-%d'):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        transaction = json.loads(line)
+                    except ValueError:
+                        continue
+                    if in_range(transaction, start, end):
+                        transactions[transaction.get('transaction_id')] = transaction
+    for directory in event_directories(event_dir):
+        for transaction_id, (_, _, data, _) in fold(replay(directory)).items():
+            if in_range(data, start, end):
+                transactions[transaction_id] = data
+    return transactions
+
+def reference_of(transaction):
+    """MoMo reference (X-Reference-Id) the payment was sent with, if it reached MoMo"""
+    result = transaction.get('payment_result')
+    if isinstance(result, dict) and result.get('response') in (202, '202'):
+        return result.get('ref')
+    return None
+
+def check(transaction):
+    """Gateway status of one collection, retrying while the gateway sheds load"""
+    client = client_for(transaction.get('tenant'))
+    reference = reference_of(transaction)
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return client.verifymomo(reference)
+        except GatewayUnavailable as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(min(e.retry_after, 0.05 * 2 ** attempt))
+
+def compare(transaction, gateway):
+    """Mismatch description, or None when the stored transaction agrees with MoMo"""
+    gateway_status = str(gateway.get('status', '')).upper()
+    expected = GATEWAY_STATUS.get(gateway_status)
+    local = transaction.get('status')
+    problems = []
+    if expected is None:
+        problems.append(f'unknown gateway status {gateway_status or gateway!r}')
+    elif expected != local and not (expected == 'pending' and local == 'initiated'):
+        problems.append(f'status {local} locally, {gateway_status} at MoMo')
+    if gateway.get('amount') is not None:
+        try:
+            if abs(float(gateway['amount']) - float(transaction.get('amount') or 0)) > 0.005:
+                problems.append(f"amount {transaction.get('amount')} locally, {gateway['amount']} at MoMo")
+        except (TypeError, ValueError):
+            problems.append(f"unreadable gateway amount {gateway['amount']!r}")
+    if not problems:
+        return None
+    return {
+        'transaction_id': transaction.get('transaction_id'),
+        'order_id': transaction.get('order_id'),
+        'tenant': transaction.get('tenant'),
+        'reference_id': reference_of(transaction),
+        'local_status': local,
+        'gateway_status': gateway_status,
+        'problems': problems
+    }
+
+def reconcile(transactions, workers=16, check_all=False, rate=None):
+    """Check transactions concurrently; returns the report dict"""
+    to_check = [t for t in transactions.values()
+                if reference_of(t) and (check_all or t.get('status') not in TERMINAL_STATUSES)]
+    if rate:
+        # Pre-create the buckets so this run's rate applies to every key it touches
+        for tenant in set(t.get('tenant') for t in to_check):
+            for product in client_for(tenant).products.values():
+                quota_for(product.subkey, rate=rate, burst=rate)
+
+    mismatches = []
+    errors = []
+    settled = {}
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [(transaction, pool.submit(check, transaction)) for transaction in to_check]
+        for transaction, future in futures:
+            try:
+                gateway = future.result()
+            except Exception as e:
+                errors.append({'transaction_id': transaction.get('transaction_id'), 'error': str(e)})
+                continue
+            mismatch = compare(transaction, gateway)
+            if mismatch:
+                mismatches.append(mismatch)
+            settled[transaction.get('transaction_id')] = GATEWAY_STATUS.get(
+                str(gateway.get('status', '')).upper(), transaction.get('status'))
+
+    totals = {}
+    for transaction in transactions.values():
+        status = settled.get(transaction.get('transaction_id'), transaction.get('status'))
+        by_status = totals.setdefault(transaction.get('currency') or 'unknown', {})
+        entry = by_status.setdefault(status, {'count': 0, 'amount': 0.0})
+        entry['count'] += 1
+        entry['amount'] = round(entry['amount'] + float(transaction.get('amount') or 0), 2)
+
+    return {
+        'transactions': len(transactions),
+        'checked': len(to_check),
+        'seconds': round(time.monotonic() - started, 1),
+        'mismatches': mismatches,
+        'errors': errors,
+        'totals': totals
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile stored payments with MTN MOMO')
+    parser.add_argument('--from', dest='start', type=datetime.fromisoformat, help='created at or after (ISO date)')
+    parser.add_argument('--to', dest='end', type=datetime.fromisoformat, help='created before (ISO date)')
+    parser.add_argument('--all', action='store_true', help='also re-check settled transactions')
+    parser.add_argument('--workers', type=int, default=16, help='concurrent status checks, default 16')
+    parser.add_argument('--rate', type=float, help='requests per second per subscription key (default MOMO_QUOTA_RPS)')
+    parser.add_argument('--event-dir', default=os.environ.get('PAYMENT_EVENT_DIR', 'payment_events'))
+    parser.add_argument('--archive-dir', default=os.environ.get('PAYMENT_ARCHIVE_DIR', 'payment_archive'))
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    transactions = load_transactions(args.event_dir, args.archive_dir, args.start, args.end)
+    report = reconcile(transactions, args.workers, args.all, args.rate)
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    print(f"🔎 {report['checked']} of {report['transactions']} transactions checked in {report['seconds']} s: "
+          f"{len(report['mismatches'])} mismatches, {len(report['errors'])} errors", file=sys.stderr)
+    return 1 if report['mismatches'] or report['errors'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Gifted Solutions payment and chatbot servers
+Serves any of the Flask apps under gunicorn (multi-worker, preloaded) when it
+is installed, else waitress, else a threaded Werkzeug server without the
+debugger. SIGTERM drains in-flight requests before the process exits.
+
+Usage:
+    python serve.py real_payment_server --threads 16
+    python serve.py chatbot_ai_server --workers 4 --threads 4
+    python serve.py simple_ai_server --check             # startup benchmark only
+    FLASK_DEBUG=1 python serve.py demo_payment_server    # dev server with reloader
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import importlib
+import importlib.util
+import threading
+
+from server_logging import get_logger
+
+log = get_logger('serve')
+
+# Payment servers keep transactions in a per-process dict, so a verify must
+# land on the worker that handled the initiate: one worker, many threads.
+APPS = {
+    'real_payment_server': {'port': 5000, 'max_workers': 1},
+    'simple_real_payment_server': {'port': 5000, 'max_workers': 1},
+    'payment_server': {'port': 5000, 'max_workers': 1},
+    'simple_payment_server': {'port': 5000, 'max_workers': 1},
+    'demo_payment_server': {'port': 5000, 'max_workers': 1},
+    'chatbot_ai_server': {'port': 5001, 'max_workers': None},
+    'simple_ai_server': {'port': 5001, 'max_workers': None},
+    'gs.ai_chatbot_server': {'port': 5001, 'max_workers': None},
+    # The SDK's example servers live under hyphenated directories, so load them by path
+    'sdk.mtn_payment_server': {'port': 5000, 'max_workers': 1,
+                               'path': 'Wit-MTN-MOMO-API-Python-SDK-main/gs/gifted-solutions/mtn_payment_server.py'},
+    'sdk.payment_server': {'port': 5000, 'max_workers': 1,
+                           'path': 'Wit-MTN-MOMO-API-Python-SDK-main/gs/gifted-solutions/payment-server/app.py'},
+}
+
+class DrainingMiddleware:
+    """Counts in-flight requests and turns new ones away once draining starts"""
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self.draining = False
+        self._idle = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        if self.draining:
+            start_response('503 Service Unavailable', [
+                ('Content-Type', 'application/json'), ('Retry-After', '5'), ('Connection', 'close')])
+            return [b'{"success": false, "error": "Server is shutting down"}']
+
+        with self._idle:
+            self.active += 1
+        try:
+            result = self.app(environ, start_response)
+        except BaseException:
+            self._finished()
+            raise
+        return _ClosingIterable(result, self._finished)
+
+    def _finished(self):
+        with self._idle:
+            self.active -= 1
+            if self.active == 0:
+                self._idle.notify_all()
+
+    def drain(self, timeout):
+        """Stop accepting requests and wait for the in-flight ones; True if all finished"""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        with self._idle:
+            while self.active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+class _ClosingIterable:
+    """WSGI response wrapper that reports when the server is done sending it"""
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+def peak_rss_mib():
+    """Peak resident set size of this process, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def load_app(name, app=None):
+    """Import a server module (building its shared state) unless given its app, and time it"""
+    started = time.perf_counter()
+    if app is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, root)
+        path = APPS[name].get('path')
+        if path:
+            spec = importlib.util.spec_from_file_location(name, os.path.join(root, path))
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            app = module.app
+        else:
+            app = importlib.import_module(name).app
+    import_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    health = app.test_client().get('/api/health')
+    first_request_ms = (time.perf_counter() - started) * 1000
+
+    timings = {
+        'app': name,
+        'import_ms': round(import_ms, 1),
+        'first_request_ms': round(first_request_ms, 2),
+        'health_status': health.status_code,
+        'peak_rss_mib': peak_rss_mib()
+    }
+    return app, timings
+
+def serve_gunicorn(app, middleware, options):
+    """Pre-fork gunicorn with threaded workers; the app is already loaded (preload)"""
+    from gunicorn.app.base import BaseApplication
+
+    def worker_exit(server, worker):
+        log.info('worker_exit', pid=worker.pid, in_flight=middleware.active)
+
+    settings = dict(options, worker_exit=worker_exit)
+
+    class PreloadedApplication(BaseApplication):
+        def load_config(self):
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return middleware
+
+    PreloadedApplication().run()
+
+def serve_waitress(app, middleware, args):
+    """Single-process waitress server (Windows and gunicorn-less installs)"""
+    from waitress import create_server
+
+    server = create_server(middleware, host=args.host, port=args.port, threads=args.threads)
+
+    def shutdown(signum, frame):
+        def drain_and_close():
+            drained = middleware.drain(args.graceful_timeout)
+            log.info('drained', clean=drained, in_flight=middleware.active)
+            server.close()
+            server.task_dispatcher.shutdown()
+        threading.Thread(target=drain_and_close, daemon=True).start()
+
+    install_signal_handlers(shutdown)
+    server.run()
+
+def serve_werkzeug(app, middleware, args):
+    """Threaded Werkzeug server without reloader or debugger, as a last resort"""
+    from werkzeug.serving import make_server
+
+    server = make_server(args.host, args.port, middleware, threaded=True)
+
+    def shutdown(signum, frame):
+        def drain_and_stop():
+            drained = middleware.drain(args.graceful_timeout)
+            log.info('drained', clean=drained, in_flight=middleware.active)
+            server.shutdown()
+        threading.Thread(target=drain_and_stop, daemon=True).start()
+
+    install_signal_handlers(shutdown)
+    server.serve_forever()
+
+def install_signal_handlers(handler):
+    for name in ('SIGTERM', 'SIGINT'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), handler)
+
+def choose_backend(requested):
+    """First installed server from the preference order (or the requested one)"""
+    order = [requested] if requested != 'auto' else ['gunicorn', 'waitress', 'werkzeug']
+    for backend in order:
+        if backend == 'gunicorn' and os.name == 'nt':
+            continue
+        try:
+            importlib.import_module(backend)
+            return backend
+        except ImportError:
+            continue
+    raise SystemExit(f'❌ No usable server backend among: {", ".join(order)}')
+
+def run_server(app_name, app=None, host='0.0.0.0', port=None, workers=None, threads=None,
+               backend='auto', graceful_timeout=30, check=False):
+    """Load one app and serve it; shared by the CLI and the servers' __main__ blocks"""
+    settings = APPS[app_name]
+    port = port or settings['port']
+    if os.environ.get('FLASK_DEBUG') == '1':
+        # Local development keeps the reloader and debugger
+        app = app or load_app(app_name)[0]
+        app.run(host=host, port=port, debug=True)
+        return None
+    requested = workers or int(os.environ.get('WEB_CONCURRENCY', 0))
+    workers = requested or (os.cpu_count() or 1) + 1
+    if settings['max_workers'] and workers > settings['max_workers']:
+        if requested:
+            log.warning('workers_capped', app=app_name, requested=workers,
+                        workers=settings['max_workers'], reason='per-process payment store')
+        workers = settings['max_workers']
+    threads = threads or int(os.environ.get('SERVER_THREADS', 8))
+
+    app, timings = load_app(app_name, app)
+    log.info('startup_benchmark', **timings)
+    if check:
+        print(f"⏱️  {app_name}: import {timings['import_ms']} ms, "
+              f"first request {timings['first_request_ms']} ms, "
+              f"peak RSS {timings['peak_rss_mib']} MiB")
+        return timings
+
+    backend = choose_backend(backend)
+    middleware = DrainingMiddleware(app)
+    args = argparse.Namespace(host=host, port=port, threads=threads,
+                              graceful_timeout=graceful_timeout)
+    log.info('server_starting', app=app_name, backend=backend, host=host, port=port,
+             workers=workers if backend == 'gunicorn' else 1, threads=threads)
+
+    if backend == 'gunicorn':
+        serve_gunicorn(app, middleware, {
+            'bind': f'{host}:{port}',
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'preload_app': True,
+            'graceful_timeout': graceful_timeout,
+            'timeout': max(graceful_timeout, 60),
+        })
+    elif backend == 'waitress':
+        serve_waitress(app, middleware, args)
+    else:
+        serve_werkzeug(app, middleware, args)
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a Gifted Solutions Flask app')
+    parser.add_argument('app', choices=sorted(APPS))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, help='default: 5000 for payments, 5001 for chatbots')
+    parser.add_argument('--workers', type=int, help='processes (gunicorn only), default WEB_CONCURRENCY or CPUs + 1')
+    parser.add_argument('--threads', type=int, help='threads per worker, default SERVER_THREADS or 8')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'gunicorn', 'waitress', 'werkzeug'])
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds to let in-flight payments finish on shutdown')
+    parser.add_argument('--check', action='store_true', help='load the app, report startup timings and exit')
+    args = parser.parse_args()
+
+    run_server(args.app, host=args.host, port=args.port, workers=args.workers, threads=args.threads,
+               backend=args.backend, graceful_timeout=args.graceful_timeout, check=args.check)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Structured logging for the Gifted Solutions servers
+JSON log lines written by a background thread, so request threads only pay
+for a queue put. Supports levels, per-event sampling and masks phone numbers.
+
+Settings (environment):
+    LOG_LEVEL        minimum level, default INFO
+    LOG_SAMPLING     set to 0 to log every sampled event (debugging)
+    LOG_QUEUE_SIZE   records buffered before new ones are dropped, default 10000
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import random
+import logging
+import threading
+import logging.handlers
+
+from server_metrics import registry
+
+PHONE_FIELDS = frozenset(['phone', 'phone_number', 'msisdn', 'partyId', 'party_id'])
+PHONE_PATTERN = re.compile(r'(?<!\d)(\+?\d{3})(\d{3,9})(\d{3})(?!\d)')
+UUID_PATTERN = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+
+DROPPED = registry.counter('log_records_dropped_total', 'Log records dropped because the queue was full')
+
+_context_providers = []
+_setup_lock = threading.Lock()
+_listener = None
+
+def mask_phone(value):
+    """Keep the country prefix and last three digits of a phone number"""
+    digits = str(value)
+    if len(digits) <= 6:
+        return '*' * len(digits)
+    return digits[:3] + '*' * (len(digits) - 6) + digits[-3:]
+
+def mask_text(text):
+    """Mask anything that looks like a phone number inside free text"""
+    if not any(char.isdigit() for char in text):
+        return text
+    # Reference and transaction IDs are UUIDs whose digit runs must survive
+    protected = UUID_PATTERN.split(text)
+    uuids = UUID_PATTERN.findall(text)
+    masked = [PHONE_PATTERN.sub(lambda m: mask_phone(m.group(0)), part) for part in protected]
+    return ''.join(part + (uuids[i] if i < len(uuids) else '') for i, part in enumerate(masked))
+
+def scrub(value, key=None):
+    """Mask phone numbers in a log field, recursing into dicts and lists"""
+    if key in PHONE_FIELDS and value not in (None, ''):
+        return mask_phone(value)
+    if isinstance(value, str):
+        return mask_text(value)
+    if isinstance(value, dict):
+        return {k: scrub(v, k) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [scrub(item) for item in value]
+    return value
+
+def add_context_provider(provider):
+    """Register a callable returning fields (e.g. correlation_id) for every record"""
+    _context_providers.append(provider)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the event name and its fields"""
+
+    def format(self, record):
+        data = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage()
+        }
+        data.update(getattr(record, 'context', None) or {})
+        data.update(scrub(getattr(record, 'fields', None) or {}))
+        if record.exc_info:
+            data['error'] = mask_text(self.formatException(record.exc_info))
+        return json.dumps(data, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that never blocks: a full queue drops and counts the record"""
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+def setup_logging(stream=None):
+    """Start the background log writer once per process"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        records = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', '10000')))
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        root = logging.getLogger('giftedsolutions')
+        root.handlers[:] = [DroppingQueueHandler(records)]
+        root.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+        root.propagate = False
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def _restart_after_fork():
+    """Forked workers inherit the queue but not the writer thread; start a fresh one"""
+    global _listener, _setup_lock
+    _setup_lock = threading.Lock()
+    if _listener is not None:
+        _listener = None
+        setup_logging()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+class StructuredLogger:
+    """Logs an event name plus keyword fields, e.g. log.info('payment_initiated', order_id=...)"""
+
+    def __init__(self, name):
+        self._logger = logging.getLogger('giftedsolutions.' + name)
+        self._sampling = os.environ.get('LOG_SAMPLING', '1') != '0'
+
+    def _log(self, level, event, fields, sample=1.0, exc_info=None):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample < 1.0 and self._sampling:
+            if random.random() >= sample:
+                return
+            fields['sample_rate'] = sample
+        context = {}
+        for provider in _context_providers:
+            context.update(provider() or {})
+        self._logger.log(level, event, exc_info=exc_info,
+                         extra={'fields': fields, 'context': context})
+
+    def debug(self, event, sample=1.0, **fields):
+        self._log(logging.DEBUG, event, fields, sample)
+
+    def info(self, event, sample=1.0, **fields):
+        self._log(logging.INFO, event, fields, sample)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """Error with the current traceback attached; never sampled"""
+        self._log(logging.ERROR, event, fields, exc_info=sys.exc_info())
+
+def get_logger(name):
+    """Structured logger for one server component"""
+    setup_logging()
+    return StructuredLogger(name)
@@ -0,0 +1,253 @@
+"""
+In-process metrics for the Gifted Solutions Flask servers
+Counters and histograms with a Prometheus text exposition at /metrics,
+plus an optional sampling profiler that keeps profiles of slow requests.
+"""
+
+import os
+import time
+import random
+import cProfile
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def format_labels(names, values):
+    """Render a label set as {name="value",...}"""
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, format_labels(self.labelnames, key), value
+
+class Gauge:
+    """Current value that can go up and down, optionally split by labels"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, format_labels(self.labelnames, key), value
+
+class Histogram:
+    """Cumulative bucket histogram of observed durations, in seconds"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        # Bucket index found outside the lock keeps the critical section tiny
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with-block takes"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(counts), total, count)
+                     for key, (counts, total, count) in self._series.items()]
+        bucket_labels = self.labelnames + ('le',)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield self.name + '_bucket', format_labels(bucket_labels, key + (le,)), cumulative
+            labels = format_labels(self.labelnames, key)
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+class MetricsRegistry:
+    """Named metrics of one process, rendered in Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self):
+        """Prometheus text exposition of every metric"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {value}')
+        return '\n'.join(lines) + '\n'
+
+# Shared by every server module in the process
+registry = MetricsRegistry()
+
+class SlowRequestProfiler:
+    """Profiles a sample of requests and keeps the ones slower than a threshold
+
+    Enabled with PROFILE_SLOW_REQUESTS_MS; PROFILE_SAMPLE_RATE (default 0.01)
+    picks the fraction of requests profiled and PROFILE_DIR where the .prof
+    files go. Only one request is profiled at a time.
+    """
+
+    def __init__(self, threshold_ms, sample_rate, directory):
+        self.threshold = threshold_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self._busy = threading.Lock()
+
+    @classmethod
+    def from_environment(cls):
+        threshold = os.environ.get('PROFILE_SLOW_REQUESTS_MS')
+        if not threshold:
+            return None
+        return cls(float(threshold),
+                   float(os.environ.get('PROFILE_SAMPLE_RATE', '0.01')),
+                   os.environ.get('PROFILE_DIR', 'profiles'))
+
+    def start(self):
+        """Return a running profiler for this request, or None"""
+        if random.random() >= self.sample_rate or not self._busy.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiling tool is active
+            self._busy.release()
+            return None
+        return profiler
+
+    def finish(self, profiler, duration, endpoint):
+        """Stop profiling and save the profile if the request was slow"""
+        profiler.disable()
+        try:
+            if duration >= self.threshold:
+                os.makedirs(self.directory, exist_ok=True)
+                filename = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{int(duration * 1000)}ms.prof"
+                path = os.path.join(self.directory, filename)
+                profiler.dump_stats(path)
+                # Imported here: server_logging itself imports this module
+                from server_logging import get_logger
+                get_logger('metrics').warning('slow_request_profile', path=path, endpoint=endpoint,
+                                              duration_ms=int(duration * 1000))
+        finally:
+            self._busy.release()
+
+def install_metrics(app, metrics=registry):
+    """Time every request of a Flask app and expose /metrics"""
+    from flask import Response, g, request
+
+    request_duration = metrics.histogram(
+        'http_request_duration_seconds', 'HTTP request latency by endpoint',
+        ('method', 'endpoint', 'status'))
+    profiler = SlowRequestProfiler.from_environment()
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_profiler = profiler.start() if profiler else None
+
+    @app.after_request
+    def observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            duration = time.perf_counter() - started
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            request_duration.observe(duration, method=request.method,
+                                     endpoint=endpoint, status=response.status_code)
+            active_profiler = g.pop('metrics_profiler', None)
+            if active_profiler is not None:
+                profiler.finish(active_profiler, duration, request.endpoint or 'unmatched')
+        return response
+
+    @app.teardown_request
+    def release_profiler(exc):
+        # Unhandled errors skip after_request; never leave the profiler running
+        active_profiler = g.pop('metrics_profiler', None)
+        if active_profiler is not None:
+            profiler.finish(active_profiler, 0.0, request.endpoint or 'unmatched')
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        """Prometheus metrics endpoint"""
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    return metrics
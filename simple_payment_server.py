@@ -3,12 +3,23 @@ from flask_cors import CORS
 import json
 import uuid
 from datetime import datetime
+from fast_json import install_json
+from http_cache import install_compression
+from payment_tracing import install_tracing, tag
+from server_logging import get_logger
+from payment_store import (IdempotencyConflict, TransactionStore, bulk_status_response,
+                           idempotency_key, replay_payload, stream_listing)
+
+log = get_logger('payments')
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
+install_json(app)
+install_compression(app)
+install_tracing(app)
 
 # Store payment transactions in memory (in production, use a database)
-payment_transactions = {}
+payment_transactions = TransactionStore('simple_payment_server')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -41,37 +52,47 @@ def initiate_payment():
         customer_name = str(data['customer_name'])
         currency = data.get('currency', 'EUR')  # Default to EUR for sandbox
         
-        # Generate unique transaction ID
-        transaction_id = str(uuid.uuid4())
+        # Retried checkouts (double click, network retry) reuse the first transaction
+        key = idempotency_key(request, order_id)
+        with payment_transactions.idempotent(key, order_id=order_id, amount=amount,
+                                             phone_number=phone_number) as existing:
+            if existing is not None:
+                tag(order_id=order_id, transaction_id=existing['transaction_id'])
+                log.info('payment_replayed', idempotency_key=key, status=existing['status'])
+                return jsonify(replay_payload(existing))
+
+            # Generate unique transaction ID
+            transaction_id = str(uuid.uuid4())
+            tag(order_id=order_id, transaction_id=transaction_id)
         
-        print(f"Initiating payment: Amount={amount}, Phone={phone_number}, Order={order_id}")
+            log.info('payment_initiating', amount=amount, currency=currency, phone_number=phone_number)
         
-        # For demo purposes, simulate a successful payment initiation
-        # In production, this would call the actual MTN MOMO API
-        payment_result = {
-            'success': True,
-            'message': 'Payment initiated successfully',
-            'transaction_id': transaction_id,
-            'reference': order_id
-        }
+            # For demo purposes, simulate a successful payment initiation
+            # In production, this would call the actual MTN MOMO API
+            payment_result = {
+                'success': True,
+                'message': 'Payment initiated successfully',
+                'transaction_id': transaction_id,
+                'reference': order_id
+            }
         
-        print(f"Payment result: {payment_result}")
+            log.info('gateway_response', operation='requesttopay', result=payment_result)
         
-        # Store transaction details
-        payment_transactions[transaction_id] = {
-            'order_id': order_id,
-            'amount': amount,
-            'currency': currency,
-            'phone_number': phone_number,
-            'customer_name': customer_name,
-            'payment_result': payment_result,
-            'status': 'initiated',
-            'created_at': datetime.now().isoformat(),
-            'transaction_id': transaction_id
-        }
-        
-        # Also store by order_id for easy lookup
-        payment_transactions[order_id] = payment_transactions[transaction_id]
+            # Store transaction details
+            transaction_data = {
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'phone_number': phone_number,
+                'customer_name': customer_name,
+                'payment_result': payment_result,
+                'status': 'initiated',
+                'created_at': datetime.now().isoformat(),
+                'transaction_id': transaction_id
+            }
+        
+            # One record, indexed by transaction_id, order_id and idempotency key
+            payment_transactions.add(transaction_data, key)
         
         return jsonify({
             'success': True,
@@ -81,8 +102,13 @@ def initiate_payment():
             'payment_result': payment_result
         })
             
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except Exception as e:
-        print(f"Error initiating payment: {str(e)}")
+        log.exception('payment_initiation_failed')
         return jsonify({
             'success': False,
             'error': f'Payment initiation failed: {str(e)}'
@@ -101,8 +127,8 @@ def verify_payment(transaction_id):
         transaction = payment_transactions[transaction_id]
         order_id = transaction['order_id']
         
-        print(f"Verifying payment for transaction: {transaction_id}, order: {order_id}")
-        
+        tag(order_id=order_id, transaction_id=transaction_id)
+
         # For demo purposes, simulate payment verification
         # In production, this would call the actual MTN MOMO verification API
         import time
@@ -116,20 +142,21 @@ def verify_payment(transaction_id):
                 'status': 'SUCCESSFUL',
                 'message': 'Payment completed successfully'
             }
-            transaction['status'] = 'completed'
+            status = 'completed'
         else:
             verification_result = {
                 'success': False,
                 'status': 'PENDING',
                 'message': 'Payment still pending'
             }
-            transaction['status'] = 'pending'
+            status = 'pending'
         
-        print(f"Verification result: {verification_result}")
+        log.info('gateway_response', sample=0.1, operation='requesttopay_status',
+                 result=verification_result)
         
         # Update transaction status
-        transaction['verification_result'] = verification_result
-        transaction['last_verified'] = datetime.now().isoformat()
+        payment_transactions.set_status(transaction, status, verification_result=verification_result,
+                                        last_verified=datetime.now().isoformat())
         
         if verification_result['success']:
             return jsonify({
@@ -147,12 +174,26 @@ def verify_payment(transaction_id):
             })
             
     except Exception as e:
-        print(f"Error verifying payment: {str(e)}")
+        log.exception('payment_verification_failed')
         return jsonify({
             'success': False,
             'error': f'Payment verification failed: {str(e)}'
         }), 500
 
+@app.route('/api/payment/status', methods=['GET', 'POST'])
+def get_payment_statuses():
+    """Payment status of many orders at once (order history pages)
+
+    Query: order_ids=a,b,c, or POST {"order_ids": [...]}; at most 100
+    """
+    try:
+        return bulk_status_response(payment_transactions, request)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
+
 @app.route('/api/payment/status/<order_id>', methods=['GET'])
 def get_payment_status(order_id):
     """Get payment status by order ID"""
@@ -176,7 +217,7 @@ def get_payment_status(order_id):
         })
         
     except Exception as e:
-        print(f"Error getting payment status: {str(e)}")
+        log.exception('payment_status_failed')
         return jsonify({
             'success': False,
             'error': f'Failed to get payment status: {str(e)}'
@@ -184,22 +225,21 @@ def get_payment_status(order_id):
 
 @app.route('/api/payment/transactions', methods=['GET'])
 def get_all_transactions():
-    """Get all payment transactions (for admin/debugging)"""
+    """Get payment transactions a page at a time (for admin/debugging)
+
+    Query: limit, cursor (next_cursor of the previous page), order=asc|desc,
+    status, from/to (ISO dates), min_amount/max_amount, fields (comma separated)
+    """
     try:
-        # Filter out duplicate entries (we store by both transaction_id and order_id)
-        unique_transactions = {}
-        for key, transaction in payment_transactions.items():
-            if 'transaction_id' in transaction:
-                unique_transactions[transaction['transaction_id']] = transaction
+        return stream_listing(payment_transactions, request.args)
         
+    except ValueError as e:
         return jsonify({
-            'success': True,
-            'transactions': list(unique_transactions.values()),
-            'count': len(unique_transactions)
-        })
-        
+            'success': False,
+            'error': f'Invalid query: {str(e)}'
+        }), 400
     except Exception as e:
-        print(f"Error getting transactions: {str(e)}")
+        log.exception('list_transactions_failed')
         return jsonify({
             'success': False,
             'error': f'Failed to get transactions: {str(e)}'
@@ -215,4 +255,5 @@ if __name__ == '__main__':
     print("🛑 Press Ctrl+C to stop the server")
     print("=" * 60)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    from serve import run_server
+    run_server('simple_payment_server', app)
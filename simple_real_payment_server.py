@@ -9,12 +9,24 @@ from flask_cors import CORS
 import requests
 import json
 import uuid
-from datetime import datetime
-import traceback
+import time
 import base64
+import threading
+from datetime import datetime
+from fast_json import dumps_bytes, install_json
+from http_cache import install_compression
+from payment_tracing import install_tracing, span, tag
+from gateway_guard import GATEWAY_TIMEOUT, GatewayUnavailable, gateway_call, unavailable_response
+from server_logging import get_logger
+from payment_store import IdempotencyConflict, TransactionStore, idempotency_key, replay_payload
+
+log = get_logger('payments')
 
 app = Flask(__name__)
 CORS(app)
+install_json(app)
+install_compression(app)
+install_tracing(app)
 
 # MTN MOMO Configuration
 class MTNMomoConfig:
@@ -28,33 +40,46 @@ class MTNMomoConfig:
     # Generate API user for sandbox
     collections_apiuser = str(uuid.uuid4())
 
+    # Built once: the basic auth string and the header templates of each call
+    basic_auth = 'Basic ' + base64.b64encode(f'{collections_apiuser}:'.encode()).decode()
+    token_headers = {'Ocp-Apim-Subscription-Key': collections_subkey, 'Authorization': basic_auth}
+    api_headers = {'Ocp-Apim-Subscription-Key': collections_subkey, 'X-Target-Environment': environment_mode}
+    json_headers = {**api_headers, 'Content-Type': 'application/json'}
+
 # In-memory storage for payment transactions
-payment_transactions = {}
+payment_transactions = TransactionStore('simple_real_payment_server')
+
+# Access token cache: MoMo tokens last an hour, refreshed a minute early
+_token = {'response': None, 'expires_at': 0.0}
+_token_lock = threading.Lock()
 
 def get_momo_token():
-    """Get MTN MOMO access token"""
+    """Get MTN MOMO access token (cached until shortly before it expires)"""
+    if _token['response'] and time.monotonic() < _token['expires_at']:
+        return _token['response']
     try:
-        url = f"{MTNMomoConfig.accurl}/collection/token/"
-        
-        # Create basic auth
-        auth_string = f"{MTNMomoConfig.collections_apiuser}:"
-        encoded_auth = base64.b64encode(auth_string.encode()).decode()
-        
-        headers = {
-            'Ocp-Apim-Subscription-Key': MTNMomoConfig.collections_subkey,
-            'Authorization': f'Basic {encoded_auth}',
-        }
-        
-        response = requests.post(url, headers=headers)
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Token request failed: {response.status_code} - {response.text}")
-            return None
+        with _token_lock:
+            if _token['response'] and time.monotonic() < _token['expires_at']:
+                return _token['response']
+            url = f"{MTNMomoConfig.accurl}/collection/token/"
+            
+            with gateway_call('collection_token', span_name='token_fetch', quota_key=MTNMomoConfig.collections_subkey) as token_span:
+                response = requests.post(url, headers=MTNMomoConfig.token_headers, timeout=GATEWAY_TIMEOUT)
+                token_span.status = response.status_code
+            
+            if response.status_code == 200:
+                token_response = response.json()
+                _token['response'] = token_response
+                _token['expires_at'] = time.monotonic() + max(0, int(token_response.get('expires_in', 3600)) - 60)
+                return token_response
+            else:
+                log.warning('token_request_failed', status=response.status_code, body=response.text)
+                return None
             
+    except GatewayUnavailable:
+        raise
     except Exception as e:
-        print(f"Error getting token: {e}")
+        log.exception('token_request_error')
         return None
 
 def initiate_momo_payment(amount, currency, txt_ref, phone_number, payer_message):
@@ -69,6 +94,7 @@ def initiate_momo_payment(amount, currency, txt_ref, phone_number, payer_message
         
         # Generate UUID for the request
         reference_id = str(uuid.uuid4())
+        tag(reference_id=reference_id)
         
         url = f"{MTNMomoConfig.accurl}/collection/v1_0/requesttopay"
         
@@ -84,15 +110,15 @@ def initiate_momo_payment(amount, currency, txt_ref, phone_number, payer_message
             "payeeNote": payer_message
         }
         
-        headers = {
-            'X-Reference-Id': reference_id,
-            'X-Target-Environment': MTNMomoConfig.environment_mode,
-            'Ocp-Apim-Subscription-Key': MTNMomoConfig.collections_subkey,
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        }
+        headers = MTNMomoConfig.json_headers.copy()
+        headers['X-Reference-Id'] = reference_id
+        headers['Authorization'] = 'Bearer ' + access_token
         
-        response = requests.post(url, headers=headers, json=payload)
+        with gateway_call('requesttopay', quota_key=MTNMomoConfig.collections_subkey) as gateway_span:
+            response = requests.post(url, headers=headers, data=dumps_bytes(payload), timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
+        if response.status_code == 401:
+            _token['response'] = None  # revoked or expired early
         
         return {
             'success': response.status_code == 202,
@@ -101,6 +127,8 @@ def initiate_momo_payment(amount, currency, txt_ref, phone_number, payer_message
             'status_text': response.text if response.status_code != 202 else 'Payment initiated'
         }
         
+    except GatewayUnavailable:
+        raise
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
@@ -116,19 +144,22 @@ def verify_momo_payment(reference_id):
         
         url = f"{MTNMomoConfig.accurl}/collection/v1_0/requesttopay/{reference_id}"
         
-        headers = {
-            'Ocp-Apim-Subscription-Key': MTNMomoConfig.collections_subkey,
-            'Authorization': f'Bearer {access_token}',
-            'X-Target-Environment': MTNMomoConfig.environment_mode,
-        }
+        headers = MTNMomoConfig.api_headers.copy()
+        headers['Authorization'] = 'Bearer ' + access_token
         
-        response = requests.get(url, headers=headers)
+        with gateway_call('requesttopay_status', quota_key=MTNMomoConfig.collections_subkey) as gateway_span:
+            response = requests.get(url, headers=headers, timeout=GATEWAY_TIMEOUT)
+            gateway_span.status = response.status_code
+        if response.status_code == 401:
+            _token['response'] = None  # revoked or expired early
         
         if response.status_code == 200:
             return response.json()
         else:
             return {'success': False, 'error': f'Verification failed: {response.status_code}'}
             
+    except GatewayUnavailable:
+        raise
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
@@ -168,46 +199,54 @@ def initiate_payment():
         # Create payer message
         payer_message = f'Payment for order {order_id} by {customer_name}'
         
-        # Generate unique transaction ID
-        transaction_id = str(uuid.uuid4())
-        
-        print(f'🚀 Initiating MTN MOMO payment:')
-        print(f'   Amount: {amount} {currency}')
-        print(f'   Phone: {phone_number}')
-        print(f'   Order ID: {order_id}')
-        print(f'   Customer: {customer_name}')
-        print(f'   Transaction ID: {transaction_id}')
-        
-        # Call MTN MOMO API
-        payment_result = initiate_momo_payment(
-            amount=amount,
-            currency=currency,
-            txt_ref=transaction_id,
-            phone_number=phone_number,
-            payer_message=payer_message
-        )
-        
-        print(f'📱 MTN MOMO API Response: {payment_result}')
-        
-        # Store transaction details
-        transaction_data = {
-            'transaction_id': transaction_id,
-            'order_id': order_id,
-            'amount': amount,
-            'currency': currency,
-            'phone_number': phone_number,
-            'customer_name': customer_name,
-            'customer_email': data.get('customer_email', ''),
-            'payer_message': payer_message,
-            'payment_result': payment_result,
-            'status': 'initiated',
-            'created_at': datetime.now().isoformat(),
-            'last_verified': None
-        }
+        # Retried checkouts (double click, network retry) reuse the first transaction
+        key = idempotency_key(request, order_id)
+        with payment_transactions.idempotent(key, order_id=order_id, amount=amount,
+                                             phone_number=phone_number) as existing:
+            if existing is not None:
+                tag(order_id=order_id, transaction_id=existing['transaction_id'])
+                log.info('payment_replayed', idempotency_key=key, status=existing['status'])
+                return jsonify(replay_payload(existing))
+
+            # Generate unique transaction ID
+            transaction_id = str(uuid.uuid4())
+            tag(order_id=order_id, transaction_id=transaction_id)
+        
+            log.info('payment_initiating', amount=amount, currency=currency,
+                     phone_number=phone_number, customer_name=customer_name)
+        
+            # Call MTN MOMO API
+            with span('initiate', operation='requesttopay'):
+                payment_result = initiate_momo_payment(
+                    amount=amount,
+                    currency=currency,
+                    txt_ref=transaction_id,
+                    phone_number=phone_number,
+                    payer_message=payer_message
+                )
+        
+            log.info('gateway_response', operation='requesttopay', result=payment_result)
+        
+            # Store transaction details; rejected attempts may be retried
+            accepted = bool(isinstance(payment_result, dict) and payment_result.get('response') == 202)
+            transaction_data = {
+                'transaction_id': transaction_id,
+                'order_id': order_id,
+                'amount': amount,
+                'currency': currency,
+                'phone_number': phone_number,
+                'customer_name': customer_name,
+                'customer_email': data.get('customer_email', ''),
+                'payer_message': payer_message,
+                'payment_result': payment_result,
+                'status': 'initiated' if accepted else 'failed',
+                'created_at': datetime.now().isoformat(),
+                'last_verified': None
+            }
         
-        # Store by both transaction_id and order_id for easy lookup
-        payment_transactions[transaction_id] = transaction_data
-        payment_transactions[order_id] = transaction_data
+            # One record, indexed by transaction_id, order_id and idempotency key
+            with span('store_write'):
+                payment_transactions.add(transaction_data, key)
         
         # Check if payment initiation was successful
         if payment_result.get('success'):
@@ -226,14 +265,21 @@ def initiate_payment():
                 'details': payment_result
             }), 400
             
+    except IdempotencyConflict as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 409
     except ValueError as e:
         return jsonify({
             'success': False,
             'error': f'Invalid data format: {str(e)}'
         }), 400
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f'❌ Payment initiation error: {str(e)}')
-        print(f'❌ Traceback: {traceback.format_exc()}')
+        log.exception('payment_initiation_failed')
         return jsonify({
             'success': False,
             'error': f'Payment initiation failed: {str(e)}'
@@ -255,24 +301,26 @@ def verify_payment(transaction_id):
         # Get the reference ID from the original payment result
         reference_id = transaction['payment_result'].get('ref', transaction_id)
         
-        print(f'🔍 Verifying payment for transaction: {transaction_id}')
-        print(f'🔍 Using reference ID: {reference_id}')
-        
         # Call MTN MOMO verification API
-        verification_result = verify_momo_payment(reference_id)
+        tag(transaction_id=transaction_id, reference_id=reference_id)
+        with span('verify', operation='requesttopay_status'):
+            verification_result = verify_momo_payment(reference_id)
         
-        print(f'📋 Verification result: {verification_result}')
+        # Clients poll verify every few seconds; keep a sample of the results
+        log.info('gateway_response', sample=0.1, operation='requesttopay_status',
+                 result=verification_result)
         
         # Update transaction with verification result
-        transaction['verification_result'] = verification_result
-        transaction['last_verified'] = datetime.now().isoformat()
+        with span('store_write'):
+            transaction['verification_result'] = verification_result
+            transaction['last_verified'] = datetime.now().isoformat()
         
         # Parse verification result
         if verification_result and not verification_result.get('error'):
             status = verification_result.get('status', '').upper()
             
             if status == 'SUCCESSFUL':
-                transaction['status'] = 'completed'
+                payment_transactions.set_status(transaction, 'completed')
                 return jsonify({
                     'success': True,
                     'status': 'completed',
@@ -281,7 +329,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
             elif status == 'FAILED':
-                transaction['status'] = 'failed'
+                payment_transactions.set_status(transaction, 'failed')
                 return jsonify({
                     'success': False,
                     'status': 'failed',
@@ -290,7 +338,7 @@ def verify_payment(transaction_id):
                     'verification_result': verification_result
                 })
             elif status == 'PENDING':
-                transaction['status'] = 'pending'
+                payment_transactions.set_status(transaction, 'pending')
                 return jsonify({
                     'success': False,
                     'status': 'pending',
@@ -300,7 +348,7 @@ def verify_payment(transaction_id):
                 })
             else:
                 # Unknown status, treat as pending
-                transaction['status'] = 'pending'
+                payment_transactions.set_status(transaction, 'pending')
                 return jsonify({
                     'success': False,
                     'status': 'pending',
@@ -310,7 +358,7 @@ def verify_payment(transaction_id):
                 })
         else:
             # Error in verification or no valid result
-            transaction['status'] = 'pending'
+            payment_transactions.set_status(transaction, 'pending')
             return jsonify({
                 'success': False,
                 'status': 'pending',
@@ -319,9 +367,11 @@ def verify_payment(transaction_id):
                 'verification_result': verification_result
             })
             
+    except GatewayUnavailable as e:
+        log.warning('gateway_unavailable', operation=e.operation, reason=e.reason)
+        return unavailable_response(e)
     except Exception as e:
-        print(f'❌ Payment verification error: {str(e)}')
-        print(f'❌ Traceback: {traceback.format_exc()}')
+        log.exception('payment_verification_failed')
         return jsonify({
             'success': False,
             'error': f'Payment verification failed: {str(e)}'
@@ -337,4 +387,5 @@ if __name__ == '__main__':
     print('🔄 CORS enabled for React frontend')
     print('=' * 50)
     
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    from serve import run_server
+    run_server('simple_real_payment_server', app)